@@ -0,0 +1,126 @@
+import time
+import cv2
+import numpy as np
+
+
+class MarkerDetector():
+
+    '''
+    ArUco marker detection for the scene camera. The dictionary and
+    detector parameters are built once, and per-frame cost is kept low by:
+    - detecting only in a window around the markers found in the last
+      frame, with a full-frame rescan every 'rescan' frames (or as soon
+      as the window loses the markers)
+    - optionally running full-frame scans on an image downscaled by
+      'scale' first, refining the result at full resolution in a window
+      around what was found
+    It also keeps detection timing statistics (see summary).
+    '''
+
+    def __init__(self, dictionary=cv2.aruco.DICT_4X4_50, scale=1.0,
+                 rescan=30, margin=0.5):
+        self.dictionary = cv2.aruco.getPredefinedDictionary(dictionary)
+        self.detector = None
+        if hasattr(cv2.aruco, 'ArucoDetector'):
+            params = cv2.aruco.DetectorParameters()
+            self.detector = cv2.aruco.ArucoDetector(self.dictionary, params)
+        else:
+            self.params = cv2.aruco.DetectorParameters_create()
+        self.scale = scale
+        self.rescan = rescan
+        self.margin = margin
+        self.window = None
+        self.since_rescan = 0
+        self.since_full = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.roi_frames = 0
+        self.roi_hits = 0
+        self.full_frames = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    def _detect(self, img):
+        if self.detector is not None:
+            corners, ids, _ = self.detector.detectMarkers(img)
+        else:
+            corners, ids, _ = cv2.aruco.detectMarkers(img, self.dictionary,
+                                                      parameters=self.params)
+        return corners, ids
+
+    def _detect_window(self, img, window):
+        x0, y0, x1, y1 = window
+        corners, ids = self._detect(img[y0:y1, x0:x1])
+        if ids is None:
+            return corners, ids
+        offset = np.array([x0, y0], np.float32)
+        return [c + offset for c in corners], ids
+
+    def _get_window(self, corners, width, height):
+        points = np.concatenate([c.reshape(-1,2) for c in corners])
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        mx = (x1 - x0) * self.margin + 8
+        my = (y1 - y0) * self.margin + 8
+        return (max(int(x0 - mx), 0), max(int(y0 - my), 0),
+                min(int(x1 + mx) + 1, width), min(int(y1 + my) + 1, height))
+
+    def _full_scan(self, img):
+        height, width = img.shape[:2]
+        self.since_rescan = 0
+        if self.scale < 1.0:
+            small = cv2.resize(img, None, fx=self.scale, fy=self.scale,
+                               interpolation=cv2.INTER_AREA)
+            corners, ids = self._detect(small)
+            if ids is not None:
+                corners = [c / self.scale for c in corners]
+                window = self._get_window(corners, width, height)
+                refined, refined_ids = self._detect_window(img, window)
+                if refined_ids is not None:
+                    return refined, refined_ids
+                return corners, ids
+            # nothing found downscaled: full resolution only once in a while
+            self.since_full += 1
+            if self.since_full < self.rescan:
+                return [], None
+        self.since_full = 0
+        return self._detect(img)
+
+    def detect(self, img):
+        '''
+        Returns marker corners (in full image coordinates) and ids
+        '''
+        start = time.perf_counter()
+        height, width = img.shape[:2]
+        corners, ids = [], None
+        if self.window is not None and self.since_rescan < self.rescan:
+            corners, ids = self._detect_window(img, self.window)
+            self.since_rescan += 1
+            self.roi_frames += 1
+            self.roi_hits += int(ids is not None)
+        if ids is None:
+            corners, ids = self._full_scan(img)
+            self.full_frames += 1
+        self.window = None
+        if ids is not None:
+            self.window = self._get_window(corners, width, height)
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.last_time = elapsed
+        return corners, ids
+
+    def summary(self):
+        if self.frames == 0:
+            return {'frames': 0}
+        mean = self.total_time / self.frames
+        return {'frames': self.frames,
+                'mean_ms': mean * 1000,
+                'max_ms': self.max_time * 1000,
+                'max_hz': 1.0 / mean if mean > 0 else 0.0,
+                'roi_rate': self.roi_frames / self.frames,
+                'roi_hit_rate': self.roi_hits / max(self.roi_frames, 1),
+                'full_frames': self.full_frames}
@@ -0,0 +1,245 @@
+'''
+Parallel batch reprocessing of eye/scene recordings (pupil detection
+and ArUco target extraction), spread over a process pool. Every worker
+keeps its own pupil detectors for all the videos it processes.
+
+Inputs are a directory (searched recursively for videos) or a manifest
+file with one recording per line, either "<path>" or "<kind>,<path>"
+(kind: eye or scene; lines starting with # are ignored). When not
+given, the kind is guessed from the file name ("eye" or "scene" in
+it); videos whose name contains neither need an explicit kind (--kind
+or the manifest).
+
+Results go to <output dir>/<video folder>/<video name>_<kind>.csv,
+<video folder> being the folder of the video relative to the source
+directory (or manifest), so recordings with the same name in different
+folders do not share a results file. Runs are resumable:
+videos whose results file exists are skipped (results are written to
+a .part file first and only renamed once complete). A video that
+fails, or yields no frame, is reported and gets no results file, so
+it is retried on the next run.
+
+usage (from the src folder):
+    python3 batch.py <dir|manifest> [-o output_dir] [-j workers] [--3d]
+'''
+import argparse
+import os
+import sys
+import time
+import cv2
+from multiprocessing import Pool, cpu_count
+import offline
+
+VIDEO_EXTENSIONS = ('.avi', '.mkv', '.mpeg', '.mp4', '.mov')
+
+_detectors = None
+
+
+def guess_kind(path):
+    '''
+    Kind of a video from its file name, None if it cannot tell
+    '''
+    name = os.path.basename(path).lower()
+    if 'scene' in name:
+        return 'scene'
+    if 'eye' in name:
+        return 'eye'
+    return None
+
+
+def find_videos(root):
+    videos = []
+    for folder, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                videos.append(os.path.join(folder, name))
+    return sorted(videos)
+
+
+def read_manifest(filename, kind=None):
+    jobs = []
+    base = os.path.dirname(os.path.abspath(filename))
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [v.strip() for v in line.split(',')]
+            path = fields[-1]
+            if not os.path.isabs(path):
+                path = os.path.join(base, path)
+            job_kind = fields[0] if len(fields) > 1 else kind
+            jobs.append((job_kind or guess_kind(path), path))
+    return jobs
+
+
+def output_path(output_dir, base, video, kind):
+    '''
+    Results file of a video, mirroring its folder relative to 'base'
+    (videos outside of it keep their whole absolute folder)
+    '''
+    video = os.path.abspath(video)
+    folder = os.path.relpath(os.path.dirname(video), base)
+    if folder == os.curdir:
+        folder = ''
+    elif folder == os.pardir or folder.startswith(os.pardir + os.sep):
+        folder = os.path.splitdrive(os.path.dirname(video))[1]
+        folder = folder.lstrip(os.sep)
+    name = os.path.splitext(os.path.basename(video))[0]
+    return os.path.join(output_dir, folder, "{}_{}.csv".format(name, kind))
+
+
+def create_jobs(source, output_dir, kind=None, mode_3D=False, 
+                roi=False, mono=False):
+    '''
+    Raises ValueError if the kind of a video is unknown or if two
+    videos would write the same results file
+    '''
+    if os.path.isdir(source):
+        base = os.path.abspath(source)
+        videos = [(kind or guess_kind(v), v) for v in find_videos(source)]
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        videos = read_manifest(source, kind)
+    unknown = [v for k, v in videos if k not in ('eye', 'scene')]
+    if unknown:
+        raise ValueError("unknown video kind (use --kind or a manifest "
+                         "'<kind>,<path>' line): {}".format(', '.join(unknown)))
+    jobs, outputs = [], {}
+    for video_kind, video in videos:
+        output = output_path(output_dir, base, video, video_kind)
+        if output in outputs:
+            raise ValueError("{} and {} would both write {}".format(
+                outputs[output], video, output))
+        outputs[output] = video
+        jobs.append({'kind': video_kind, 'video': video, 'output': output,
+                     'mode_3D': mode_3D, 'roi': roi, 'mono': mono})
+    return jobs
+
+
+def _init_worker():
+    # one process per core already: keep OpenCV single-threaded
+    cv2.setNumThreads(1)
+
+
+def run_job(job):
+    '''
+    Processes a single video in a pool worker. Any error (unreadable
+    video, processing failure, no frame decoded) fails this job only,
+    and leaves no results file behind, so it is retried on resume.
+    '''
+    global _detectors
+    partial = job['output'] + '.part'
+    try:
+        processor = offline.create_processor(job['kind'], job['video'],
+                                             job['mono'], job['roi'])
+        if job['kind'] == 'eye' and _detectors is not None:
+            processor.set_detectors(_detectors)
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        summary = processor.run_offline(partial, job['mode_3D'])
+        if job['kind'] == 'eye':
+            _detectors = processor.get_detectors()
+        if summary['frames'] == 0:
+            raise ValueError("no frames decoded")
+        os.replace(partial, job['output'])
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return job, None, str(e)
+    summary['pid'] = os.getpid()
+    return job, summary, None
+
+
+class BatchReport():
+
+    '''
+    Aggregate throughput of a batch run. Scaling is the ratio between
+    the summed per-video processing time and the wall-clock time, i.e.,
+    the speedup over processing every video sequentially.
+    '''
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.start = time.monotonic()
+        self.frames = 0
+        self.busy = 0.0
+        self.done, self.failed = 0, 0
+
+    def add(self, summary):
+        self.done += 1
+        self.frames += summary['frames']
+        self.busy += summary['seconds']
+
+    def summary(self):
+        wall = time.monotonic() - self.start
+        scaling = self.busy / wall if wall > 0 else 0.0
+        return {'videos': self.done,
+                'failed': self.failed,
+                'frames': self.frames,
+                'seconds': wall,
+                'fps': self.frames / wall if wall > 0 else 0.0,
+                'fps_per_worker': self.frames / self.busy if self.busy else 0.0,
+                'scaling': scaling,
+                'efficiency': scaling / self.workers}
+
+
+def run_batch(jobs, workers, log=None):
+    report = BatchReport(workers)
+    pending = [j for j in jobs if not os.path.exists(j['output'])]
+    print("{} videos, {} already processed, {} workers".format(
+        len(jobs), len(jobs) - len(pending), workers))
+    if not pending:
+        return report.summary()
+    with Pool(workers, initializer=_init_worker) as pool:
+        for job, summary, error in pool.imap_unordered(run_job, pending):
+            if error is not None:
+                report.failed += 1
+                print("failed: {} ({})".format(job['video'], error))
+                continue
+            report.add(summary)
+            print("[{}/{}] {}: {:.1f} fps".format(
+                report.done, len(pending), job['video'], summary['fps']))
+            if log is not None:
+                log.write("{},{},{},{:.3f},{:.2f},{}\n".format(
+                    job['video'], job['kind'], summary['frames'], 
+                    summary['seconds'], summary['fps'], summary['pid']))
+                log.flush()
+    return report.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='batch video reprocessing')
+    parser.add_argument('source', help='directory of videos or manifest')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='results folder (default: next to the source)')
+    parser.add_argument('-j', '--workers', type=int, default=cpu_count())
+    parser.add_argument('--kind', choices=['eye', 'scene'], default=None)
+    parser.add_argument('--3d', dest='mode_3D', action='store_true')
+    parser.add_argument('--roi', action='store_true')
+    parser.add_argument('--mono', action='store_true')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
+    if output_dir is None:
+        output_dir = args.source
+        if not os.path.isdir(output_dir):
+            output_dir = os.path.dirname(os.path.abspath(args.source))
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        jobs = create_jobs(args.source, output_dir, args.kind, args.mode_3D,
+                           args.roi, args.mono)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    with open(os.path.join(output_dir, 'batch_log.csv'), 'a') as log:
+        summary = run_batch(jobs, max(args.workers, 1), log)
+    print("batch: {videos} videos ({failed} failed), {frames} frames in "
+          "{seconds:.1f}s -> {fps:.1f} fps ({fps_per_worker:.1f} fps per "
+          "worker), scaling {scaling:.2f}x, efficiency {efficiency:.0%}"
+          .format(**summary))
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
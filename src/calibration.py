@@ -3,9 +3,11 @@ import numpy as np
 import time
 import os
 import data_storage as ds
+import gaze_mapping as gm
+import calibration_search as cs
+from latency import lap, now
+from sample_sync import SampleCollector
 from PySide2.QtCore import QObject, Signal, Slot, Property
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process import kernels
 from threading import Thread
 
 
@@ -23,6 +25,7 @@ class Calibrator(QObject):
     enable_estimation = Signal()
     draw_estimation = Signal('QVariantList', 'QVariantList', 'QVariantList',
                              'QString', 'QString')
+    gaze_updated = Signal('QVariantList')
                             
 
     def __init__(self, v_targets, h_targets, samples_per_tgt, timeout):
@@ -35,6 +38,7 @@ class Calibrator(QObject):
         self.storer = ds.Storer(self.target_list)
         self.l_regressor, self.l_regressor_3D = None, None
         self.r_regressor, self.r_regressor_3D = None, None
+        self.fast_2D, self.fast_3D = None, None
         self.current_target = -1
         self.scene, self.leye, self.reye = None, None, None
         self.samples = samples_per_tgt
@@ -43,6 +47,12 @@ class Calibrator(QObject):
         self.mode_3D = False
         self.storage = False
         self.estimation = {}
+        self.mapping = 'gp'
+        self.mapping_params = {}
+        self.search_budget = 0.0  # --> seconds; 0 disables the search
+        self.search_folds = None  # --> None: leave-one-target-out
+        self.test_samples = None
+        self.latest_gaze = [-1,-1,-1,-1]
 
 
     def set_sources(self, scene, leye, reye):
@@ -65,24 +75,25 @@ class Calibrator(QObject):
 
     def _get_target_data(self, maxfreq, minfreq):
         '''
-        scene: sceneCamera object
-        le: left eyeCamera object
-        re: right eyeCamera object
-        thresh: amount of data to be collected per target
+        Collects samples_per_tgt synchronized samples for the current
+        target, as fast as the eye cameras deliver them. Scene and eye
+        samples are joined by capture timestamp, within 1/minfreq.
         '''
         idx = self.current_target
         t = time.time()
-        tgt = self.storer.targets
-
-        while (len(tgt[idx]) < self.samples) and (time.time()-t < self.timeout):
-            self.storer.collect_data(idx, self.mode_3D, minfreq)
-            tgt = self.storer.targets
-            time.sleep(1/maxfreq)
+        collector = SampleCollector(self.scene, self.leye, self.reye, 1/minfreq)
+        while (self.storer.count(idx) < self.samples) and \
+              (time.time()-t < self.timeout):
+            for sc, le, re in collector.poll():
+                if self.storer.count(idx) < self.samples:
+                    self.storer.add_sample(idx, sc, le, re)
         self.move_on.emit()
         print("number of samples collected: t->{}, l->{}, r->{}".format(
-            len(self.storer.targets[idx]), 
-            len(self.storer.l_centers[idx]),
-            len(self.storer.r_centers[idx])))
+            self.storer.count(idx),
+            self.storer.count(idx, 'left'),
+            self.storer.count(idx, 'right')))
+        print("sample synchronization:", collector.summary())
+        collector.close()
 
     
     @Property('QVariantList')
@@ -97,10 +108,14 @@ class Calibrator(QObject):
     def start_calibration(self):
         print('reseting calibration')
         self.storer.initialize_storage(len(self.target_list))
+        if self.storage:
+            self.storer.start_frame_archive()
         self.l_regressor = None
         self.r_regressor = None
         self.l_regressor_3D = None
         self.r_regressor_3D = None
+        self.fast_2D, self.fast_3D = None, None
+        self.latest_gaze = [-1,-1,-1,-1]
         self.current_target = -1
 
     @Slot()
@@ -120,26 +135,103 @@ class Calibrator(QObject):
         Finds a gaze estimation function to be used for 
         future predictions. Based on Gaussian Processes regression.
         '''
-        clf_l = self._get_clf()
-        clf_r = self._get_clf()     
+        self.storer.stop_frame_archive()
+        if self.search_budget > 0 and self.mapping in ('gp', 'sgp'):
+            if self._search_estimation():
+                return
         st, sl, sr = self.storer.get_random_test_samples(
             self.samples, len(self.target_list))                             
-        targets = self.storer.get_targets_list()
-        if self.leye.is_cam_active():                                       
-            l_centers = self.storer.get_l_centers_list(self.mode_3D)
-            clf_l.fit(l_centers, targets)
-            self._set_regressor('left', clf_l)
-        if self.reye.is_cam_active():
-            r_centers = self.storer.get_r_centers_list(self.mode_3D)
-            clf_r.fit(r_centers, targets)
-            self._set_regressor('right', clf_r)
-        print("Gaze estimation finished")
+        self.test_samples = st, sl, sr
+        self._fit(self.leye.is_cam_active(), self.reye.is_cam_active())
+        print("Gaze estimation finished ({})".format(self.mapping))
         self._test_calibration(st, sl, sr)
         print('Estimation assessment ready')
         self.enable_estimation.emit()
         if self.storage:
-            self.storer.store_calibration()
+            self.storer.store_calibration(self.mapping, self.mapping_params)
         
+    def _search_estimation(self):
+        '''
+        Picks the kernel hyperparameters of every eye by cross-validation
+        (see calibration_search), fits them on all samples and assesses
+        the calibration with the out-of-fold predictions. Returns False,
+        before fitting anything, if an eye could not be assessed (the
+        held-out assessment is used instead).
+        '''
+        left, right = self.leye.is_cam_active(), self.reye.is_cam_active()
+        targets, groups = self.storer.get_cv_data()
+        data = {}
+        if left:
+            data['left'] = (self.storer.get_l_centers_list(self.mode_3D),
+                            targets, groups)
+        if right:
+            data['right'] = (self.storer.get_r_centers_list(self.mode_3D),
+                             targets, groups)
+        best, stats = cs.search(data, self.mapping, k=self.search_folds,
+                                budget=self.search_budget)
+        print("hyperparameter search:", stats)
+        self.mapping_params = {}
+        if None in best.values():
+            print("hyperparameter search incomplete, using default parameters")
+            return False
+        for eye, result in best.items():
+            if result is not None:
+                self.mapping_params[eye] = cs.mapper_params(self.mapping,
+                                                            result[0])
+                print("{} eye: {} (cv error {:.3f}%)".format(
+                    eye, result[0], result[1] * 100))
+        self._fit(left, right)
+        print("Gaze estimation finished ({})".format(self.mapping))
+        self.test_samples = None
+        tgt_mean, le_mean, re_mean = [], [], []
+        le_error, re_error = [], []
+        if best.get('left') is not None:
+            tgt_mean, le_mean, le_error = best['left'][2]
+        if best.get('right') is not None:
+            tgt_mean, re_mean, re_error = best['right'][2]
+        tgt_mean, le_mean, re_mean = [np.asarray(m).tolist() for m in
+                                      (tgt_mean, le_mean, re_mean)]
+        self._set_estimation(tgt_mean, le_mean, re_mean, le_error, re_error)
+        print('Estimation assessment ready')
+        self.enable_estimation.emit()
+        if self.storage:
+            self.storer.store_calibration(self.mapping, self.mapping_params)
+        return True
+
+    def _fit(self, left, right):
+        clf_l = self._get_clf('left')
+        clf_r = self._get_clf('right')
+        targets = self.storer.get_targets_list()
+        ids = self.storer.get_target_ids()
+        if left:
+            l_centers = self.storer.get_l_centers_list(self.mode_3D)
+            clf_l.fit(l_centers, targets, ids)
+            self._set_regressor('left', clf_l)
+        if right:
+            r_centers = self.storer.get_r_centers_list(self.mode_3D)
+            clf_r.fit(r_centers, targets, ids)
+            self._set_regressor('right', clf_r)
+        self._build_fast_predictors()
+
+    def _build_fast_predictors(self):
+        self.fast_2D = gm.pair_predictor([self.l_regressor, self.r_regressor])
+        self.fast_3D = gm.pair_predictor([self.l_regressor_3D,
+                                          self.r_regressor_3D])
+
+    def load_calibration(self, path):
+        '''
+        Fits gaze estimation on calibration data stored in a previous
+        session (see Storer.store_calibration)
+        '''
+        self.storer.load_calibration(path)
+        if self.storer.mapping is not None:
+            self.mapping = self.storer.mapping
+        self.mapping_params = self.storer.mapping_params
+        left = len(self.storer.get_l_centers_list(True)) > 0
+        right = len(self.storer.get_r_centers_list(True)) > 0
+        self._fit(left, right)
+        print("Gaze estimation loaded from", path)
+
     def _set_regressor(self, eye, clf):
         if eye == 'left':
             if self.mode_3D:
@@ -152,23 +244,65 @@ class Calibrator(QObject):
             else:
                 self.r_regressor = clf
 
-    @Property('QVariantList')
+    @Property('QVariantList', notify=gaze_updated)
     def predict(self):
+        '''
+        Latest gaze prediction (see GazeWorker); no regression
+        runs when it is read
+        '''
+        return self.latest_gaze
+
+    def get_predictor(self):
+        if self.mode_3D:
+            return self.fast_3D
+        return self.fast_2D
+
+    def update_prediction(self, samples=None):
+        '''
+        Maps the given eye samples (or the latest ones), caches the
+        result, stores it with the session and signals listeners
+        '''
+        if samples is None:
+            samples = self._latest_samples()
         data, pred = [], []
         if self.mode_3D:
-            data, pred = self._predict3d()
+            data, pred = self._predict3d(samples)
             if self.storage:
                 l_gz, r_gz   = pred[:2], pred[2:]
                 l_raw, r_raw = data[:3], data[3:]
-                self.storer.append_session_data(l_gz, r_gz, l_raw, r_raw)
+                self._store_sample(l_gz, r_gz, l_raw, r_raw, samples)
         else:
-            data, pred = self._predict2d()
+            data, pred = self._predict2d(samples)
             if self.storage:
                 l_gz, r_gz   = pred[:2], pred[2:]
                 l_raw, r_raw = data[:2], data[2:]
-                self.storer.append_session_data(l_gz, r_gz, l_raw, r_raw)
+                self._store_sample(l_gz, r_gz, l_raw, r_raw, samples)
+        self.latest_gaze = pred
+        self.gaze_updated.emit(pred)
         return pred
 
+    def _latest_samples(self):
+        samples = [None, None]
+        predictor = self.get_predictor()
+        if predictor is not None:
+            if predictor.active[0]:
+                samples[0] = self.leye.get_processed_data()
+            if predictor.active[1]:
+                samples[1] = self.reye.get_processed_data()
+        return samples
+
+    def _store_sample(self, l_gz, r_gz, l_raw, r_raw, samples):
+        timestamps, confidence = [None, None], [None, None]
+        for i, eye in enumerate((self.leye, self.reye)):
+            if samples[i] is None:
+                continue
+            timestamps[i] = samples[i][-1]
+            pupil = eye.get_pupil_data()
+            if pupil is not None and pupil.timestamp == timestamps[i]:
+                confidence[i] = pupil.confidence
+        self.storer.append_session_data(l_gz, r_gz, l_raw, r_raw,
+                                        timestamps, confidence)
+
 
     def _test_calibration(self, st, sl, sr):
         le_error, re_error = [],[]
@@ -183,8 +317,16 @@ class Calibrator(QObject):
             tgt_mean.append(tmean.tolist())
             le_mean.append(lmean.tolist())
             re_mean.append(rmean.tolist())
-        le_err_porc = np.mean(le_error) * 100
-        re_err_porc = np.mean(re_error) * 100
+        self._set_estimation(tgt_mean, le_mean, re_mean, le_error, re_error)
+
+    def _set_estimation(self, tgt_mean, le_mean, re_mean, le_error, 
+                        re_error):
+        '''
+        Per-target means of targets and predictions, and mean per-target
+        errors, as shown by show_estimation
+        '''
+        le_err_porc = np.mean(le_error) * 100 if len(le_error) else 100.0
+        re_err_porc = np.mean(re_error) * 100 if len(re_error) else 100.0
         if not np.any(le_mean):
             le_err_porc = 100.0
         if not np.any(re_mean):
@@ -194,6 +336,7 @@ class Calibrator(QObject):
         self.estimation['right_eye'] = re_mean
         self.estimation['le_error'] = "{:.3f}%".format(le_err_porc)
         self.estimation['re_error'] = "{:.3f}%".format(re_err_porc)
+        self.estimation['mapping'] = self.mapping
 
 
     @Slot()
@@ -226,46 +369,116 @@ class Calibrator(QObject):
         return le_pred, re_pred
 
 
-    def _predict2d(self):
+    def _predict2d(self, samples=None):
         data = [-1,-1,-1,-1]
         pred = [-1,-1,-1,-1]
-        if self.l_regressor:
-            le = self.leye.get_processed_data()
-            if le is not None:
-                input_data = le[:2].reshape(1,-1)
-                le_coord = self.l_regressor.predict(input_data)[0]
-                data[0], data[1] = input_data[0]
-                pred[0], pred[1] = float(le_coord[0]), float(le_coord[1])
-        if self.r_regressor:
-            re = self.reye.get_processed_data()
-            if re is not None:
-                input_data = re[:2].reshape(1,-1)
-                re_coord = self.r_regressor.predict(input_data)[0]
-                data[2], data[3] = input_data[0]
-                pred[2], pred[3] = float(re_coord[0]), float(re_coord[1])
+        le, re, coords = self._predict_samples(self.fast_2D, samples)
+        if le is not None:
+            data[0], data[1] = le[:2]
+            pred[0], pred[1] = float(coords[0,0]), float(coords[0,1])
+        if re is not None:
+            data[2], data[3] = re[:2]
+            pred[2], pred[3] = float(coords[1,0]), float(coords[1,1])
         return data, pred
 
 
-    def _predict3d(self):
+    def _predict3d(self, samples=None):
         d = [-1 for i in range(6)]
         pred = [-1,-1,-1,-1]
-        if self.l_regressor_3D:
-            le = self.leye.get_processed_data()
-            if le is not None:
-                input_data = le[:3].reshape(1,-1)
-                le_coord = self.l_regressor_3D.predict(input_data)[0]
-                d[0], d[1], d[2] = input_data[0]#, d[3], d[4], d[5] = input_data[0]
-                pred[0], pred[1] = float(le_coord[0]), float(le_coord[1])
-        if self.r_regressor_3D:
-            re = self.reye.get_processed_data()
-            if re is not None:
-                input_data = re[:3].reshape(1,-1)
-                re_coord = self.r_regressor_3D.predict(input_data)[0]
-                d[3], d[4], d[5] = input_data[0]
-                pred[2], pred[3] = float(re_coord[0]), float(re_coord[1])
+        le, re, coords = self._predict_samples(self.fast_3D, samples)
+        if le is not None:
+            d[0], d[1], d[2] = le[:3]
+            pred[0], pred[1] = float(coords[0,0]), float(coords[0,1])
+        if re is not None:
+            d[3], d[4], d[5] = re[:3]
+            pred[2], pred[3] = float(coords[1,0]), float(coords[1,1])
         return d, pred
 
 
+    def _predict_samples(self, predictor, samples=None):
+        '''
+        Maps a sample of both eyes (the latest ones, unless given)
+        in a single FastGP call
+        '''
+        if predictor is None:
+            return None, None, None
+        if samples is None:
+            samples = [None, None]
+            if predictor.active[0]:
+                samples[0] = self.leye.get_processed_data()
+            if predictor.active[1]:
+                samples[1] = self.reye.get_processed_data()
+        le = samples[0] if predictor.active[0] else None
+        re = samples[1] if predictor.active[1] else None
+        if le is None and re is None:
+            return None, None, None
+        t = now()
+        coords = predictor.predict([le, re])
+        if le is not None:
+            self._record_latency(self.leye, t, le[-1])
+        if re is not None:
+            self._record_latency(self.reye, t, re[-1])
+        return le, re, coords
+
+
+    def _record_latency(self, eye, start, capture_time):
+        '''
+        start: time when regression started
+        capture_time: capture timestamp of the eye frame the sample
+        comes from (i.e., the age of the gaze point being returned)
+        '''
+        lap(eye.latency, 'regression', start)
+        lap(eye.latency, 'output', capture_time)
+
+    @Slot(str)
+    def set_mapping(self, name):
+        '''
+        Selects the regression model of the next calibration
+        (see gaze_mapping.MAPPERS)
+        '''
+        if name not in gm.MAPPERS:
+            print("unknown gaze mapping:", name)
+            return
+        self.mapping = name
+        self.mapping_params = {}
+
+    @Slot(float)
+    def set_search_budget(self, seconds):
+        '''
+        Wall-clock budget of the hyperparameter search run by
+        perform_estimation (0 disables it)
+        '''
+        self.search_budget = max(0.0, seconds)
+
+    @Property('QVariantList')
+    def mapping_list(self):
+        return sorted(gm.MAPPERS.keys())
+
+    @Slot()
+    def compare_mappings(self):
+        '''
+        Fits every available mapping on the current calibration data
+        and reports fit time, prediction latency and the error on the
+        held-out samples of the last estimation
+        '''
+        if self.test_samples is None:
+            print("no calibration to compare mappings on")
+            return
+        st, sl, sr = self.test_samples
+        targets = self.storer.get_targets_list()
+        ids = self.storer.get_target_ids()
+        t_test = np.vstack([st[t] for t in st.keys()])
+        ndim = 3 if self.mode_3D else 2
+        for eye, X, test in (
+            ('left', self.storer.get_l_centers_list(self.mode_3D), sl),
+            ('right', self.storer.get_r_centers_list(self.mode_3D), sr)):
+            X_test = np.vstack([test[t] for t in test.keys()])[:,:ndim]
+            if len(X) == 0 or len(X_test) != len(t_test):
+                continue
+            report = gm.compare_mappers(X, targets, X_test, t_test)
+            print(">>> {} eye:".format(eye))
+            print(gm.format_report(report))
+
     @Slot()
     def toggle_3D(self):
         self.mode_3D = not self.mode_3D
@@ -279,13 +492,6 @@ class Calibrator(QObject):
         self.storer.store_session()
 
 
-    def _get_clf(self):
-        kernel = 1.5*kernels.RBF(length_scale=1.0, length_scale_bounds=(0,1.0))
-        clf = GaussianProcessRegressor(alpha=1e-5,
-                                       optimizer=None,
-                                       n_restarts_optimizer=9,
-                                       kernel = kernel)
-        return clf
-
-
-   
+    def _get_clf(self, eye=None):
+        params = self.mapping_params.get(eye, {})
+        return gm.create_mapper(self.mapping, **params)
@@ -4,9 +4,10 @@ import time
 import os
 import socket
 import data_storage as ds
+import gaze_mapping as gm
+from latency import lap, now
+from sample_sync import SampleCollector
 from PySide2.QtCore import QObject, Signal, Slot, Property
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process import kernels
 from threading import Thread
 
 
@@ -34,6 +35,7 @@ class HMDCalibrator(QObject):
         self.l_regressor = None
         self.r_regressor = None
         self.z_regressor = None
+        self.fast_gp, self.fast_z = None, None
         self.current_target = -1
         self.leye, self.reye = None, None
         self.samples = samples_per_tgt
@@ -44,7 +46,9 @@ class HMDCalibrator(QObject):
         self.vergence = None
         self.mode_3D = False
         self.storage = False
+        self.mapping = 'gp'
         self.depth_buffer = []
+        self.capture_times = [None, None]
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind(("0.0.0.0", 50021))
         self.ip, self.port = self.load_network_options()
@@ -86,38 +90,38 @@ class HMDCalibrator(QObject):
 
     def _get_target_data(self, maxfreq, minfreq):
         '''
-        scene: sceneCamera object
-        le: left eyeCamera object
-        re: right eyeCamera object
-        thresh: amount of data to be collected per target
+        Collects samples_per_tgt synchronized samples for the current
+        target, as fast as the eye cameras deliver them. Left and right
+        eye samples are joined by capture timestamp, within 1/minfreq.
         '''
         idx = self.current_target
         t = time.time()
-        tgt = self.storer.targets
-
-        while (len(tgt[idx]) < self.samples) and (time.time()-t < self.timeout):
-            self.storer.collect_data(idx, self.mode_3D, minfreq)
-            tgt = self.storer.targets
-            time.sleep(1/maxfreq)
+        collector = SampleCollector(None, self.leye, self.reye, 1/minfreq)
+        while (self.storer.count(idx) < self.samples) and \
+              (time.time()-t < self.timeout):
+            for sc, le, re in collector.poll():
+                if self.storer.count(idx) < self.samples:
+                    self.storer.add_sample(idx, sc, le, re)
         self.move_on.emit()
         print("number of samples collected: l->{}, r->{}".format(
-            len(self.storer.l_centers[idx]),
-            len(self.storer.r_centers[idx])))
+            self.storer.count(idx, 'left'),
+            self.storer.count(idx, 'right')))
+        print("sample synchronization:", collector.summary())
+        collector.close()
 
 
     def _get_depth_data(self, maxfreq, minfreq):
         idx = self.current_target
         t = time.time()
-        tgt = self.storer.depth_t
-        while (len(tgt[idx]) < self.samples) and (time.time()-t < self.timeout):
+        while (self.storer.count_depth(idx) < self.samples) and \
+              (time.time()-t < self.timeout):
             pred = self._predict()         
             dist = self._get_dist(pred)
             self.storer.collect_depth_data(idx, dist, self.mode_3D, minfreq)
-            tgt = self.storer.depth_t
             time.sleep(1/maxfreq)
         self.move_on.emit()
         print("number of samples collected: {}".format(
-            len(self.storer.dist[idx])))
+            self.storer.count_depth(idx, 'dist')))
 
     def _get_dist(self, pred):
         le_data, re_data = np.array(pred[:2]), np.array(pred[3:5])
@@ -143,8 +147,11 @@ class HMDCalibrator(QObject):
     def start_calibration(self):
         print('resetting calibration')
         self.storer.initialize_storage(len(self.target_list))
+        if self.storage:
+            self.storer.start_frame_archive()
         self.l_regressor = None
         self.r_regressor = None
+        self.fast_gp = None
         if self.predictor is not None:
             self.stream = False
             self.predictor.join()
@@ -204,28 +211,48 @@ class HMDCalibrator(QObject):
         Finds a gaze estimation function to be used for 
         future predictions. Based on Gaussian Processes regression.
         '''
+        self.storer.stop_frame_archive()
+        self._fit(self.leye.is_cam_active(), self.reye.is_cam_active())
+        print("Gaze estimation finished ({})".format(self.mapping))
+        if self.storage:
+            self.storer.store_calibration(self.mapping)
+
+    def _fit(self, left, right):
         clf_l = self._get_clf()
         clf_r = self._get_clf()        
-        targets = self.storer.get_targets_list()                         
-        if self.leye.is_cam_active():           
+        targets = self.storer.get_targets_list()
+        ids = self.storer.get_target_ids()
+        if left:
             l_centers = self.storer.get_l_centers_list(self.mode_3D)     
-            clf_l.fit(l_centers, targets)
+            clf_l.fit(l_centers, targets, ids)
             self.l_regressor = clf_l
-        if self.reye.is_cam_active():
+        if right:
             r_centers = self.storer.get_r_centers_list(self.mode_3D)
-            clf_r.fit(r_centers, targets)
+            clf_r.fit(r_centers, targets, ids)
             self.r_regressor = clf_r
-        print("Gaze estimation finished")
-        if self.storage:
-            self.storer.store_calibration()
+        self.fast_gp = gm.pair_predictor([self.l_regressor, self.r_regressor])
+
+    def load_calibration(self, path):
+        '''
+        Fits gaze estimation on calibration data stored in a previous
+        session (see Storer.store_calibration)
+        '''
+        self.storer.load_calibration(path)
+        if self.storer.mapping is not None:
+            self.mapping = self.storer.mapping
+        left = len(self.storer.get_l_centers_list(True)) > 0
+        right = len(self.storer.get_r_centers_list(True)) > 0
+        self._fit(left, right)
+        print("Gaze estimation loaded from", path)
 
     @Slot()
     def perform_depth_estimation(self):
         clf_z = self._get_clf()
         targets = self.storer.get_depth_t_list()
         dist = self.storer.get_dist_list()
-        clf_z.fit(dist, targets)
+        clf_z.fit(dist, targets, self.storer.get_depth_target_ids())
         self.z_regressor = clf_z
+        self.fast_z = gm.pair_predictor([clf_z])
         print("Depth estimation finished")
         #
         #TODO: code for storage
@@ -251,6 +278,7 @@ class HMDCalibrator(QObject):
                     x2, y2, z2 = '{:.8f}'.format(x2/d), '{:.8f}'.format(y2/d), '{:.8f}'.format(z)
                     msg = 'G:'+x1+':'+y1+':'+z1+':'+x2+':'+y2+':'+z2
                     self.socket.sendto(msg.encode(), (self.ip, self.port))
+                    self._record_output_latency()
             except Exception as e:
                 print("no request from HMD...", e)
                 count += 1
@@ -258,32 +286,44 @@ class HMDCalibrator(QObject):
                     break
         
 
+    def _record_output_latency(self):
+        for eye, capture_time in zip((self.leye, self.reye), 
+                                     self.capture_times):
+            if capture_time is not None:
+                lap(eye.latency, 'hmd_output', capture_time)
+
     def _predict(self):
         data = [-9,-9,-9,-9]
         pred = [-9,-9,-9,-9,-9,-9]
+        self.capture_times = [None, None]
+        le, re = None, None
         if self.l_regressor is not None:
             le = self.leye.get_processed_data()
-            if le is not None:
-                input_data = le[:2].reshape(1,-1)
-                le_c = self.l_regressor.predict(input_data)[0]
-                data[0], data[1] = input_data[0]
-                pred[0], pred[1], pred[2] = float(le_c[0]), float(le_c[1]), float(le_c[2])
         if self.r_regressor is not None:
             re = self.reye.get_processed_data()
+        if le is not None or re is not None:
+            t = now()
+            coords = self.fast_gp.predict([le, re])
+            if le is not None:
+                lap(self.leye.latency, 'hmd_regression', t)
+                self.capture_times[0] = le[-1]
+                data[0], data[1] = le[:2]
+                pred[0], pred[1], pred[2] = [float(v) for v in coords[0,:3]]
             if re is not None:
-                input_data = re[:2].reshape(1,-1)
-                re_c = self.r_regressor.predict(input_data)[0]
-                data[2], data[3] = input_data[0]
-                pred[3], pred[4], pred[5] = float(re_c[0]), float(re_c[1]), float(re_c[2])
-            if self.z_regressor is not None and self.l_regressor is not None:
-                dist = self._get_dist(pred)
-                input_data = np.array([dist]).reshape(1,-1)
-                z = self.z_regressor.predict(input_data)[0]
-                pred[2], pred[5] = float(z[0]), float(z[0])
+                lap(self.reye.latency, 'hmd_regression', t)
+                self.capture_times[1] = re[-1]
+                data[2], data[3] = re[:2]
+                pred[3], pred[4], pred[5] = [float(v) for v in coords[1,:3]]
+        if self.r_regressor is not None and self.fast_z is not None \
+           and self.l_regressor is not None:
+            dist = self._get_dist(pred)
+            z = self.fast_z.predict([np.array([dist])])[0]
+            pred[2], pred[5] = float(z[0]), float(z[0])
         if self.storage:
             l_gz, r_gz   = pred[:3], pred[3:]
             l_raw, r_raw = data[:2], data[2:]
-            self.storer.append_session_data(l_gz, r_gz, l_raw, r_raw)
+            self.storer.append_session_data(l_gz, r_gz, l_raw, r_raw,
+                                            self.capture_times)
         return pred
 
     def _get_depth_val(self, curr):
@@ -297,12 +337,14 @@ class HMDCalibrator(QObject):
 
 
     def _get_clf(self):
-        kernel = 1.5*kernels.RBF(length_scale=1.0, length_scale_bounds=(0.0,1.0))
-        clf = GaussianProcessRegressor(alpha=1e-5,
-                                       optimizer=None,
-                                       n_restarts_optimizer=3,
-                                       kernel = kernel)
-        return clf
+        return gm.create_mapper(self.mapping)
+
+    @Slot(str)
+    def set_mapping(self, name):
+        if name not in gm.MAPPERS:
+            print("unknown gaze mapping:", name)
+            return
+        self.mapping = name
 
     @Property(str)
     def hmd_ip(self):
@@ -0,0 +1,179 @@
+import itertools
+import time
+import numpy as np
+from multiprocessing import TimeoutError, cpu_count, get_context
+import gaze_mapping as gm
+
+GRID = {'length_scale': (0.25, 0.5, 1.0, 2.0),
+        'amplitude':    (0.5, 1.5, 4.0),
+        'alpha':        (1e-5, 1e-3, 1e-2)}
+DEFAULT_PARAMS = {'length_scale': 1.0, 'amplitude': 1.5, 'alpha': 1e-5}
+
+_data = None
+
+
+def grid_params(grid=GRID):
+    '''
+    Every combination of the grid, starting with the default
+    parameters (see search)
+    '''
+    names = sorted(grid.keys())
+    combos = [dict(zip(names, values))
+              for values in itertools.product(*[grid[n] for n in names])]
+    default = {n: DEFAULT_PARAMS[n] for n in names}
+    if default in combos:
+        combos.remove(default)
+    return [default] + combos
+
+
+def mapper_params(mapping, params):
+    '''
+    Grid parameters as keyword arguments of a GP mapping
+    '''
+    params = dict(params)
+    if mapping == 'sgp':
+        params['noise'] = params.pop('alpha')
+    return params
+
+
+def make_folds(groups, k=None, rnd=None):
+    '''
+    Test sample indices of every fold: one fold per target
+    (leave-one-target-out) if k is None, otherwise k folds with the
+    samples of every target spread over all of them
+    '''
+    if k is None:
+        return [np.flatnonzero(groups == g) for g in np.unique(groups)]
+    rnd = rnd or np.random.RandomState(0)
+    fold = np.empty(len(groups), dtype=int)
+    for g in np.unique(groups):
+        idx = np.flatnonzero(groups == g)
+        fold[idx] = rnd.permutation(len(idx)) % k
+    return [np.flatnonzero(fold == f) for f in range(k)]
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def run_fold(job):
+    '''
+    Fits a model without the samples of one fold and predicts them
+    '''
+    eye, mapping, params, fold = job
+    X, Y, groups, folds = _data[eye]
+    test = folds[fold]
+    train = np.ones(len(X), dtype=bool)
+    train[test] = False
+    mapper = gm.create_mapper(mapping, **mapper_params(mapping, params))
+    mapper.fit(X[train], Y[train], groups[train])
+    return job, mapper.predict(X[test])
+
+
+class SearchResult():
+
+    '''
+    Out-of-fold predictions of every assessed parameter set of an eye
+    '''
+
+    def __init__(self, Y, groups, nfolds):
+        self.Y = Y
+        self.groups = groups
+        self.nfolds = nfolds
+        self.pred = {}
+        self.folds_done = {}
+
+    def add(self, params, test, pred):
+        key = tuple(sorted(params.items()))
+        if key not in self.pred:
+            self.pred[key] = np.full(self.Y.shape, np.nan)
+            self.folds_done[key] = 0
+        self.pred[key][test] = pred
+        self.folds_done[key] += 1
+
+    def per_target(self, key):
+        '''
+        Mean target, mean prediction and error (distance between both)
+        of every target, as assessed by Calibrator._test_calibration
+        '''
+        targets, preds, errors = [], [], []
+        for g in np.unique(self.groups):
+            rows = self.groups == g
+            tmean = self.Y[rows].mean(axis=0)
+            pmean = self.pred[key][rows].mean(axis=0)
+            targets.append(tmean)
+            preds.append(pmean)
+            errors.append(np.linalg.norm(pmean - tmean))
+        return np.array(targets), np.array(preds), np.array(errors)
+
+    def complete(self):
+        return [k for k, n in self.folds_done.items() if n == self.nfolds]
+
+    def best(self):
+        '''
+        (params, score, (targets, predictions, errors)) of the complete
+        parameter set with the lowest mean per-target error
+        '''
+        best = None
+        for key in self.complete():
+            assessment = self.per_target(key)
+            score = np.mean(assessment[2])
+            if best is None or score < best[1]:
+                best = (dict(key), score, assessment)
+        return best
+
+
+def search(data, mapping='gp', grid=GRID, k=None, budget=10.0,
+           workers=None):
+    '''
+    Cross-validated grid search over GP hyperparameters.
+    data: {eye: (X, Y, groups)}, with groups holding the target index
+    of every sample. Every (eye, parameter set, fold) fit is a job
+    of a process pool, started (not forked, the caller may be the
+    Qt process) on every search. The 'budget' (seconds) starts on entry
+    and covers the pool startup; jobs not finished within it are
+    abandoned. The default parameters are assessed first, but only
+    fully assessed parameter sets are compared, so an eye whose default
+    folds did not finish has no best (None).
+    Returns ({eye: best}, stats), best as in SearchResult.best.
+    '''
+    start = time.monotonic()
+    deadline = start + budget
+    shared, results, jobs = {}, {}, []
+    params = grid_params(grid)
+    for eye, (X, Y, groups) in data.items():
+        folds = make_folds(groups, k)
+        shared[eye] = (X, Y, groups, folds)
+        results[eye] = SearchResult(Y, groups, len(folds))
+    # parameter sets in order, so the first ones complete first
+    for p in params:
+        for eye in data.keys():
+            for fold in range(len(shared[eye][3])):
+                jobs.append((eye, mapping, p, fold))
+    workers = workers or cpu_count()
+    done, expired = 0, False
+    pool = get_context('spawn').Pool(workers, initializer=_init_worker,
+                                     initargs=(shared,))
+    try:
+        pending = pool.imap_unordered(run_fold, jobs)
+        for _ in range(len(jobs)):
+            timeout = max(deadline - time.monotonic(), 0.001)
+            try:
+                job, pred = pending.next(timeout=timeout)
+            except TimeoutError:
+                expired = True
+                break
+            eye, _, p, fold = job
+            results[eye].add(p, shared[eye][3][fold], pred)
+            done += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    best = {eye: r.best() for eye, r in results.items()}
+    stats = {'jobs': len(jobs), 'done': done, 'expired': expired,
+             'assessed': min([len(r.complete()) for r in results.values()]
+                             or [0]),
+             'grid': len(params), 'workers': workers,
+             'seconds': time.monotonic() - start}
+    return best, stats
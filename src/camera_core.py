@@ -0,0 +1,360 @@
+from threading import Thread
+from multiprocessing import Pipe, Value
+from frame_buffer import FrameBuffer, FrameWaiter
+from devices import inventory
+import cv2
+import time
+import os
+
+
+class CameraCore():
+
+    '''
+    This is the base class for all cameras or video used in pEyeTracker,
+    with no Qt dependency (headless sessions use it as it is, the UI
+    through camera_proc.Camera). It is mainly responsible for:
+    - gathering and managing cam / video specs
+    - starting / stop a streaming
+    - providing feedback of gaze data processing to other objects
+    '''
+
+    def __init__(self, name=None):
+        self._np_img = None
+        self.name = name
+        self.capturing = Value('i', 0)
+        self.fps_res = {}
+        self.modes = {}
+        self.mode = None         # --> subclassed property
+        self.frame_buffer = None # --> subclassed property
+        self.shared_pos = None   # --> subclassed property
+        self.source = None
+        self.cap = None
+        self.pipe, self.child = Pipe()
+        self.cam_process = None
+        self.vid_process = None
+        self.cam_thread = None
+        self.paused = False
+        self.gamma = 1.0
+        self.color = True
+        self.flip = False
+        self.mono = False
+        self.preview = False     # --> True when a UI shows the frames
+        self.preview_visible = True
+        self.preview_fps = 30.0  # --> max UI preview rate
+        self.preview_scale = 1.0 # --> UI preview downscale factor
+        self._next_preview = 0
+        self.persistent = True   # --> keep mode in config/<name>config.txt
+        self.latency = {}        # --> stage histograms, see LatencyMonitor
+        self.offline_output = None # --> results file for offline runs
+        self.reset_delivery_stats()
+        
+
+    def thread_loop(self):
+        '''
+        UI preview loop. Tracking runs at full camera rate in the image
+        processing process, whereas the preview only takes the latest
+        frame at up to preview_fps (downscaled by preview_scale), and
+        nothing at all while the preview is disabled or hidden.
+        '''
+        waiter, last_seq, last_timestamp = FrameWaiter(), -1, None
+        self.reset_delivery_stats()
+        while self.capturing.value:
+            try:
+                frame_buffer = self.frame_buffer
+                if frame_buffer is not waiter.frame_buffer:
+                    last_seq = -1
+                if not waiter.wait(frame_buffer, 0.5):
+                    self.idle_wakeups += 1
+                    continue
+                delay = self._preview_delay()
+                if delay > 0:
+                    time.sleep(min(delay, 0.5))
+                    continue
+                frame = frame_buffer.read(last_seq)
+                if frame is None:
+                    self.idle_wakeups += 1
+                    continue
+                img, seq, timestamp = frame
+                if last_seq >= 0:
+                    self.frames_skipped += seq - last_seq - 1
+                last_seq = seq
+                if timestamp == last_timestamp:
+                    self.duplicate_frames += 1
+                    continue
+                last_timestamp = timestamp
+                self.frames_processed += 1
+                self._next_preview = time.monotonic() + 1.0/self.preview_fps
+                img = self.process(img)
+                self._np_img = img
+                self._show_preview(self._downscale(img))
+            except Exception as e:
+                print(">>> Exception:", e)
+        waiter.close()
+
+    def _show_preview(self, img):
+        '''
+        Hands a preview frame over to the UI (none by default)
+        '''
+        return
+
+    def _preview_delay(self):
+        if not (self.preview and self.preview_visible):
+            return 0.1
+        return self._next_preview - time.monotonic()
+
+    def _downscale(self, img):
+        if self.preview_scale >= 1.0:
+            return img
+        return cv2.resize(img, None, fx=self.preview_scale, 
+                          fy=self.preview_scale, interpolation=cv2.INTER_AREA)
+
+    def reset_delivery_stats(self):
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.idle_wakeups = 0
+        self.duplicate_frames = 0
+
+    def get_delivery_stats(self):
+        '''
+        processed: frames previewed
+        skipped: frames not previewed (decimation or UI load)
+        '''
+        return {'processed': self.frames_processed,
+                'skipped':   self.frames_skipped,
+                'idle':      self.idle_wakeups,
+                'duplicate': self.duplicate_frames}
+
+    def create_frame_buffer(self, mode):
+        channels = 1 if self.mono else 3
+        return FrameBuffer(mode, channels=channels)
+
+    def get_np_image(self):
+        '''
+        Latest frame, read from the frame buffer (the preview
+        may be decimated or disabled)
+        '''
+        return self.get_np_frame()[0]
+
+    def get_np_frame(self):
+        '''
+        Latest frame and its capture timestamp
+        '''
+        if self.frame_buffer is not None:
+            frame = self.frame_buffer.read()
+            if frame is not None:
+                return frame[0], frame[2]
+        return self._np_img, None
+
+    def init_process(self, source, pipe, buffer, pos, mode, cap): #abstract
+        return 
+
+    def init_vid_process(self, source, pipe, buffer, pos, mode, cap): #abstract
+        return
+
+    def process(self, img):
+        return img
+
+    def join_process(self): #abstract
+        return
+
+    def join_vid_process(self): # abstract
+        return 
+
+    def reset_model(self): #abstract
+        return
+
+    def get_processed_data(self): #abstract
+        return
+
+    def stop(self, video_file=False):
+        if self.capturing.value:
+            if self.paused:
+                self.pipe.send("play")
+            self.pipe.send("stop")
+            if video_file:
+                self.join_vid_process()
+                if self.vid_process.is_alive():
+                    self.vid_process.terminate()
+            else:
+                self.join_process()
+                if self.cam_process.is_alive():
+                    self.cam_process.terminate()
+            self.cam_thread.join(1)
+            print("{} camera frames: {}".format(self.name, 
+                                                self.get_delivery_stats()))
+
+    def play(self, is_video):
+        if is_video:
+            if not self.capturing.value:
+                self.play_video_file()
+            else:
+                self.pipe.send("play")
+                self.paused = False
+
+    def pause(self, is_video):
+        if is_video:
+            self.pipe.send("pause")
+            self.paused = True
+
+    def seek_frame(self, index):
+        self.pipe.send("seek")
+        self.pipe.send(index)
+
+    def seek_time(self, seconds):
+        self.pipe.send("seek_time")
+        self.pipe.send(seconds)
+
+    def step_frame(self):
+        '''
+        Shows the next video frame while paused
+        '''
+        self.pipe.send("step")
+
+    def get_source(self):
+        return self.source
+    
+    def is_cam_active(self):
+        if self.cam_thread is not None:
+            if self.cam_thread.is_alive():
+                return True
+        return False
+
+    def set_source(self, source):
+        print('setting camera source to', source)
+        self.source = source
+        self.load_state()
+        self._set_fps_modes()
+        self.frame_buffer = self.create_frame_buffer(self.mode)
+        self.capturing.value = 1
+        self.init_process(source, self.child, self.frame_buffer, 
+                          self.shared_pos, self.mode, self.capturing)
+        self.cam_thread = Thread(target=self.thread_loop, args=())
+        self.save_state()
+        self.cam_thread.start()
+        
+
+    def set_video_file(self, filename):
+        cap = cv2.VideoCapture(filename)
+        w = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        h = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        f = cap.get(cv2.CAP_PROP_FPS)
+        self.source = filename
+        self.mode = (int(w),int(h),int(f)) 
+        self.modes = {}
+        self.frame_buffer = self.create_frame_buffer(self.mode)
+        ret, frame = cap.read()
+        if ret and self.preview:
+            self._show_preview(self._downscale(frame))
+        cap.release()
+
+    def video_target(self, processor):
+        '''
+        Video files are played back in real time, unless an offline
+        results file is set (as fast as possible, see run_offline)
+        '''
+        if self.offline_output is not None:
+            return processor.run_offline, (self.offline_output,)
+        return processor.run_vid, ()
+
+    def play_video_file(self):
+        self.capturing.value = 1
+        self.init_vid_process(self.source, self.child, self.frame_buffer, 
+                    self.shared_pos, self.mode, self.capturing)
+        self.cam_thread = Thread(target=self.thread_loop, args=())
+        self.cam_thread.start()
+
+    def _set_fps_modes(self):
+        self.fps_res, self.modes = {}, {}
+        avaible_modes = inventory.get_modes(self.source)
+        for i in range(len(avaible_modes)):
+            mode = avaible_modes[i]
+            fps  = mode[2]
+            if fps not in self.fps_res.keys():
+                self.fps_res[fps] = []
+                self.modes[fps]   = []
+            resolution = str(mode[0]) + " x " + str(mode[1])
+            self.modes[fps].append(mode)
+            self.fps_res[fps].append(resolution)
+        if self.mode not in avaible_modes:
+            self.mode = sorted(avaible_modes)[0]
+
+    def set_mode(self, fps, resolution):
+        self.stop()
+        res  = resolution.split('x')
+        self.mode = (int(res[0]), int(res[1]), int(fps))
+        self._set_fps_modes()
+        print("setting mode:", self.mode)
+        if resolution not in self.fps_res[int(fps)]:
+            print("setting mode:", self.modes[int(fps)][0])
+            self.mode = self.modes[int(fps)][0]
+        self._start_capture()
+
+    def _start_capture(self):
+        self.frame_buffer = self.create_frame_buffer(self.mode)
+        self.pipe, self.child = Pipe()
+        self.capturing.value = 1
+        self.init_process(self.source, self.child, self.frame_buffer, 
+                          self.shared_pos, self.mode, self.capturing)
+        self.cam_thread = Thread(target=self.thread_loop, args=())
+        self.save_state()
+        self.cam_thread.start()
+
+    def set_gamma(self, value):
+        self.gamma = value
+        self.pipe.send("gamma")
+        self.pipe.send(value)
+
+    def set_color(self, value):
+        self.color = value
+        self.pipe.send("color")
+        self.pipe.send(bool(value))
+
+    def flip_image(self, value):
+        self.flip = value
+        self.pipe.send("flip")
+        self.pipe.send(bool(value))
+
+    def set_mono(self, value):
+        '''
+        Switches between single-channel (gray) and BGR capture.
+        Live streams are restarted with a frame buffer of the new layout.
+        '''
+        self.mono = bool(value)
+        if isinstance(self.source, int):
+            self.stop()
+            self._start_capture()
+        else:
+            self.stop(video_file=True)
+            self.frame_buffer = self.create_frame_buffer(self.mode)
+
+    def set_preview_fps(self, value):
+        self.preview_fps = max(float(value), 0.1)
+
+    def set_preview_scale(self, value):
+        self.preview_scale = min(max(float(value), 0.05), 1.0)
+
+    def set_preview_visible(self, value):
+        self.preview_visible = bool(value)
+
+    def reset(self):
+        self.reset_model()
+
+    def save_state(self):
+        if not self.persistent:
+            return
+        with open('config/'+self.name+'config.txt', 'w') as f:
+            data =  str(self.mode[0]) + ':'
+            data += str(self.mode[1]) + ':'
+            data += str(self.mode[2]) + ':'
+            data += str(int(self.mono))
+            #data += str(self.gamma)   + ':'
+            #data += str(int(self.color)) 
+            f.write(data)
+
+    def load_state(self):
+        if self.persistent and os.path.isfile('config/'+self.name+'config.txt'):
+            with open('config/'+self.name+'config.txt', 'r') as f:
+                d = f.readline().split(':')
+                self.mode = (int(d[0]), int(d[1]), int(d[2]))
+                if len(d) > 3:
+                    self.mono = bool(int(d[3]))
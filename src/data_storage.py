@@ -1,6 +1,157 @@
 import numpy as np 
+import json
 import os
 import time
+from session_recorder import SessionRecorder
+from frame_archive import FrameArchive
+
+
+class SampleBuffer():
+
+    '''
+    Columnar storage of calibration samples with a per-target index:
+    - every column group (e.g., 'target', 'left', 'right') lives in
+      one preallocated array that doubles when full, so appending a
+      sample is O(1) amortized
+    - rows are kept grouped by target (targets are collected in
+      order), so the rows of a target and the concatenated training
+      matrix of all targets are views, not copies
+    - split() moves held-out samples after the training ones (once),
+      so both training and held-out sets are views as well
+    Groups missing from a sample are left as NaN and not counted.
+    '''
+
+    def __init__(self, ntargets, columns, capacity=1024):
+        self.ntargets = ntargets
+        self.widths = dict(columns)
+        self.data = {name: np.full((capacity, width), np.nan)
+                     for name, width in columns}
+        self.counts = {name: 0 for name, _ in columns}
+        self.target = np.empty(capacity, dtype=np.int32)
+        self.held_out = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.ntrain = 0
+        self.ordered = True
+        self.bounds = np.zeros(2 * ntargets + 1, dtype=np.int64)
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n):
+        capacity = len(self.target)
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for name, array in self.data.items():
+            grown = np.full((capacity, array.shape[1]), np.nan)
+            grown[:self.size] = array[:self.size]
+            self.data[name] = grown
+        for attr in ('target', 'held_out'):
+            array = getattr(self, attr)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, attr, grown)
+
+    def append(self, idx, **values):
+        self.extend(idx, **{k: np.reshape(v, (1,-1)) 
+                            for k, v in values.items() if v is not None})
+
+    def extend(self, idx, **values):
+        '''
+        Appends a block of rows (one array per column group) to target idx
+        '''
+        n = len(next(iter(values.values())))
+        self._reserve(n)
+        start, stop = self.size, self.size + n
+        for name, v in values.items():
+            self.data[name][start:stop] = v
+            self.counts[name] += n
+        if self.ntrain < self.size: # any split is undone
+            self.held_out[:self.size] = False
+            self.ordered = False
+        if self.size > 0 and self.target[self.size-1] > idx:
+            self.ordered = False
+        self.target[start:stop] = idx
+        self.held_out[start:stop] = False
+        self.size = stop
+        if self.ordered:
+            self.bounds[idx+1:] += n
+            self.ntrain = int(self.bounds[self.ntargets])
+        else:
+            self._index()
+
+    def _index(self):
+        '''
+        Rows are ordered by (held out, target). bounds[i]:bounds[i+1]
+        are the training rows of target i and bounds[n+i]:bounds[n+i+1]
+        its held-out rows
+        '''
+        held_out, target = self.held_out[:self.size], self.target[:self.size]
+        if not self.ordered:
+            order = np.lexsort((target, held_out))
+            for name, array in self.data.items():
+                array[:self.size] = array[order]
+            self.target[:self.size] = target[order]
+            self.held_out[:self.size] = held_out[order]
+            self.ordered = True
+        keys = self.target[:self.size] + self.ntargets * self.held_out[:self.size]
+        self.bounds = np.searchsorted(keys, np.arange(2 * self.ntargets + 1))
+        self.ntrain = int(self.bounds[self.ntargets])
+
+    def split(self, nsamples, rnd=np.random):
+        '''
+        Holds out 'nsamples' random samples of every target
+        '''
+        if self.ntrain < self.size:
+            self.held_out[:self.size] = False
+            self.ordered = False
+            self._index()
+        for t in range(self.ntargets):
+            start, stop = self.bounds[t], self.bounds[t+1]
+            n = min(nsamples, stop - start)
+            chosen = rnd.choice(stop - start, n, False)
+            self.held_out[start + chosen] = True
+        self.ordered = False
+        self._index()
+
+    def count(self, idx, name):
+        if self.counts[name] == 0:
+            return 0
+        n = self.ntargets
+        rows = self.bounds[idx+1] - self.bounds[idx]
+        rows += self.bounds[n+idx+1] - self.bounds[n+idx]
+        return int(rows)
+
+    def _empty(self, name):
+        return np.empty((0, self.widths[name]))
+
+    def training(self, name, idx=None):
+        '''
+        View of the training rows of a column group (of target idx only,
+        if given)
+        '''
+        if self.counts[name] == 0:
+            return self._empty(name)
+        if idx is None:
+            return self.data[name][:self.ntrain]
+        return self.data[name][self.bounds[idx]:self.bounds[idx+1]]
+
+    def target_ids(self):
+        '''
+        Target index of every training row
+        '''
+        return self.target[:self.ntrain]
+
+    def testing(self, name, idx):
+        '''
+        View of the held-out rows of target idx (see split)
+        '''
+        if self.counts[name] == 0:
+            return self._empty(name)
+        n = self.ntargets
+        return self.data[name][self.bounds[n+idx]:self.bounds[n+idx+1]]
+
 
 class Storer():
     '''
@@ -11,27 +162,26 @@ class Storer():
 
     def __init__(self, target_list, hmd=False):
         self.target_list = target_list
-        self.targets, self.l_centers, self.r_centers = None, None, None
-        self.depth_t, self.dist = None, None
-        self.t_imgs, self.l_imgs, self.r_imgs = None, None, None
-        self.l_sess, self.r_sess, self.l_raw, self.r_raw = [],[],[],[]
+        self.samples, self.depth = None, None
+        self.archive = None
+        self.archive_codec = 'png'
+        self.narchives = 0
+        self.unmatched_frames = 0
+        self.recorder = None
+        self.nsessions = 0
         self.hmd = hmd
+        self.mapping = None
+        self.mapping_params = {}
         self.scene, self.leye, self.reye = None, None, None
         self.uid = time.ctime().replace(':', '_')
    
     def initialize_storage(self, ntargets):
-        self.targets = {i:np.empty((0,2), dtype='float32') for i in range(ntargets)}
-        if self.hmd:
-            self.targets = {i:np.empty((0,3), dtype='float32') for i in range(ntargets)}
-        self.l_centers = {i:np.empty((0,3), dtype='float32') for i in range(ntargets)}
-        self.r_centers = {i:np.empty((0,3), dtype='float32') for i in range(ntargets)}
-        self.t_imgs = {i:[] for i in range(ntargets)}
-        self.l_imgs = {i:[] for i in range(ntargets)}
-        self.r_imgs = {i:[] for i in range(ntargets)}
+        tdim = 3 if self.hmd else 2
+        columns = [('target', tdim), ('left', 3), ('right', 3)]
+        self.samples = SampleBuffer(ntargets, columns)
     
     def initialize_depth_storage(self, ntargets):
-        self.depth_t = {i:np.empty((0,1), dtype='float32') for i in range(ntargets)}
-        self.dist = {i:np.empty((0,1), dtype='float32') for i in range(ntargets)}
+        self.depth = SampleBuffer(ntargets, [('target', 1), ('dist', 1)])
 
     def set_sources(self, scene, leye, reye):
         self.scene = scene
@@ -47,45 +197,86 @@ class Storer():
         if self._check_data_n_timestamp(None, le, re, mode3D, 1/minfreq):
             self._add_depth_data(dist, idx)
 
-    def collect_data(self, idx, mode3D, minfreq):
-        sc, sc_img = None, None
-        if self.scene is not None:
-            sc = self.scene.get_processed_data() 
-            sc_img = self.scene.get_np_image()
-        le = self.leye.get_processed_data()
-        re = self.reye.get_processed_data()
-        le_img = self.leye.get_np_image()
-        re_img = self.reye.get_np_image()
-        if self._check_data_n_timestamp(sc, le, re, mode3D, 1/minfreq):
-            self._add_data(sc, le, re, idx)
-            self._add_imgs(sc_img, le_img, re_img, idx)
+    def add_sample(self, idx, sc, le, re):
+        '''
+        Stores a synchronized (scene, left, right) sample of target idx
+        (see sample_sync.SampleCollector)
+        '''
+        self._add_data(sc, le, re, idx)
+        if self.archive is not None:
+            self._add_imgs(idx, sc, le, re)
     
     def _add_data(self, sc, le, re, idx):
-        scd = np.array(self.target_list[idx])
+        scd = self.target_list[idx]
         if sc is not None and self.scene.is_cam_active():
-            scd = np.array([sc[0], sc[1]], dtype='float32')
-        self.targets[idx] = np.vstack((self.targets[idx], scd))
+            scd = sc[:2]
+        led, red = None, None
         if self.leye.is_cam_active():
-            led = np.array([le[0],le[1],le[2]])#,le[3],le[4],le[5]])
-            self.l_centers[idx] = np.vstack((self.l_centers[idx], led))
+            led = le[:3]
         if self.reye.is_cam_active():
-            red = np.array([re[0],re[1],re[2]])#,le[3],le[4],le[5]])
-            self.r_centers[idx] = np.vstack((self.r_centers[idx], red))
+            red = re[:3]
+        self.samples.append(idx, target=scd, left=led, right=red)
 
-    def _add_imgs(self, sc, le, re, idx):
-        if sc is not None and self.scene.is_cam_active():
-            self.t_imgs[idx].append(sc)
-        if self.leye.is_cam_active():
-            self.l_imgs[idx].append(le)
-        if self.reye.is_cam_active():
-            self.r_imgs[idx].append(re)
+    def _add_imgs(self, idx, sc, le, re):
+        '''
+        Archives the frames the sample was computed from, looked up
+        by capture timestamp. Frames already overwritten in the frame
+        buffer are not archived (counted as unmatched).
+        '''
+        sample = self.count(idx) - 1
+        for stream, cam, data in (('scene', self.scene, sc), 
+                                  ('leye', self.leye, le),
+                                  ('reye', self.reye, re)):
+            if cam is None or data is None or not cam.is_cam_active():
+                continue
+            frame = None
+            if cam.frame_buffer is not None:
+                frame = cam.frame_buffer.read_at(data[-1])
+            if frame is None:
+                self.unmatched_frames += 1
+                continue
+            img, _, timestamp = frame
+            self.archive.add(stream, idx, sample, timestamp, img)
+
+    def start_frame_archive(self):
+        '''
+        Archives the camera frames of every calibration sample
+        from now on (see FrameArchive)
+        '''
+        self.stop_frame_archive(wait=False)
+        slot_size = 1280 * 720 * 3
+        for cam in (self.scene, self.leye, self.reye):
+            if cam is not None and cam.mode is not None:
+                slot_size = max(slot_size, cam.mode[0] * cam.mode[1] * 3)
+        path = self._check_or_create_path(
+            'frames/{:03d}'.format(self.narchives))
+        self.archive = FrameArchive(path, slot_size, 
+                                    codec=self.archive_codec).start()
+        self.unmatched_frames = 0
+        self.narchives += 1
+
+    def stop_frame_archive(self, wait=True, timeout=10.0):
+        '''
+        Waits (up to 'timeout' seconds) for the frames still being
+        encoded, so the archive is complete when the calibration is
+        stored. UI paths that just restart it pass wait=False.
+        '''
+        if self.archive is not None:
+            if self.unmatched_frames:
+                print(">>> Calibration frames not found in the frame buffer:",
+                      self.unmatched_frames)
+            if self.archive.close(wait, timeout) or not wait:
+                print(">>> Calibration frames archived in", self.archive.path)
+            else:
+                print(">>> Calibration frames still being archived in",
+                      self.archive.path)
+            self.archive = None
 
     def _add_depth_data(self, dist, idx):
-        scd = np.array(self.target_list[idx][2])
-        self.depth_t[idx] = np.vstack((self.depth_t[idx], scd))
+        d = None
         if self.leye.is_cam_active() and self.reye.is_cam_active():
-            d = np.array([dist])
-            self.dist[idx] = np.vstack((self.dist[idx], d))
+            d = dist
+        self.depth.append(idx, target=self.target_list[idx][2], dist=d)
    
     def _check_data_n_timestamp(self, sc, le, re, mode3D, thresh):
         if le is None and self.leye.is_cam_active():
@@ -111,85 +302,151 @@ class Storer():
                     return True
         return False
 
-    def _dict_to_list(self, dic):
-        new_list = np.empty((0,dic[0].shape[1]), dtype='float32')
-        for t in dic.keys():
-            new_list = np.vstack((new_list, dic[t]))
-        return new_list
+    def count(self, idx, column='target'):
+        '''
+        Number of samples collected for target idx
+        '''
+        return self.samples.count(idx, column)
+
+    def count_depth(self, idx, column='target'):
+        return self.depth.count(idx, column)
 
     def get_targets_list(self):
-        return self._dict_to_list(self.targets)
+        return self.samples.training('target')
+
+    def get_target_ids(self):
+        '''
+        Target index of every training sample
+        '''
+        return self.samples.target_ids()
 
     def get_depth_t_list(self):
-        return self._dict_to_list(self.depth_t)
+        return self.depth.training('target')
 
     def get_dist_list(self):
-        return self._dict_to_list(self.dist)
+        return self.depth.training('dist')
+
+    def get_depth_target_ids(self):
+        return self.depth.target_ids()
 
     def get_l_centers_list(self, mode_3D):
-        data = self._dict_to_list(self.l_centers)
+        data = self.samples.training('left')
         if not mode_3D:
-            data = np.array(data[:,:2])
+            data = data[:,:2]
         return data
 
     def get_r_centers_list(self, mode_3D):
-        data = self._dict_to_list(self.r_centers)
+        data = self.samples.training('right')
         if not mode_3D:
-            data = np.array(data[:,:2])
+            data = data[:,:2]
         return data
 
+    def get_cv_data(self):
+        '''
+        All samples (held-out ones included) for cross-validation:
+        targets and the target index of every sample
+        '''
+        self.samples.split(0)
+        return self.get_targets_list(), self.get_target_ids()
+
     def get_random_test_samples(self, nsamples, ntargets):
-        s_target = {i:np.empty((0,3), dtype='float32') for i in range(ntargets)}
-        s_left   = {i:np.empty((0,3), dtype='float32') for i in range(ntargets)}
-        s_right  = {i:np.empty((0,3), dtype='float32') for i in range(ntargets)}
-        distribution = [i for i in range(nsamples)]
-        candidates = np.random.choice(distribution, 5, False)
-        for t in self.targets.keys():
-            s_target[t] = np.take(self.targets[t], candidates, axis=0)
-            if len(self.l_centers[t]) > 0:
-                s_left[t] = np.take(self.l_centers[t], candidates, axis=0)
-                self.l_centers[t] = np.delete(self.l_centers[t], candidates, axis=0)
-            if len(self.r_centers[t]) > 0:
-                s_right[t] = np.take(self.r_centers[t], candidates, axis=0)
-                self.r_centers[t] = np.delete(self.r_centers[t], candidates, axis=0)
-            self.targets[t] = np.delete(self.targets[t], candidates, axis=0)
+        '''
+        Holds out 5 random samples per target from training, and returns
+        them per target (views into storage)
+        '''
+        self.samples.split(5)
+        s_target, s_left, s_right = {}, {}, {}
+        for t in range(ntargets):
+            s_target[t] = self.samples.testing('target', t)
+            s_left[t] = self.samples.testing('left', t)
+            s_right[t] = self.samples.testing('right', t)
         return s_target, s_left, s_right            
 
 
-    def append_session_data(self, l_gaze, r_gaze, l_raw, r_raw):
-        self.l_sess.append(l_gaze)
-        self.r_sess.append(r_gaze)
-        self.l_raw.append(l_raw)
-        self.r_raw.append(r_raw)
+    def append_session_data(self, l_gaze, r_gaze, l_raw, r_raw,
+                            timestamps=(None, None),
+                            confidence=(None, None)):
+        '''
+        Streams a session record to disk (see SessionRecorder);
+        recording starts with the first record
+        '''
+        if self.recorder is None:
+            path = self._check_or_create_path(
+                'session/{:03d}'.format(self.nsessions))
+            self.recorder = SessionRecorder(path).start()
+            self.nsessions += 1
+        self.recorder.append(time.monotonic(), l_gaze, r_gaze, l_raw, r_raw,
+                             timestamps[0], timestamps[1],
+                             confidence[0], confidence[1])
 
     
-    def store_calibration(self):
+    def store_calibration(self, mapping=None, params=None):
+        '''
+        params -> {eye: mapper keyword arguments} picked by the
+        hyperparameter search, if any (see Calibrator.mapping_params)
+        '''
         print(">>> Storing calibration data, please wait...")
         path = self._check_or_create_path('calibration')
-        for k in self.targets.keys():
-            perc = int(k/len(self.targets.keys()) * 100)
+        if mapping is not None:
+            with open(path+'mapping.txt', 'w') as f:
+                f.write(mapping + '\n')
+        if params:
+            with open(path+'mapping_params.json', 'w') as f:
+                json.dump(params, f, indent=2)
+        ntargets = self.samples.ntargets
+        for k in range(ntargets):
+            perc = int(k/ntargets * 100)
             print(">>> {}%...".format(perc), end="\r", flush=True)
-            c1, c2 = self.target_list[k]
+            c1, c2 = self.target_list[k][:2]
             prefix = str(c1) + "_" + str(c2) + "_"
-            # np.savez_compressed(path+prefix+ "img_scene", self.t_imgs[k])
-            # np.savez_compressed(path+prefix+ "img_leye", self.l_imgs[k])
-            # np.savez_compressed(path+prefix+ "img_reye", self.r_imgs[k])
-            np.savez_compressed(path+prefix+ "tgt", self.targets[k])
-            if len(self.l_centers[k]) > 0:
-                np.savez_compressed(path+prefix+"leye", self.l_centers[k])
-            if len(self.r_centers[k]) > 0:
-                np.savez_compressed(path+prefix+"reye", self.r_centers[k])
+            np.savez_compressed(path+prefix+ "tgt", 
+                                self.samples.training('target', k))
+            l_centers = self.samples.training('left', k)
+            if len(l_centers) > 0:
+                np.savez_compressed(path+prefix+"leye", l_centers)
+            r_centers = self.samples.training('right', k)
+            if len(r_centers) > 0:
+                np.savez_compressed(path+prefix+"reye", r_centers)
         print(">>> Calibration data saved.")
 
+    def load_calibration(self, path):
+        '''
+        Loads calibration data saved by store_calibration 
+        (one set of files per target) back into storage
+        '''
+        files = sorted([f for f in os.listdir(path) if f.endswith('_tgt.npz')])
+        self.initialize_storage(len(files))
+        for i, f in enumerate(files):
+            prefix = os.path.join(path, f[:-len('tgt.npz')])
+            block = {'target': np.load(prefix+'tgt.npz')['arr_0']}
+            if os.path.isfile(prefix+'leye.npz'):
+                block['left'] = np.load(prefix+'leye.npz')['arr_0']
+            if os.path.isfile(prefix+'reye.npz'):
+                block['right'] = np.load(prefix+'reye.npz')['arr_0']
+            if len(block['target']) > 0:
+                self.samples.extend(i, **block)
+        self.mapping = None
+        mapping_file = os.path.join(path, 'mapping.txt')
+        if os.path.isfile(mapping_file):
+            with open(mapping_file) as f:
+                self.mapping = f.read().strip()
+        self.mapping_params = {}
+        params_file = os.path.join(path, 'mapping_params.json')
+        if os.path.isfile(params_file):
+            with open(params_file) as f:
+                self.mapping_params = json.load(f)
+        print(">>> Calibration data loaded ({} targets).".format(len(files)))
+
     def store_session(self):
-        if len(self.l_sess) > 0:        
+        '''
+        Ends the current recording (the next record starts a new one)
+        '''
+        if self.recorder is not None:
             print(">>> Saving session...")
-            path = self._check_or_create_path('session')
-            np.savez_compressed(path+'_left_gaze', self.l_sess)
-            np.savez_compressed(path+'_right_gaze', self.r_sess)
-            np.savez_compressed(path+'_left_eye', self.l_raw)
-            np.savez_compressed(path+'_right_eye', self.r_raw)
-            print('>>> Session saved.')
+            self.recorder.close()
+            print('>>> Session saved ({} records): {}'.format(
+                self.recorder.records, self.recorder.path))
+            self.recorder = None
 
 
     def _check_or_create_path(self, spec):
@@ -0,0 +1,122 @@
+import os
+import time
+import uvc
+from threading import Thread, Lock
+
+
+class DeviceInventory():
+
+    '''
+    Cached inventory of the uvc devices plugged in and their frame modes.
+    Enumerating devices and (especially) opening a uvc.Capture just to
+    read its modes is slow, so it:
+    - enumerates devices only once, until a refresh is requested
+    - reads the frame modes of each device only once (by uid)
+    - optionally polls uvc.device_list() in a background thread (there
+      is no hotplug event), refreshing the inventory only when the set
+      of devices changes
+
+    Camera processes are forked while the watcher may hold the lock, so
+    forked children get a fresh lock (see _after_fork).
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._devices = None
+        self._modes = {}
+        self._watcher = None
+        self.watching = False
+        self.version = 0
+
+    def _after_fork(self):
+        # the lock may have been held by a parent thread, and no
+        # thread (watcher included) survives the fork
+        self._lock = Lock()
+        self._watcher = None
+        self.watching = False
+
+    def _enumerate(self):
+        devices = uvc.device_list()
+        uids = set([d['uid'] for d in devices])
+        for uid in list(self._modes.keys()):
+            if uid not in uids:
+                del self._modes[uid]
+        self._devices = devices
+        self.version += 1
+
+    def refresh(self):
+        with self._lock:
+            self._enumerate()
+
+    def device_list(self):
+        with self._lock:
+            if self._devices is None:
+                self._enumerate()
+            return list(self._devices)
+
+    def get_uid(self, source):
+        return self.device_list()[source]['uid']
+
+    def get_name(self, source):
+        return self.device_list()[source]['name']
+
+    def get_modes(self, source):
+        '''
+        Frame modes (w, h, fps) available for the device at 'source'.
+        They are read once, while the device is not streaming.
+        '''
+        uid = self.get_uid(source)
+        with self._lock:
+            modes = self._modes.get(uid)
+        if modes is None:
+            # opened without the lock, so the watcher never waits on it
+            cap = uvc.Capture(uid)
+            modes = [tuple(m) for m in cap.avaible_modes]
+            cap.close()
+            with self._lock:
+                self._modes[uid] = modes
+        return list(modes)
+
+    def check_hotplug(self):
+        '''
+        Re-enumerates devices, returning True if any was added or removed
+        '''
+        devices = uvc.device_list()
+        with self._lock:
+            current = None
+            if self._devices is not None:
+                current = set([d['uid'] for d in self._devices])
+            if current == set([d['uid'] for d in devices]):
+                return False
+            self._enumerate()
+        return True
+
+    def start_watcher(self, interval=2.0):
+        '''
+        Polls the device list every 'interval' seconds
+        '''
+        if self._watcher is not None:
+            return
+        self.watching = True
+        self._watcher = Thread(target=self._watch, args=(interval,),
+                               daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self.watching = False
+        if self._watcher is not None:
+            self._watcher.join(1)
+            self._watcher = None
+
+    def _watch(self, interval):
+        while self.watching:
+            time.sleep(interval)
+            try:
+                if self.check_hotplug():
+                    print(">>> Camera devices changed")
+            except Exception as e:
+                print(">>> Exception:", e)
+
+
+inventory = DeviceInventory()
+os.register_at_fork(after_in_child=inventory._after_fork)
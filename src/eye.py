@@ -1,26 +1,24 @@
 import cv2
 import time
 import numpy as np
-import camera_proc as camera
+import camera_core
+from devices import inventory
 import sys 
 import ctypes
-import uvc
-from matplotlib import pyplot as plt
-from eye_img_processor import EyeImageProcessor
+from eye_img_processor import EyeImageProcessor, PupilData, roi_summary
 #from img_processor import ImageProcessor
-from multiprocessing import Array, Process
-from pupil_detectors import Detector3D, Detector2D
+from multiprocessing import Array, Process, RawValue
 
 
 
-class EyeCamera(camera.Camera):
+class EyeCamera(camera_core.CameraCore):
 
     '''
-    This is the specialized eye camera extension of the Camera class.
+    This is the specialized eye camera extension of the CameraCore class.
     It is responsible for:
     - starting / stoping processes for image processing tasks
-    - detecting the pupil center
-    - creating a 3D eye model
+    - controlling pupil detection (2D or 3D eye model), which runs
+      in the image processing process
     - providing eye tracking information to other objects
     '''
 
@@ -29,29 +27,32 @@ class EyeCamera(camera.Camera):
         self.mode = mode
         self.cam_process = None
         self.vid_process = None
-        self.shared_array = self.create_shared_array(mode)
+        self.frame_buffer = self.create_frame_buffer(mode)
         self.shared_pos = self.create_shared_pos()
         self.mode_3D = False
-        self.detector_2D = Detector2D()
-        self.detector_3D = Detector3D()
-        self.detector_2D.update_properties({'2d':{'pupil_size_max':250}})
-        self.detector_3D.update_properties({'2d':{'pupil_size_max':250}})
-        self.countdown = 5
+        self.roi_mode = False
 
-    def init_process(self, source, pipe, array, pos, mode, cap):
+    def init_process(self, source, pipe, buffer, pos, mode, cap):
         mode = self.check_mode_availability(source, mode)
-        self.cam_process = EyeImageProcessor(source, mode, pipe, array, cap)
+        self.cam_process = EyeImageProcessor(source, mode, pipe, buffer, 
+                                             cap, pos, self.latency)
         self.cam_process.start()
         if self.mode_3D:
             self.pipe.send("mode_3D")    
+        if self.roi_mode:
+            self.pipe.send("roi")
 
-    def init_vid_process(self, source, pipe, array, pos, mode, cap):
+    def init_vid_process(self, source, pipe, buffer, pos, mode, cap):
         mode = self.check_mode_availability(source, mode)
-        self.cam_process = EyeImageProcessor(source, mode, pipe, array, cap)
-        self.vid_process = Process(target=self.cam_process.run_vid, args=())
+        self.cam_process = EyeImageProcessor(source, mode, pipe, buffer, 
+                                             cap, pos, self.latency)
+        target, args = self.video_target(self.cam_process)
+        self.vid_process = Process(target=target, args=args)
         self.vid_process.start()
         if self.mode_3D:
             self.pipe.send("mode_3D")
+        if self.roi_mode:
+            self.pipe.send("roi")
 
     def join_process(self):
         self.cam_process.join(10)
@@ -63,84 +64,47 @@ class EyeCamera(camera.Camera):
         self.mode_3D = not self.mode_3D
         self.pipe.send("mode_3D")
 
-    def create_shared_array(self, mode):
-        w = mode[0]
-        h = mode[1]
-        return Array(ctypes.c_uint8, h*w*3, lock=False)
+    def toggle_roi(self):
+        self.roi_mode = not self.roi_mode
+        self.pipe.send("roi")
 
     def create_shared_pos(self):
-        return Array(ctypes.c_float, 4, lock=False)
+        return RawValue(PupilData)
 
     def check_mode_availability(self, source, mode):
-        dev_list = uvc.device_list()
-        cap = uvc.Capture(dev_list[source]['uid'])
-        if mode not in cap.avaible_modes:
-            m = cap.avaible_modes[0]
+        if not isinstance(source, int):
+            return mode
+        avaible_modes = inventory.get_modes(source)
+        if mode not in avaible_modes:
+            m = avaible_modes[0]
             mode = (m[1], m[0], m[2])
-            self.shared_array = self.create_shared_array(mode)
+            self.frame_buffer = self.create_frame_buffer(mode)
             self.mode = mode
         return mode
 
 
-    def process(self, img):
-        if img is None:
-            return
-        height, width = img.shape[0], img.shape[1]
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        timestamp = uvc.get_time_monotonic()
-        if self.mode_3D:
-            result = self.detector_3D.detect(gray, timestamp)
-        else:
-            result = self.detector_2D.detect(gray)
-        if result["confidence"] > 0.6:
-            if self.mode_3D:
-                n = np.array(result['circle_3d']['normal'])
-                center = np.array(result['circle_3d']['center'])     
-                self.pos = np.array([n[0], n[1], n[2], time.monotonic()])
-            else:
-                c = np.array(result['ellipse']['center'])
-                self.pos = np.array([c[0]/width, c[1]/height, time.monotonic()])
-            self._draw_tracking_info(result, img)
-            self.countdown = 5
-        else:
-            self.countdown -= 1
-            if self.countdown <= 0:
-                self.pos = None
-        return img
- 
-    def _draw_tracking_info(self, result, img, color=(255,120,120)):
-        ellipse = result["ellipse"]
-        center = tuple(int(v) for v in ellipse["center"])
-        cv2.drawMarker(img, center, (0,255,0), cv2.MARKER_CROSS, 12, 1)
-        self._draw_ellipse(ellipse, img, (0,0,255))
-        if self.mode_3D:
-            sphere = result["projected_sphere"]
-            normal = result["circle_3d"]["normal"]
-            dest_pos = (int(center[0]+normal[0]*60), int(center[1]+normal[1]*60))
-            cv2.line(img, center, dest_pos, (85,175,20),2)
-            if result['model_confidence'] > 0.6:
-                self._draw_ellipse(sphere, img, (255, 204, 51), 1)
-
-
-    def _draw_ellipse(self, ellipse, img, color, thickness=2):
-        center = tuple(int(v) for v in ellipse["center"])
-        axes = tuple(int(v/2) for v in ellipse["axes"])
-        rad = ellipse["angle"]
-        cv2.ellipse(img, center, axes, rad, 0, 360, color, 2)
-
-    
     def reset_model(self):
-        if self.mode_3D:
-            self.detector_3D.reset_model()
-        else:
-            self.detector_2D.reset_model()
-
-
-    def get_processed_data(self):
-        return self.pos
+        self.pipe.send("reset")
 
+    def get_pupil_data(self):
+        '''
+        Copy of the last PupilData (None if it could not be read)
+        '''
+        return self.shared_pos.snapshot()
 
+    def get_roi_stats(self):
+        d = self.shared_pos.snapshot()
+        if d is None:
+            return roi_summary(0, 0, 0, 0.0, 0.0)
+        return roi_summary(d.roi_frames, d.roi_hits, d.full_frames,
+                           d.roi_time, d.full_time)
 
-
-            
-
+    def get_processed_data(self):
+        data = self.shared_pos.snapshot()
+        if data is None or not data.valid:
+            return None
+        if data.mode_3D:
+            n = data.normal
+            return np.array([n[0], n[1], n[2], data.timestamp])
+        c = data.center
+        return np.array([c[0], c[1], data.timestamp])
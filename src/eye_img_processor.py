@@ -3,17 +3,156 @@ import numpy as np
 import img_processor as imp
 import time
 import sys
+import ctypes
 import uvc
+from devices import inventory
+from results import EYE_FIELDS
+
+
+class PupilData(ctypes.Structure):
+
+    '''
+    Fixed-layout pupil detection result shared between an
+    EyeImageProcessor (writer) and its EyeCamera (reader).
+    The sequence counter is odd while an update is in progress,
+    so readers never consume a half-written result (snapshot gives
+    up, returning None, if the writer never finishes the update,
+    e.g., because it was terminated while writing).
+    '''
+
+    _fields_ = [('seq',              ctypes.c_int64),
+                ('timestamp',        ctypes.c_double),
+                ('valid',            ctypes.c_int32),
+                ('mode_3D',          ctypes.c_int32),
+                ('confidence',       ctypes.c_double),
+                ('model_confidence', ctypes.c_double),
+                ('center',           ctypes.c_double * 2),
+                ('normal',           ctypes.c_double * 3),
+                ('ellipse_center',   ctypes.c_double * 2),
+                ('ellipse_axes',     ctypes.c_double * 2),
+                ('ellipse_angle',    ctypes.c_double),
+                ('roi_frames',       ctypes.c_int64),
+                ('roi_hits',         ctypes.c_int64),
+                ('full_frames',      ctypes.c_int64),
+                ('roi_time',         ctypes.c_double),
+                ('full_time',        ctypes.c_double)]
+
+    def snapshot(self, retries=500):
+        for _ in range(retries):
+            seq = self.seq
+            if seq % 2 == 0:
+                data = PupilData.from_buffer_copy(self)
+                if self.seq == seq:
+                    return data
+        return None
+
+
+def roi_summary(roi_frames, roi_hits, full_frames, roi_time, full_time):
+    '''
+    roi_rate: share of frames detected inside the ROI window
+    hit_rate: share of ROI detections that were confident
+    speedup: mean full-frame detection time over mean ROI detection time
+    '''
+    total = roi_frames + full_frames
+    summary = {'roi_rate': 0.0, 'hit_rate': 0.0, 'speedup': 1.0}
+    if total > 0:
+        summary['roi_rate'] = roi_frames / total
+    if roi_frames > 0:
+        summary['hit_rate'] = roi_hits / roi_frames
+    if roi_frames > 0 and full_frames > 0 and roi_time > 0:
+        roi_mean = roi_time / roi_frames
+        full_mean = full_time / full_frames
+        summary['speedup'] = full_mean / roi_mean
+    return summary
+
+
+class PupilRoiTracker():
+
+    '''
+    Keeps a pupil search window around the last confident detection,
+    so that detection does not need to scan the whole eye image:
+    - the window follows the pupil velocity and grows with pupil size
+    - full-frame search is used whenever the last detection was not
+      confident (or no detection happened yet)
+    - ROI usage, hits and detection times are accounted
+    '''
+
+    def __init__(self, scale=1.5, min_half=40, smoothing=0.5):
+        self.scale = scale
+        self.min_half = min_half
+        self.smoothing = smoothing
+        self.roi_frames, self.roi_hits, self.full_frames = 0, 0, 0
+        self.roi_time, self.full_time = 0.0, 0.0
+        self.reset()
+
+    def reset(self):
+        self.center = None
+        self.axis = 0
+        self.velocity = np.zeros(2)
+        self.timestamp = None
+        self.interval = 0.0
+
+    def window(self, width, height):
+        if self.center is None:
+            return None
+        pred = self.center + self.velocity * self.interval
+        reach = np.abs(self.velocity) * self.interval
+        half = np.maximum(self.min_half, self.scale * self.axis) + reach
+        x_min = int(max(0, pred[0] - half[0]))
+        y_min = int(max(0, pred[1] - half[1]))
+        x_max = int(min(width,  pred[0] + half[0]))
+        y_max = int(min(height, pred[1] + half[1]))
+        if x_max - x_min < 2 or y_max - y_min < 2:
+            return None
+        return x_min, y_min, x_max, y_max
+
+    def update(self, ellipse, timestamp):
+        center = np.array(ellipse['center'], dtype=float)
+        if self.center is not None and timestamp > self.timestamp:
+            dt = timestamp - self.timestamp
+            vel = (center - self.center) / dt
+            a = self.smoothing
+            self.velocity = a * vel + (1 - a) * self.velocity
+            self.interval = dt
+        self.center = center
+        self.axis = max(ellipse['axes'])
+        self.timestamp = timestamp
+
+    def account(self, roi, elapsed, confident):
+        if roi is None:
+            self.full_frames += 1
+            self.full_time += elapsed
+        else:
+            self.roi_frames += 1
+            self.roi_time += elapsed
+            self.roi_hits += int(confident)
+
+    def summary(self):
+        return roi_summary(self.roi_frames, self.roi_hits, self.full_frames,
+                           self.roi_time, self.full_time)
+
 
 class EyeImageProcessor(imp.ImageProcessor):
 
     '''
     It runs specialized image processing tasks for eye cameras
-    as a separate process
+    as a separate process, including:
+    - pupil detection (2D or 3D model), optionally restricted
+      to a window around the last pupil position (ROI mode)
+    - drawing tracking info on the outgoing frame
+    - publishing detection results to the shared PupilData struct
     '''
 
-    def __init__(self, source, mode, pipe, array, cap):
-        super().__init__(source, mode, pipe, array, cap)
+    def __init__(self, source, mode, pipe, buffer, cap, pos, latency=None):
+        super().__init__(source, mode, pipe, buffer, cap, pos, latency)
+        self.detector_2D = None
+        self.detector_3D = None
+        self.roi_type = None
+        self.tracker = PupilRoiTracker()
+        self.roi_mode = False
+        self.countdown = 5
+        self.result = None
+        self.result_fields = EYE_FIELDS
 
     def _setup_eye_cam(self, cap):
         if self.eye_cam:
@@ -24,48 +163,221 @@ class EyeImageProcessor(imp.ImageProcessor):
             except:
                 print("Exposure settings not available for this camera.")
 
+    def _setup_detectors(self):
+        # imported here, so only the eye processes pay for it
+        from pupil_detectors import Detector3D, Detector2D, Roi
+        self.roi_type = Roi
+        self.detector_2D = Detector2D()
+        self.detector_3D = Detector3D()
+        self.detector_2D.update_properties({'2d':{'pupil_size_max':250}})
+        self.detector_3D.update_properties({'2d':{'pupil_size_max':250}})
+        self.countdown = 5
+        self.tracker = PupilRoiTracker()
+        self._invalidate()
+
     def run_vid(self):
         self.capturing.value = 1
-        cap = cv2.VideoCapture(self.source)
-        gamma, color, delay, mode_3D = 1, True, 1/self.mode[2], False
-        loop, flip = True, False
-        while cap.isOpened() and loop:
-            ret, frame = cap.read()
-            if ret:
-                img = self.adjust_gamma(frame, gamma)
-                img = self.cvtBlackWhite(img, color)
-                img = self.flip_img(img, flip) 
-                if img is not None:
-                    shared_img = self.get_shared_np_array(img)
-                    np.copyto(shared_img, img)
-                time.sleep(delay)
-            loop,gamma,color,mode_3D,flip = self.process_msg(gamma,color,mode_3D,flip)
-        cap.release()
+        self._setup_detectors()
+        self.open_video()
+        mode_3D, loop = False, True
+        while loop:
+            item = self.next_video_frame()
+            if item is not None:
+                timestamp = time.monotonic()
+                img = self.preprocess(item[2])
+                t = self.lap('preprocess', timestamp)
+                self._process_frame(img, timestamp, mode_3D)
+                self.lap('detection', t)
+                self.frame_buffer.commit(timestamp)
+            loop, mode_3D = self.process_msg(mode_3D)
+        self.close_video()
+        self._invalidate()
+        self._print_roi_summary()
         self.capturing.value = 0
 
 
     def run(self):
         self.capturing.value = 1
-        dev_list = uvc.device_list()
-        cap = uvc.Capture(dev_list[self.source]['uid'])
+        self._setup_detectors()
+        cap = uvc.Capture(inventory.get_uid(self.source))
         self._setup_eye_cam(cap)
         cap.frame_mode = self.mode
-        attempt, attempts, loop = 0, 5, True
-        gamma, color, mode_3D, flip = 1, True, False, False
-        while attempt < attempts and loop:     
+        self.sync_clock()
+        attempt, attempts, loop, mode_3D = 0, 5, True, False
+        while attempt < attempts and loop:
             try:
                 frame = cap.get_frame(2.0)
-                img   = self.adjust_gamma(frame.bgr, gamma)
-                img   = self.cvtBlackWhite(img, color)
-                img   = self.flip_img(img, flip)       
-                if img is not None:
-                    attempt = 0
-                    shared_img = self.get_shared_np_array(img)
-                    np.copyto(shared_img, img)
+                timestamp = self.get_capture_time(frame)
+                t = self.lap('capture', timestamp)
+                img = self.preprocess(self.grab(frame))
+                t = self.lap('preprocess', t)
+                attempt = 0
             except Exception as e:
                 print("error:", e)
                 cap = self.reset_mode(cap)
-                attempt += 1 
-            loop,gamma,color,mode_3D,flip = self.process_msg(gamma,color,mode_3D,flip)      
+                attempt += 1
+            else:
+                self._process_frame(img, timestamp, mode_3D)
+                self.lap('detection', t)
+                self.frame_buffer.commit(timestamp)
+            loop, mode_3D = self.process_msg(mode_3D)
+        self._invalidate()
+        self._print_roi_summary()
         self.capturing.value = 0
-        print("eye camera closed [source: {}]".format(self.source))
\ No newline at end of file
+        print("eye camera closed [source: {}]".format(self.source))
+
+
+    def _process_frame(self, img, timestamp, mode_3D):
+        '''
+        Detection errors on a frame only invalidate the pupil data
+        (the camera is not reset, as for capture errors)
+        '''
+        try:
+            self.process(img, timestamp, mode_3D)
+        except Exception as e:
+            print("detection error:", e)
+            self.tracker.reset()
+            self._invalidate()
+
+    def process(self, img, timestamp, mode_3D):
+        height, width = img.shape[0], img.shape[1]
+        gray = img
+        if len(img.shape) > 2:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        roi = None
+        if self.roi_mode:
+            roi = self.tracker.window(width, height)
+        start = time.perf_counter()
+        result = self._detect(gray, timestamp, mode_3D, roi)
+        self.result = result
+        confident = result["confidence"] > 0.6
+        self.tracker.account(roi, time.perf_counter()-start, confident)
+        if confident:
+            self.tracker.update(result['ellipse'], timestamp)
+            self._publish(result, timestamp, mode_3D, width, height)
+            self._draw_tracking_info(result, img, mode_3D)
+            self.countdown = 5
+        else:
+            self.tracker.reset()
+            self.countdown -= 1
+            if self.countdown <= 0:
+                self._invalidate()
+        self._publish_roi_stats()
+        return img
+
+    def setup_offline(self):
+        if self.detector_2D is None:
+            self._setup_detectors()
+        else:
+            self.reset_model()
+            self.countdown = 5
+            self._invalidate()
+
+    def get_detectors(self):
+        return self.roi_type, self.detector_2D, self.detector_3D
+
+    def set_detectors(self, detectors):
+        '''
+        Reuses detectors created by another processor (e.g., batch
+        workers keep a single pair of detectors for every video)
+        '''
+        self.roi_type, self.detector_2D, self.detector_3D = detectors
+
+    def process_offline(self, img, timestamp, mode_3D):
+        height, width = img.shape[0], img.shape[1]
+        self.process(img, timestamp, mode_3D)
+        result = self.result
+        ellipse = result['ellipse']
+        values = [result['confidence'],
+                  ellipse['center'][0] / width,
+                  ellipse['center'][1] / height,
+                  max(ellipse['axes']), min(ellipse['axes']),
+                  ellipse['angle']]
+        if mode_3D:
+            values += list(result['circle_3d']['normal'])
+            values.append(result['model_confidence'])
+        else:
+            values += [np.nan] * 4
+        return values
+
+    def _detect(self, gray, timestamp, mode_3D, roi):
+        kwargs = {}
+        if roi is not None:
+            kwargs['roi'] = self.roi_type(*roi)
+        if mode_3D:
+            return self.detector_3D.detect(gray, timestamp, **kwargs)
+        return self.detector_2D.detect(gray, **kwargs)
+
+    def _publish(self, result, timestamp, mode_3D, width, height):
+        data = self.shared_pos
+        ellipse = result['ellipse']
+        data.seq += 1
+        data.timestamp = timestamp
+        data.mode_3D = int(mode_3D)
+        data.confidence = result['confidence']
+        data.center[0] = ellipse['center'][0] / width
+        data.center[1] = ellipse['center'][1] / height
+        data.ellipse_center[:] = ellipse['center']
+        data.ellipse_axes[:] = ellipse['axes']
+        data.ellipse_angle = ellipse['angle']
+        if mode_3D:
+            data.normal[:] = result['circle_3d']['normal']
+            data.model_confidence = result['model_confidence']
+        data.valid = 1
+        data.seq += 1
+
+    def _publish_roi_stats(self):
+        data, tracker = self.shared_pos, self.tracker
+        data.seq += 1
+        data.roi_frames = tracker.roi_frames
+        data.roi_hits = tracker.roi_hits
+        data.full_frames = tracker.full_frames
+        data.roi_time = tracker.roi_time
+        data.full_time = tracker.full_time
+        data.seq += 1
+
+    def _print_roi_summary(self):
+        if self.tracker.roi_frames > 0:
+            print("eye ROI tracking [source: {}]: {}".format(
+                self.source, self.tracker.summary()))
+
+    def _invalidate(self):
+        data = self.shared_pos
+        data.seq += 1
+        data.valid = 0
+        data.seq += 1
+
+    def _draw_tracking_info(self, result, img, mode_3D):
+        ellipse = result["ellipse"]
+        center = tuple(int(v) for v in ellipse["center"])
+        cv2.drawMarker(img, center, self._color(img, (0,255,0)),
+                       cv2.MARKER_CROSS, 12, 1)
+        self._draw_ellipse(ellipse, img, self._color(img, (0,0,255)))
+        if mode_3D:
+            sphere = result["projected_sphere"]
+            normal = result["circle_3d"]["normal"]
+            dest_pos = (int(center[0]+normal[0]*60), int(center[1]+normal[1]*60))
+            cv2.line(img, center, dest_pos, self._color(img, (85,175,20)), 2)
+            if result['model_confidence'] > 0.6:
+                self._draw_ellipse(sphere, img, 
+                                   self._color(img, (255, 204, 51)), 1)
+
+    def _color(self, img, bgr):
+        if len(img.shape) > 2:
+            return bgr
+        return (255,)
+
+    def _draw_ellipse(self, ellipse, img, color, thickness=2):
+        center = tuple(int(v) for v in ellipse["center"])
+        axes = tuple(int(v/2) for v in ellipse["axes"])
+        rad = ellipse["angle"]
+        cv2.ellipse(img, center, axes, rad, 0, 360, color, 2)
+
+    def reset_model(self):
+        self.detector_2D.reset_model()
+        self.detector_3D.reset_model()
+        self.tracker.reset()
+
+    def toggle_roi(self):
+        self.roi_mode = not self.roi_mode
+        self.tracker.reset()
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def rbf_params(kernel):
+    '''
+    Amplitude and length scale of a fitted (ConstantKernel *) RBF kernel
+    '''
+    from sklearn.gaussian_process import kernels
+    if isinstance(kernel, kernels.RBF):
+        return 1.0, np.asarray(kernel.length_scale, dtype=np.float64)
+    if isinstance(kernel, kernels.Product):
+        k1, k2 = kernel.k1, kernel.k2
+        if isinstance(k2, kernels.ConstantKernel):
+            k1, k2 = k2, k1
+        if isinstance(k1, kernels.ConstantKernel) and \
+           isinstance(k2, kernels.RBF):
+            length_scale = np.asarray(k2.length_scale, dtype=np.float64)
+            return float(k1.constant_value), length_scale
+    raise ValueError("unsupported kernel for FastGP: {}".format(kernel))
+
+
+class FastGP():
+
+    '''
+    Prediction-only form of one or more fitted GaussianProcessRegressor
+    models with a (ConstantKernel *) RBF kernel, e.g., the left and right
+    eye regressors. Training inputs are pre-scaled by the length scale
+    and dual coefficients (alpha_) are folded with the amplitude and
+    the y normalization, so the predictive mean of every model comes
+    out of a single vectorized evaluation:
+        k = exp(-0.5 * |x/l - X/l|^2),   y = k . alpha
+    using preallocated buffers (no sklearn validation per call).
+    '''
+
+    def __init__(self, regressors):
+        self.nmodels = len(regressors)
+        self.active = [r is not None for r in regressors]
+        fitted = [r for r in regressors if r is not None]
+        if not fitted:
+            raise ValueError("FastGP needs at least one fitted regressor")
+        self.ndim = fitted[0].X_train_.shape[1]
+        self.ntargets = self._alpha(fitted[0]).shape[1]
+        blocks, alphas, scales, self.slices = [], [], [], []
+        start = 0
+        for r in regressors:
+            if r is None:
+                self.slices.append(None)
+                scales.append(None)
+                continue
+            amplitude, length_scale = rbf_params(r.kernel_)
+            X = r.X_train_ / length_scale
+            blocks.append(X)
+            alphas.append(self._alpha(r) * amplitude)
+            scales.append(1.0 / length_scale)
+            self.slices.append(slice(start, start + len(X)))
+            start += len(X)
+        self.inv_length_scales = scales
+        self.X = np.ascontiguousarray(np.vstack(blocks))
+        # block-diagonal dual coefficients: one column block per model
+        self.alpha = np.zeros((start, self.nmodels * self.ntargets))
+        self.offset = np.zeros(self.nmodels * self.ntargets)
+        for i, r in enumerate(regressors):
+            if r is None:
+                continue
+            cols = slice(i * self.ntargets, (i + 1) * self.ntargets)
+            self.alpha[self.slices[i], cols] = alphas.pop(0)
+            self.offset[cols] = self._y_mean(r)
+        self._query = np.empty_like(self.X)
+        self._ones = np.ones(self.ndim)
+        self._k = np.empty(start)
+        self._out = np.empty(self.nmodels * self.ntargets)
+
+    def _alpha(self, regressor):
+        alpha = regressor.alpha_
+        if alpha.ndim == 1:
+            alpha = alpha[:, None]
+        std = np.atleast_1d(getattr(regressor, '_y_train_std', 1.0))
+        return alpha * std
+
+    def _y_mean(self, regressor):
+        mean = np.atleast_1d(getattr(regressor, '_y_train_mean', 0.0))
+        return np.broadcast_to(mean, (self.ntargets,))
+
+    def predict(self, samples):
+        '''
+        samples: one input vector per model (None to skip a model).
+        Returns a (nmodels, ntargets) array; rows of skipped or
+        missing models are NaN.
+        '''
+        query = self._query
+        for i, x in enumerate(samples):
+            s = self.slices[i]
+            if s is None:
+                continue
+            if x is None:
+                query[s] = self.X[s]
+            else:
+                query[s] = np.asarray(x, dtype=np.float64)[:self.ndim] * \
+                           self.inv_length_scales[i]
+        np.subtract(self.X, query, out=query)
+        np.square(query, out=query)
+        np.dot(query, self._ones, out=self._k)
+        self._k *= -0.5
+        np.exp(self._k, out=self._k)
+        np.dot(self._k, self.alpha, out=self._out)
+        self._out += self.offset
+        pred = self._out.reshape(self.nmodels, self.ntargets).copy()
+        for i, x in enumerate(samples):
+            if x is None or not self.active[i]:
+                pred[i] = np.nan
+        return pred
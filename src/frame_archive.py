@@ -0,0 +1,135 @@
+import ctypes
+import os
+import queue
+import cv2
+import numpy as np
+from multiprocessing import Process, Queue, RawArray
+
+CODECS = ['png', 'video']
+INDEX_FILE = 'index.csv'
+
+
+def archive_writer(path, buffer, slot_size, jobs, done, codec, fps):
+    '''
+    Writer process: encodes the frames handed over in shared memory
+    slots and gives every slot back as soon as it has been encoded
+    '''
+    writers = {}
+    index = open(os.path.join(path, INDEX_FILE), 'w')
+    index.write('stream,target,sample,timestamp,file,frame\n')
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        slot, stream, target, sample, timestamp, shape = job
+        count = int(np.prod(shape))
+        img = np.frombuffer(buffer, dtype=np.uint8, count=count,
+                            offset=slot*slot_size).reshape(shape)
+        if codec == 'video':
+            if stream not in writers:
+                name = stream + '.avi'
+                fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+                writer = cv2.VideoWriter(os.path.join(path, name), fourcc,
+                                         fps, (shape[1], shape[0]),
+                                         len(shape) == 3)
+                writers[stream] = [writer, name, 0]
+            writer, name, frame = writers[stream]
+            writer.write(img)
+            writers[stream][2] += 1
+        else:
+            name = '{}_{:03d}_{:06d}.png'.format(stream, target, sample)
+            frame = 0
+            cv2.imwrite(os.path.join(path, name), img,
+                        [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        done.put(slot)
+        index.write('{},{},{},{:.6f},{},{}\n'.format(
+            stream, target, sample, timestamp, name, frame))
+    for writer, _, _ in writers.values():
+        writer.release()
+    index.close()
+
+
+class FrameArchive():
+
+    '''
+    Keeps calibration frames on disk without holding them in memory
+    or blocking the tracking path:
+    - add() copies a frame into a free slot of a shared memory ring
+      and hands the slot over to a writer process, which encodes it
+      (lossless PNG files or one MJPG video per stream) and returns it
+    - when no slot is free, the frame is dropped (and counted), so
+      memory use is bounded by 'nslots' frames
+    - every frame is listed in index.csv with its stream, target,
+      sample index and capture timestamp
+    '''
+
+    def __init__(self, path, slot_size, nslots=16, codec='png', fps=30):
+        if codec not in CODECS:
+            raise ValueError("unknown frame archive codec: {}".format(codec))
+        self.path = path
+        self.slot_size = slot_size
+        self.buffer = RawArray(ctypes.c_uint8, nslots * slot_size)
+        self.free = list(range(nslots))
+        self.jobs, self.done = Queue(), Queue()
+        self.codec = codec
+        self.fps = fps
+        self.frames = 0
+        self.dropped = 0
+        self.process = None
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        args = (self.path, self.buffer, self.slot_size, self.jobs,
+                self.done, self.codec, self.fps)
+        self.process = Process(target=archive_writer, args=args)
+        self.process.start()
+        return self
+
+    def _reclaim(self):
+        while True:
+            try:
+                self.free.append(self.done.get_nowait())
+            except queue.Empty:
+                return
+
+    def add(self, stream, target, sample, timestamp, img):
+        '''
+        Returns False if the frame had to be dropped
+        '''
+        if self.process is None or img is None:
+            return False
+        if not self.free:
+            self._reclaim()
+        if not self.free or img.nbytes > self.slot_size:
+            self.dropped += 1
+            return False
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        slot = self.free.pop()
+        view = np.frombuffer(self.buffer, dtype=np.uint8, count=img.size,
+                             offset=slot*self.slot_size)
+        view[:] = img.ravel()
+        if timestamp is None:
+            timestamp = np.nan
+        self.jobs.put((slot, stream, target, sample, timestamp, img.shape))
+        self.frames += 1
+        return True
+
+    def close(self, wait=False, timeout=None):
+        '''
+        Lets the writer finish the frames already handed over, and
+        waits for it (up to 'timeout' seconds) only if asked to.
+        Returns False if the writer is still encoding frames (it is
+        not a daemon, so it still completes before the app exits).
+        '''
+        if self.process is None:
+            return True
+        self.jobs.put(None)
+        finished = True
+        if wait:
+            self.process.join(timeout)
+            finished = not self.process.is_alive()
+        if self.dropped > 0:
+            print(">>> Frame archive dropped {} of {} frames".format(
+                self.dropped, self.dropped + self.frames))
+        self.process = None
+        return finished
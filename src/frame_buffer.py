@@ -0,0 +1,229 @@
+import ctypes
+import time
+import numpy as np
+from multiprocessing import Array, Value, Lock, Semaphore
+
+
+DTYPES = (np.uint8, np.uint16, np.float32)
+MAX_READERS = 8
+POLL_INTERVAL = 0.002
+
+
+class FrameHeader(ctypes.Structure):
+
+    '''
+    Fixed-layout header stored alongside every slot of a FrameBuffer.
+    '''
+
+    _fields_ = [('seq',       ctypes.c_int64),
+                ('timestamp', ctypes.c_double),
+                ('height',    ctypes.c_int32),
+                ('width',     ctypes.c_int32),
+                ('channels',  ctypes.c_int32),
+                ('dtype',     ctypes.c_int32),
+                ('valid',     ctypes.c_int32)]
+
+
+class FrameBuffer():
+
+    '''
+    N-slot ring buffer of frames living in shared memory.
+    It is written by exactly one image processing process and read by
+    any number of consumers, in a way that:
+    - the writer never waits for readers (old slots are just overwritten)
+    - each slot carries a header with sequence number, capture timestamp,
+      shape, dtype and a valid flag
+    - readers always get the latest complete frame, and can tell how many
+      frames they missed by comparing sequence numbers
+    - torn reads are detected (seqlock) and retried on a newer slot
+    - every committed frame is signaled, so readers can sleep until a
+      new frame arrives instead of polling: each registered reader
+      (see add_reader) has a semaphore of its own, which commit() only
+      releases, so signaling never waits for (or on) any reader
+    '''
+
+    def __init__(self, mode, channels=3, nslots=4, dtype=np.uint8):
+        w, h = mode[0], mode[1]
+        self.nslots = nslots
+        self.channels = channels
+        self.slot_size = w * h * channels * np.dtype(dtype).itemsize
+        self.data = Array(ctypes.c_uint8, nslots*self.slot_size, lock=False)
+        self.headers = Array(FrameHeader, nslots, lock=False)
+        self.latest = Value(ctypes.c_int64, -1, lock=False)
+        self.readers = Array(ctypes.c_int32, MAX_READERS, lock=False)
+        self.signals = [Semaphore(0) for _ in range(MAX_READERS)]
+        self.readers_lock = Lock()
+        self._pending = None
+
+    def _slot_view(self, slot, shape, dtype):
+        count = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        raw = np.frombuffer(self.data, dtype=np.uint8, count=count,
+                            offset=slot*self.slot_size)
+        return raw.view(dtype).reshape(shape)
+
+    def latest_seq(self):
+        return self.latest.value
+
+    def add_reader(self):
+        '''
+        Reserves a wakeup semaphore for a reader (see wait). Returns its
+        index, or None if all MAX_READERS are taken.
+        '''
+        with self.readers_lock:
+            for i in range(MAX_READERS):
+                if not self.readers[i]:
+                    while self.signals[i].acquire(False):
+                        pass
+                    self.readers[i] = 1
+                    return i
+        return None
+
+    def remove_reader(self, reader):
+        if reader is not None:
+            self.readers[reader] = 0
+
+    def begin_write(self, shape, dtype=np.uint8):
+        '''
+        Returns a writable view of the next slot, so that producers can
+        fill it in place. The frame only becomes visible after commit().
+        '''
+        shape = tuple(shape)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if size > self.slot_size:
+            raise ValueError("frame {} does not fit in slot".format(shape))
+        seq = self.latest.value + 1
+        slot = seq % self.nslots
+        header = self.headers[slot]
+        header.valid = 0
+        header.seq = -1
+        self._pending = (seq, slot, shape, dtype)
+        return self._slot_view(slot, shape, dtype)
+
+    def commit(self, timestamp):
+        seq, slot, shape, dtype = self._pending
+        header = self.headers[slot]
+        header.timestamp = timestamp
+        header.height = shape[0]
+        header.width = shape[1]
+        header.channels = shape[2] if len(shape) > 2 else 1
+        header.dtype = DTYPES.index(dtype)
+        header.seq = seq
+        header.valid = 1
+        self.latest.value = seq
+        self._pending = None
+        for i in range(MAX_READERS):
+            if self.readers[i]:
+                self.signals[i].release()
+        return seq
+
+    def write(self, img, timestamp):
+        slot_img = self.begin_write(img.shape, img.dtype.type)
+        np.copyto(slot_img, img)
+        return self.commit(timestamp)
+
+    def wait(self, since=-1, timeout=None, reader=None):
+        '''
+        Blocks until a frame newer than 'since' is committed.
+        Returns False if the timeout expired first. Registered readers
+        sleep on their semaphore; others poll every POLL_INTERVAL.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.latest.value <= since:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            if reader is None:
+                time.sleep(POLL_INTERVAL if remaining is None
+                           else min(POLL_INTERVAL, remaining))
+            elif not self.signals[reader].acquire(True, remaining):
+                return self.latest.value > since
+        if reader is not None:
+            # frames already seen should not wake the next wait
+            while self.signals[reader].acquire(False):
+                pass
+        return True
+
+    def read(self, since=-1):
+        '''
+        Copies out the latest complete frame newer than 'since'.
+        Returns (img, seq, timestamp), or None if there is no such frame.
+        '''
+        for _ in range(self.nslots):
+            seq = self.latest.value
+            if seq <= since:
+                return None
+            header = self.headers[seq % self.nslots]
+            if not header.valid or header.seq != seq:
+                continue
+            timestamp = header.timestamp
+            if header.channels > 1:
+                shape = (header.height, header.width, header.channels)
+            else:
+                shape = (header.height, header.width)
+            dtype = DTYPES[header.dtype]
+            img = self._slot_view(seq % self.nslots, shape, dtype).copy()
+            if header.valid and header.seq == seq:
+                return img, seq, timestamp
+        return None
+
+    def read_at(self, timestamp):
+        '''
+        Copies out the frame captured at 'timestamp', if it is still in
+        one of the slots. Returns (img, seq, timestamp), or None.
+        '''
+        for slot in range(self.nslots):
+            header = self.headers[slot]
+            seq = header.seq
+            if not header.valid or header.timestamp != timestamp:
+                continue
+            if header.channels > 1:
+                shape = (header.height, header.width, header.channels)
+            else:
+                shape = (header.height, header.width)
+            dtype = DTYPES[header.dtype]
+            img = self._slot_view(slot, shape, dtype).copy()
+            if header.valid and header.seq == seq and \
+               header.timestamp == timestamp:
+                return img, seq, timestamp
+        return None
+
+
+class FrameWaiter():
+
+    '''
+    Follows the FrameBuffer of a camera from one reader thread: it
+    holds a reader slot of the current buffer and, whenever the camera
+    replaces its buffer (e.g., on a source or mode change), moves to the
+    new one and restarts the sequence numbers. 'skipped' counts the
+    frames committed while the reader was not waiting.
+    '''
+
+    def __init__(self):
+        self.frame_buffer = None
+        self.reader = None
+        self.last_seq = -1
+        self.skipped = 0
+
+    def wait(self, frame_buffer, timeout):
+        '''
+        Waits for a frame newer than the last one seen (False if there
+        is none within 'timeout' seconds)
+        '''
+        if frame_buffer is not self.frame_buffer:
+            self.close()
+            self.frame_buffer = frame_buffer
+            self.reader = frame_buffer.add_reader()
+        if not frame_buffer.wait(self.last_seq, timeout, self.reader):
+            return False
+        seq = frame_buffer.latest_seq()
+        if self.last_seq >= 0 and seq > self.last_seq + 1:
+            self.skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        return True
+
+    def close(self):
+        if self.frame_buffer is not None:
+            self.frame_buffer.remove_reader(self.reader)
+        self.frame_buffer, self.reader, self.last_seq = None, None, -1
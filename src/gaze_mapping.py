@@ -0,0 +1,275 @@
+import itertools
+import time
+import numpy as np
+from fast_gp import FastGP
+
+
+class PolynomialMapper():
+
+    '''
+    Polynomial regression of the given order (all monomials up to it),
+    by least squares or, if ridge > 0, by ridge regression
+    '''
+
+    def __init__(self, order=2, ridge=0.0):
+        self.order = order
+        self.ridge = ridge
+        self.ndim = None
+        self.terms = None
+        self.powers = None
+        self.coef = None
+
+    def _features(self, X):
+        X = np.asarray(X, dtype=np.float64)[:,None,:]
+        return np.prod(X ** self.powers, axis=2)
+
+    def fit(self, X, Y, groups=None):
+        self.ndim = np.shape(X)[1]
+        self.terms = [()]
+        for order in range(1, self.order+1):
+            self.terms += list(itertools.combinations_with_replacement(
+                range(self.ndim), order))
+        # exponent of every input dimension in each monomial
+        self.powers = np.zeros((len(self.terms), self.ndim))
+        for i, term in enumerate(self.terms):
+            for j in term:
+                self.powers[i,j] += 1
+        F = self._features(X)
+        if self.ridge > 0:
+            A = F.T @ F + self.ridge * np.eye(F.shape[1])
+            self.coef = np.linalg.solve(A, F.T @ Y)
+        else:
+            self.coef = np.linalg.lstsq(F, Y, rcond=None)[0]
+        return self
+
+    def predict(self, X):
+        return self._features(X) @ self.coef
+
+
+class ThinPlateMapper():
+
+    '''
+    Thin-plate spline RBF interpolation (with a linear polynomial term).
+    Smoothing keeps it from interpolating every noisy sample exactly.
+    '''
+
+    def __init__(self, smoothing=1e-3):
+        self.smoothing = smoothing
+        self.ndim = None
+        self.model = None
+
+    def fit(self, X, Y, groups=None):
+        from scipy.interpolate import RBFInterpolator
+        self.ndim = np.shape(X)[1]
+        self.model = RBFInterpolator(np.asarray(X, dtype=np.float64),
+                                     np.asarray(Y, dtype=np.float64),
+                                     kernel='thin_plate_spline',
+                                     smoothing=self.smoothing * len(X))
+        return self
+
+    def predict(self, X):
+        return self.model(np.asarray(X, dtype=np.float64))
+
+
+class GPMapper():
+
+    '''
+    Gaussian Processes regression with a fixed RBF kernel
+    (former Calibrator._get_clf)
+    '''
+
+    def __init__(self, amplitude=1.5, length_scale=1.0, alpha=1e-5):
+        # sklearn is only imported once a calibration is performed
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process import kernels
+        kernel = amplitude * kernels.RBF(length_scale=length_scale,
+                                         length_scale_bounds=(0,1.0))
+        self.model = GaussianProcessRegressor(alpha=alpha,
+                                              optimizer=None,
+                                              kernel=kernel)
+        self.ndim = None
+
+    def fit(self, X, Y, groups=None):
+        self.ndim = np.shape(X)[1]
+        self.model.fit(X, Y)
+        return self
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+
+class SparseGPMapper():
+
+    '''
+    Sparse (inducing-point) approximation of GPMapper for large
+    calibrations. Samples are summarized into at most 'max_points'
+    inducing points: k-means centers of the eye samples of every
+    target (up to 'per_target' each), targets being given by the
+    target index of every sample ('groups' of fit; without it, all
+    samples are clustered together). The predictive mean is the
+    projected process (DTC) one,
+        y(x) = k(x,Z) (noise*K_ZZ + K_ZX K_XZ)^-1 K_ZX y
+    so fitting is O(n m^2) and prediction O(m) for m inducing points,
+    whatever the number n of samples. It exposes the fitted attributes
+    FastGP relies on (X_train_, alpha_, kernel_, _y_train_mean).
+    '''
+
+    def __init__(self, amplitude=1.5, length_scale=1.0, noise=1e-5,
+                 per_target=8, max_points=256):
+        from sklearn.gaussian_process import kernels
+        self.kernel_ = amplitude * kernels.RBF(length_scale=length_scale)
+        self.noise = noise
+        self.per_target = per_target
+        self.max_points = max_points
+        self.ndim = None
+        self.X_train_ = None
+        self.alpha_ = None
+        self._y_train_mean = 0.0
+
+    def _inducing_points(self, X, groups):
+        from scipy.cluster.vq import kmeans2
+        if groups is not None:
+            _, groups = np.unique(groups, return_inverse=True)
+            groups = groups.ravel()
+        if groups is None or groups.max() + 1 > self.max_points:
+            # a single clustering of all samples
+            groups, ngroups, k = np.zeros(len(X), int), 1, self.max_points
+        else:
+            ngroups = groups.max() + 1
+            k = max(1, min(self.per_target, self.max_points // ngroups))
+        points = []
+        for g in range(ngroups):
+            samples = X[groups == g]
+            if len(samples) <= k:
+                points.append(samples)
+            else:
+                centers, _ = kmeans2(samples, k, minit='++', seed=0)
+                points.append(centers)
+        return np.vstack(points)
+
+    def fit(self, X, Y, groups=None):
+        X = np.asarray(X, dtype=np.float64)
+        Y = np.asarray(Y, dtype=np.float64)
+        self.ndim = X.shape[1]
+        Z = self._inducing_points(X, groups)
+        self._y_train_mean = Y.mean(axis=0)
+        # K_ZZ = L L^T, V = L^-1 K_ZX:
+        # alpha = L^-T (noise*I + V V^T)^-1 V y  (well conditioned)
+        K_zz = self.kernel_(Z)
+        K_zz[np.diag_indices_from(K_zz)] += 1e-8 * K_zz[0,0]
+        L = np.linalg.cholesky(K_zz)
+        V = np.linalg.solve(L, self.kernel_(Z, X))
+        A = V @ V.T
+        A[np.diag_indices_from(A)] += self.noise
+        beta = np.linalg.solve(A, V @ (Y - self._y_train_mean))
+        self.alpha_ = np.linalg.solve(L.T, beta)
+        self.X_train_ = Z
+        return self
+
+    def predict(self, X):
+        K = self.kernel_(np.asarray(X, dtype=np.float64), self.X_train_)
+        return K @ self.alpha_ + self._y_train_mean
+
+
+MAPPERS = {'poly2': (PolynomialMapper, {'order': 2}),
+           'poly3': (PolynomialMapper, {'order': 3}),
+           'ridge': (PolynomialMapper, {'order': 3, 'ridge': 1e-3}),
+           'tps':   (ThinPlateMapper, {}),
+           'gp':    (GPMapper, {}),
+           'sgp':   (SparseGPMapper, {})}
+
+
+def create_mapper(name, **params):
+    '''
+    params override the defaults of the mapping (e.g., the kernel
+    amplitude and length_scale of the GPs)
+    '''
+    if name not in MAPPERS:
+        raise ValueError("unknown gaze mapping: {}".format(name))
+    mapper, defaults = MAPPERS[name]
+    kwargs = dict(defaults)
+    kwargs.update(params)
+    return mapper(**kwargs)
+
+
+class PairPredictor():
+
+    '''
+    Live predictions of a set of mappers (e.g., left and right eyes),
+    with the same interface as FastGP
+    '''
+
+    def __init__(self, mappers):
+        self.mappers = mappers
+        self.active = [m is not None for m in mappers]
+
+    def predict(self, samples):
+        pred = []
+        for mapper, x in zip(self.mappers, samples):
+            if mapper is None or x is None:
+                pred.append(None)
+                continue
+            x = np.asarray(x, dtype=np.float64)[:mapper.ndim]
+            pred.append(mapper.predict(x.reshape(1,-1))[0])
+        fitted = [p for p in pred if p is not None]
+        ntargets = len(fitted[0]) if fitted else 2
+        return np.array([p if p is not None else [np.nan]*ntargets
+                         for p in pred])
+
+
+def pair_predictor(mappers):
+    '''
+    Fastest live predictor for a set of mappers: FastGP when they
+    are all (sparse) GPs, otherwise each mapper on its own
+    '''
+    fitted = [m for m in mappers if m is not None]
+    if not fitted:
+        return None
+    if all([isinstance(m, (GPMapper, SparseGPMapper)) for m in fitted]):
+        return FastGP([_regressor(m) for m in mappers])
+    return PairPredictor(mappers)
+
+
+def _regressor(mapper):
+    if isinstance(mapper, GPMapper):
+        return mapper.model
+    return mapper
+
+
+def evaluate_mapper(name, X_train, Y_train, X_test, Y_test, groups=None):
+    '''
+    Fits a mapper and reports its fit time (ms), per-sample predict
+    latency (us) of its live predictor and held-out error (mean
+    distance, % of the screen). groups: target index of every
+    training sample.
+    '''
+    mapper = create_mapper(name)
+    start = time.perf_counter()
+    mapper.fit(X_train, Y_train, groups)
+    fit_time = time.perf_counter() - start
+    X_test = np.asarray(X_test)
+    predictor = pair_predictor([mapper])
+    start = time.perf_counter()
+    pred = np.vstack([predictor.predict([x]) for x in X_test])
+    predict_time = (time.perf_counter() - start) / len(X_test)
+    error = np.mean(np.linalg.norm(pred[:,:2] - Y_test[:,:2], axis=1))
+    return {'mapping': name,
+            'fit_ms': fit_time * 1000,
+            'predict_us': predict_time * 1e6,
+            'error': error * 100}
+
+
+def compare_mappers(X_train, Y_train, X_test, Y_test, names=None,
+                    groups=None):
+    names = names or sorted(MAPPERS.keys())
+    return [evaluate_mapper(n, X_train, Y_train, X_test, Y_test, groups)
+            for n in names]
+
+
+def format_report(report):
+    lines = ["{:>6} {:>10} {:>12} {:>9}".format(
+        'model', 'fit(ms)', 'predict(us)', 'error(%)')]
+    for r in report:
+        lines.append("{mapping:>6} {fit_ms:>10.2f} {predict_us:>12.1f} "
+                     "{error:>9.3f}".format(**r))
+    return '\n'.join(lines)
@@ -0,0 +1,89 @@
+import time
+from threading import Thread
+from frame_buffer import FrameWaiter
+
+
+class GazeWorker():
+
+    '''
+    Runs gaze prediction in a dedicated thread, once per new eye
+    sample (identified by its capture timestamp), instead of whenever
+    the UI asks for it:
+    - it sleeps on the frame buffer of one of the calibrated eyes
+      until a new frame is committed
+    - the latest sample of every calibrated eye goes through the
+      calibrator's predictor (see Calibrator.update_prediction), which
+      caches the result, stores it and signals the UI
+    - listeners (e.g., network outputs) get every prediction as
+      listener(timestamp, pred)
+    Nothing runs while there is no calibration or no new sample.
+    '''
+
+    def __init__(self, calibrator, leye, reye, timeout=0.02):
+        self.calibrator = calibrator
+        self.eyes = [leye, reye]
+        self.timeout = timeout
+        self.listeners = []
+        self.running = False
+        self.thread = None
+        self.predictions = 0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+
+    def _wait_frame(self, predictor, waiter):
+        '''
+        Sleeps until the first calibrated eye commits a new frame.
+        The other eye is checked at least every 'timeout' seconds.
+        The waiter follows the eye to a new frame buffer whenever it
+        is replaced (e.g., on a camera or mode change).
+        '''
+        for eye, active in zip(self.eyes, predictor.active):
+            frame_buffer = eye.frame_buffer
+            if active and eye.capturing.value and frame_buffer is not None:
+                waiter.wait(frame_buffer, self.timeout)
+                return
+        waiter.close()
+        time.sleep(self.timeout)
+
+    def _run(self):
+        waiter, last_stamps = FrameWaiter(), [None, None]
+        while self.running:
+            predictor = self.calibrator.get_predictor()
+            if predictor is None:
+                waiter.close()
+                last_stamps = [None, None]
+                time.sleep(0.1)
+                continue
+            self._wait_frame(predictor, waiter)
+            samples, stamps = [None, None], [None, None]
+            for i, eye in enumerate(self.eyes):
+                if predictor.active[i]:
+                    samples[i] = eye.get_processed_data()
+                if samples[i] is not None:
+                    stamps[i] = samples[i][-1]
+            if stamps == [None, None] or stamps == last_stamps:
+                continue
+            last_stamps = stamps
+            pred = self.calibrator.update_prediction(samples)
+            self.predictions += 1
+            timestamp = max([s for s in stamps if s is not None])
+            for listener in self.listeners:
+                listener(timestamp, pred)
+        waiter.close()
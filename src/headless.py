@@ -0,0 +1,191 @@
+'''
+Headless pEyeTracker: runs the eye tracking pipeline without Qt
+GUI objects or QML, e.g., on rigs running as services with no display.
+Camera sources, modes and the stored calibration to be used come
+from a config file (see config/headless.ini).
+
+usage (from the src folder):
+    python3 headless.py [config/headless.ini] [--duration seconds]
+'''
+import argparse
+import configparser
+import os
+import socket
+import sys
+import time
+import eye
+import scene
+import calibration
+import calibration_hmd
+import gaze_worker
+import latency
+
+
+class GazeOutput():
+
+    '''
+    Streams gaze data to one of the following targets:
+    - stdout
+    - file:<path>          (CSV lines)
+    - udp:<host>:<port>    (G:lx:ly:rx:ry datagrams)
+    '''
+
+    def __init__(self, target):
+        self.file, self.socket, self.address = None, None, None
+        if target.startswith('file:'):
+            self.file = open(target[5:], 'w')
+        elif target.startswith('udp:'):
+            _, host, port = target.split(':')
+            self.address = (host, int(port))
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.file = sys.stdout
+        if self.file is not None:
+            self.file.write('timestamp,lx,ly,rx,ry\n')
+
+    def write(self, timestamp, pred):
+        if self.socket is not None:
+            msg = 'G:' + ':'.join(['{:.6f}'.format(v) for v in pred])
+            self.socket.sendto(msg.encode(), self.address)
+        else:
+            values = [timestamp] + list(pred)
+            self.file.write(','.join(['{:.6f}'.format(v) for v in values]))
+            self.file.write('\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None and self.file is not sys.stdout:
+            self.file.close()
+        if self.socket is not None:
+            self.socket.close()
+
+
+class HeadlessTracker():
+
+    '''
+    Builds cameras and calibrators from a config file and streams
+    gaze estimation for every new eye sample. It is responsible for:
+    - opening camera streams (uvc sources or video files)
+    - loading a stored calibration
+    - feeding predictions to a GazeOutput or serving HMD requests
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.monitor = latency.LatencyMonitor()
+        self.scene = scene.SceneCamera('scene')
+        self.leye = eye.EyeCamera('left')
+        self.reye = eye.EyeCamera('right')
+        stages = latency.CAMERA_STAGES + latency.GAZE_STAGES
+        self.scene.latency = self.monitor.create('scene', latency.CAMERA_STAGES)
+        self.leye.latency = self.monitor.create('left', stages)
+        self.reye.latency = self.monitor.create('right', stages)
+        self.videos = {}
+        self.calib = None
+
+    def _open_camera(self, cam, section):
+        config = self.config
+        source = config.get(section, 'source', fallback='none')
+        if source == 'none':
+            return False
+        cam.preview = False
+        cam.persistent = False
+        mode = config.get(section, 'mode', fallback=None)
+        if mode is not None:
+            cam.mode = tuple([int(v) for v in mode.split(':')])
+        cam.mono = config.getboolean(section, 'mono', fallback=False)
+        cam.offline_output = config.get(section, 'offline', fallback=None)
+        if section == 'scene':
+            cam.marker_scale = config.getfloat(section, 'marker_scale',
+                                               fallback=1.0)
+        else:
+            cam.mode_3D = self.mode_3D
+            cam.roi_mode = config.getboolean(section, 'roi', fallback=False)
+        if source.isdigit():
+            cam.set_source(int(source))
+            self.videos[cam] = False
+        else:
+            cam.set_video_file(source)
+            cam.play_video_file()
+            self.videos[cam] = True
+        return True
+
+    def start(self):
+        opts = self.config['calibration']
+        if not os.path.isdir(opts['path']):
+            raise ValueError("calibration folder not found: {} (expected "
+                             "data/<session uid>/calibration/, see "
+                             "config/headless.ini)".format(opts['path']))
+        self.mode_3D = opts.getboolean('mode_3D', fallback=False)
+        left = self._open_camera(self.leye, 'left')
+        right = self._open_camera(self.reye, 'right')
+        self._open_camera(self.scene, 'scene')
+        if not (left or right):
+            raise ValueError("at least one eye camera source is required")
+        if opts.get('target', fallback='screen') == 'hmd':
+            self.calib = calibration_hmd.HMDCalibrator(3, 3, 60, 4)
+            self.calib.set_sources(self.leye, self.reye)
+        else:
+            self.calib = calibration.Calibrator(3, 3, 30, 5)
+            self.calib.set_sources(self.scene, self.leye, self.reye)
+        self.calib.mode_3D = self.mode_3D
+        self.calib.load_calibration(opts['path'])
+        return self.leye if left else self.reye
+
+    def stream(self, driver, output, duration=None):
+        '''
+        Predicts gaze once per new eye sample (see GazeWorker) and
+        writes every prediction to the output
+        '''
+        worker = gaze_worker.GazeWorker(self.calib, self.leye, self.reye)
+        worker.add_listener(output.write)
+        worker.start()
+        end = time.monotonic() + duration if duration else None
+        try:
+            while driver.capturing.value:
+                if end is not None and time.monotonic() > end:
+                    break
+                time.sleep(0.1)
+        finally:
+            worker.stop()
+
+    def serve_hmd(self):
+        self.calib.stream = True
+        self.calib.predict()
+
+    def stop(self):
+        for cam, video in self.videos.items():
+            cam.stop(video_file=video)
+        print(">>> Latency:", self.monitor.get_summary(), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='headless pEyeTracker')
+    parser.add_argument('config', nargs='?', default='config/headless.ini')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='stop after this many seconds')
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    if not config.read(args.config):
+        sys.exit("config file not found: {}".format(args.config))
+
+    tracker = HeadlessTracker(config)
+    output = None
+    try:
+        driver = tracker.start()
+        if isinstance(tracker.calib, calibration_hmd.HMDCalibrator):
+            tracker.serve_hmd()
+        else:
+            target = config.get('output', 'target', fallback='stdout')
+            output = GazeOutput(target)
+            tracker.stream(driver, output, args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tracker.stop()
+        if output is not None:
+            output.close()
+
+
+if __name__=='__main__':
+    main()
@@ -6,6 +6,11 @@ import sys
 import time
 import numpy as np
 import ctypes
+from preprocessing import Preprocessor
+from devices import inventory
+from latency import lap, now
+from results import ResultWriter, Throughput
+from video_reader import PrefetchReader
 
 
 class ImageProcessor(Process):
@@ -13,72 +18,202 @@ class ImageProcessor(Process):
     '''
     It provides generic image processing functionality for
     specialized image processing classes, such as gamma
-    adjusment, B&W convertion, etc.
+    adjusment, B&W convertion, etc. (see Preprocessor)
     '''
 
-    def __init__(self, source, mode, pipe, array, cap, pos=None):
+    def __init__(self, source, mode, pipe, buffer, cap, pos=None, 
+                 latency=None):
         Process.__init__(self)
         self.eye_cam = False
         self.source = source
         self.mode = mode
         self.pipe = pipe
-        self.shared_array = array
+        self.frame_buffer = buffer
         self.shared_pos = pos
         self.capturing = cap
-    
-    def get_shared_np_array(self, img):
-        nparray = np.frombuffer(self.shared_array, dtype=ctypes.c_uint8) 
-        return nparray.reshape(img.shape)
-
-    def adjust_gamma(self, img, gamma):
-        lut = np.empty((1,256), np.uint8)
-        for i in range(256):
-            lut[0,i] = np.clip(pow(i/255.0, gamma) * 255.0, 0, 255)
-        return cv2.LUT(img, lut)
-
-    def cvtBlackWhite(self, img, color):
-        if color:
-            return img
-        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    def flip_img(self, img, flip):
-        if flip:
-            return cv2.flip(img, -1)
-        return img
+        self.latency = latency if latency is not None else {}
+        self.clock_offset = 0.0
+        self.mono = buffer.channels == 1
+        self.preprocessor = Preprocessor(mono=self.mono)
+        self.result_fields = None  # --> subclassed property
+        self.throughput = None
+        self.reader = None
+        self.paused = False
+        self.step = 0
+        self.frame_period = 0.0
+        self.next_frame_time = None
+
+    def sync_clock(self):
+        '''
+        Measures the offset between the uvc clock and time.monotonic(),
+        which is the clock used by the rest of the application
+        '''
+        self.clock_offset = uvc.get_time_monotonic() - time.monotonic()
+
+    def get_capture_time(self, frame):
+        return frame.timestamp - self.clock_offset
+
+    def lap(self, stage, start):
+        return lap(self.latency, stage, start)
+
+    def grab(self, frame):
+        '''
+        Picks the Y (gray) plane of an uvc frame in mono mode, which
+        avoids decoding and shipping 3 channels for IR eye images
+        '''
+        if self.mono:
+            return frame.gray
+        return frame.bgr
+
+    def preprocess(self, img):
+        '''
+        Runs the preprocessing stage straight into the next slot of
+        the frame buffer, which is only published on commit
+        '''
+        shape = self.preprocessor.output_shape(img.shape)
+        slot = self.frame_buffer.begin_write(shape)
+        return self.preprocessor.apply(img, slot)
 
     def reset_mode(self, cap):
         print("resetting...")
         mode = cap.frame_mode
         cap.close()
         time.sleep(0.5)
-        dev_list = uvc.device_list()
-        cap2 = uvc.Capture(dev_list[self.source]['uid'])
+        inventory.refresh()
+        cap2 = uvc.Capture(inventory.get_uid(self.source))
         print("Trying mode:", mode)
         cap2.frame_mode = mode
         cap2.bandwidth_factor = 1.3
         return cap2
 
 
-    def process_msg(self, gamma, color, mode_3D=None, flip=None):  
+    def process_msg(self, mode_3D=None):
         loop = True
         if self.pipe.poll():
             msg = self.pipe.recv()
             if msg == "stop": 
                 loop = False
             elif msg == "pause":
-                while msg != "play":
-                    msg = self.pipe.recv()
+                self.paused = True
+            elif msg == "play":
+                self.paused = False
+                self.next_frame_time = None
+            elif msg == "step":
+                self.step = 1
+            elif msg == "seek":
+                self.seek(frame=self.pipe.recv())
+            elif msg == "seek_time":
+                self.seek(timestamp=self.pipe.recv())
             elif msg == "mode_3D":
                 mode_3D = not mode_3D
             elif msg == "gamma":
-                gamma = self.pipe.recv()
+                self.preprocessor.set_gamma(self.pipe.recv())
             elif msg == "color":
-                color = self.pipe.recv()
+                self.preprocessor.color = self.pipe.recv()
             elif msg == "flip":
-                flip = self.pipe.recv()
-        return loop, gamma, color, mode_3D, flip
+                self.preprocessor.flip = self.pipe.recv()
+            elif msg == "reset":
+                self.reset_model()
+            elif msg == "roi":
+                self.toggle_roi()
+        return loop, mode_3D
             
 
+    def open_video(self, realtime=True):
+        '''
+        Starts decoding the video source ahead of processing.
+        Real-time playback is paced at the video frame rate.
+        '''
+        self.reader = PrefetchReader(self.source).start()
+        self.frame_period = 1.0/self.reader.fps if realtime else 0.0
+        self.next_frame_time = None
+        return self.reader
+
+    def next_video_frame(self):
+        '''
+        Next (index, timestamp, frame) to be processed, or None while
+        paused (one frame is let through per step or seek) and at the
+        end of the video (reader.finished), until a seek
+        '''
+        if (self.paused and not self.step) or self.reader.finished:
+            self.pipe.poll(0.1)
+            return None
+        if self.frame_period and self.next_frame_time is not None:
+            delay = self.next_frame_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        item = self.reader.read()
+        self.step = 0
+        t = time.monotonic()
+        if self.next_frame_time is None or t - self.next_frame_time > 0.1:
+            self.next_frame_time = t
+        self.next_frame_time += self.frame_period
+        return item
+
+    def seek(self, frame=None, timestamp=None):
+        if self.reader is None:
+            return
+        self.reader.seek(frame, timestamp)
+        self.next_frame_time = None
+        if self.paused:
+            self.step = 1
+
+    def close_video(self):
+        if self.reader is not None:
+            self.reader.close()
+
+    def run_offline(self, output, mode_3D=False):
+        '''
+        Offline (as fast as possible) processing of a video file:
+        every frame is decoded and processed in order, with no real-time
+        throttle and no dropped frames, and its results are written to
+        'output' along with the original frame index and video timestamp
+        (frames are published with their monotonic processing time)
+        '''
+        self.capturing.value = 1
+        self.setup_offline()
+        self.open_video(realtime=False)
+        writer = ResultWriter(output, self.result_fields)
+        self.throughput = Throughput()
+        loop = True
+        while loop and self.pipe.poll():
+            loop, mode_3D = self.process_msg(mode_3D)
+        while loop and not self.reader.finished:
+            item = self.next_video_frame()
+            if item is None:
+                loop, mode_3D = self.process_msg(mode_3D)
+                continue
+            # video time only goes to the results file: shared memory
+            # (and anything pairing or timing samples) gets capture time
+            index, video_time, frame = item
+            timestamp = now()
+            img = self.preprocess(frame)
+            t = self.lap('preprocess', timestamp)
+            values = self.process_offline(img, timestamp, mode_3D)
+            self.lap('detection', t)
+            writer.write(index, video_time, values)
+            self.frame_buffer.commit(timestamp)
+            self.throughput.count()
+            loop, mode_3D = self.process_msg(mode_3D)
+        self.close_video()
+        writer.close()
+        print("offline processing [source: {}]: {}".format(
+            self.source, self.throughput.summary()))
+        self.capturing.value = 0
+        return self.throughput.summary()
+
+    def setup_offline(self): #abstract
+        return
+
+    def process_offline(self, img, timestamp, mode_3D): #abstract
+        return []
+
+    def reset_model(self): #abstract
+        return
+
+    def toggle_roi(self): #abstract
+        return
+
     def run(self):
         return
 
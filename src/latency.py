@@ -0,0 +1,118 @@
+import ctypes
+import json
+import math
+import time
+import numpy as np
+from multiprocessing import RawArray, RawValue
+
+
+CAMERA_STAGES = ('capture', 'preprocess', 'detection')
+GAZE_STAGES = ('regression', 'output', 'hmd_regression', 'hmd_output')
+
+BINS_PER_DECADE = 20
+MIN_EXP, MAX_EXP = -6, 1
+NBINS = (MAX_EXP - MIN_EXP) * BINS_PER_DECADE + 2
+
+
+def now():
+    '''
+    Clock shared by every timestamp in pEyeTracker. Capture timestamps
+    from uvc are converted to it by the image processing processes.
+    '''
+    return time.monotonic()
+
+
+def lap(histograms, stage, start):
+    '''
+    Records the time elapsed since 'start' for the given stage (if
+    it is instrumented) and returns the current time
+    '''
+    t = now()
+    hist = histograms.get(stage)
+    if hist is not None:
+        hist.record(t - start)
+    return t
+
+
+class LatencyHistogram():
+
+    '''
+    Latency histogram with log-spaced bins (1 us to 10 s) kept in
+    shared memory. It is lock-free: every histogram has a single
+    writer (the process or thread running the stage), while any
+    process can read percentiles from it at any time.
+    '''
+
+    def __init__(self):
+        self.counts = RawArray(ctypes.c_int64, NBINS)
+        self.total = RawValue(ctypes.c_double, 0.0)
+
+    def record(self, seconds):
+        idx = 0
+        if seconds > 0:
+            idx = int((math.log10(seconds) - MIN_EXP) * BINS_PER_DECADE) + 1
+            idx = min(max(idx, 0), NBINS-1)
+        self.counts[idx] += 1
+        self.total.value += seconds
+
+    def _upper_edge(self, idx):
+        idx = min(idx, NBINS-2)
+        return 10 ** (MIN_EXP + idx / BINS_PER_DECADE)
+
+    def summary(self):
+        '''
+        Returns count, mean and p50/p95/p99 in milliseconds
+        (percentiles are upper bin edges)
+        '''
+        counts = np.frombuffer(self.counts, dtype=np.int64).copy()
+        n = int(counts.sum())
+        result = {'count': n}
+        if n == 0:
+            return result
+        cumulative = np.cumsum(counts)
+        for p in (50, 95, 99):
+            idx = int(np.searchsorted(cumulative, n * p / 100.0))
+            result['p{}'.format(p)] = self._upper_edge(idx) * 1000
+        result['mean'] = self.total.value / n * 1000
+        return result
+
+    def reset(self):
+        for i in range(NBINS):
+            self.counts[i] = 0
+        self.total.value = 0.0
+
+
+class LatencyMonitor():
+
+    '''
+    Registry of per-camera, per-stage latency histograms (no Qt
+    dependency, the UI uses latency_ui.QtLatencyMonitor).
+    It provides:
+    - the histograms each camera (and its processes) should fill in
+    - a latency summary
+    - a dump of that summary to a JSON file
+    '''
+
+    def __init__(self):
+        self.histograms = {}
+
+    def create(self, source, stages):
+        hists = {stage: LatencyHistogram() for stage in stages}
+        self.histograms[source] = hists
+        return hists
+
+    def get_summary(self):
+        summary = {}
+        for source, hists in self.histograms.items():
+            summary[source] = {s: h.summary() for s, h in hists.items()}
+        return summary
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.get_summary(), f, indent=2)
+        print(">>> Latency summary saved to", filename)
+
+    def reset(self):
+        for hists in self.histograms.values():
+            for hist in hists.values():
+                hist.reset()
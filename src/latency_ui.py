@@ -0,0 +1,49 @@
+from PySide2.QtCore import QObject, QTimer, Signal, Slot, Property
+import numpy as np
+import latency
+
+
+class QtLatencyMonitor(QObject, latency.LatencyMonitor):
+
+    '''
+    LatencyMonitor exposed to the UI:
+    - latency summary as a QML property, notified (at most every
+      'interval' ms) when new latencies were recorded
+    - dump / reset slots
+    '''
+
+    latency_changed = Signal()
+
+    def __init__(self, interval=1000):
+        QObject.__init__(self)
+        latency.LatencyMonitor.__init__(self)
+        self._count = 0
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._check_changed)
+        self.timer.start(interval)
+
+    def _total_count(self):
+        return sum([int(np.frombuffer(h.counts, dtype=np.int64).sum())
+                    for hists in self.histograms.values()
+                    for h in hists.values()])
+
+    def _check_changed(self):
+        # histograms are filled in by other processes, without signals
+        count = self._total_count()
+        if count != self._count:
+            self._count = count
+            self.latency_changed.emit()
+
+    @Property('QVariantMap', notify=latency_changed)
+    def latency(self):
+        return self.get_summary()
+
+    @Slot(str)
+    def dump(self, filename):
+        super().dump(filename)
+
+    @Slot()
+    def reset(self):
+        super().reset()
+        self._count = 0
+        self.latency_changed.emit()
@@ -2,11 +2,15 @@ import sys
 from PySide2.QtGui import QGuiApplication
 from PySide2.QtQml import QQmlApplicationEngine, qmlRegisterType
 from PySide2.QtCore import QUrl, Property, Signal, QObject, Slot
-import eye
-import scene
+import camera_proc
 import videoio_uvc
 import calibration
 import calibration_hmd
+import latency
+import latency_ui
+import video_sink
+import gaze_worker
+from devices import inventory
 import cv2
 import time
 import numpy as np
@@ -15,17 +19,25 @@ import numpy as np
 if __name__=='__main__':
     app = QGuiApplication(sys.argv)
     engine = QQmlApplicationEngine()
+    qmlRegisterType(video_sink.VideoSink, 'pEyeTracker', 1, 0, 'VideoSink')
     
     videoio   = videoio_uvc.VideoIO_UVC()
+    inventory.start_watcher()
     calib_ctl = calibration.Calibrator(3, 3, 30, 5)
     calib_hmd = calibration_hmd.HMDCalibrator(3, 3, 60, 4) 
 
-    scene_cam = scene.SceneCamera('scene')
-    le_cam    = eye.EyeCamera('left')
-    re_cam    = eye.EyeCamera('right')
+    scene_cam = camera_proc.QtSceneCamera('scene')
+    le_cam    = camera_proc.QtEyeCamera('left')
+    re_cam    = camera_proc.QtEyeCamera('right')
+    monitor   = latency_ui.QtLatencyMonitor()
+    eye_stages = latency.CAMERA_STAGES + latency.GAZE_STAGES
+    scene_cam.latency = monitor.create('scene', latency.CAMERA_STAGES)
+    le_cam.latency    = monitor.create('left', eye_stages)
+    re_cam.latency    = monitor.create('right', eye_stages)
     videoio.set_active_cameras(scene_cam, le_cam, re_cam)
     calib_ctl.set_sources(scene_cam, le_cam, re_cam)
     calib_hmd.set_sources(le_cam, re_cam)
+    gaze = gaze_worker.GazeWorker(calib_ctl, le_cam, re_cam).start()
 
     engine.rootContext().setContextProperty("camManager", videoio)
     engine.rootContext().setContextProperty("sceneCam", scene_cam)
@@ -33,6 +45,7 @@ if __name__=='__main__':
     engine.rootContext().setContextProperty("rightEyeCam", re_cam)
     engine.rootContext().setContextProperty("calibControl", calib_ctl)
     engine.rootContext().setContextProperty("calibHMD", calib_hmd)
+    engine.rootContext().setContextProperty("latencyMonitor", monitor)
     engine.addImageProvider('sceneimg', scene_cam)
     engine.addImageProvider('leyeimg', le_cam)
     engine.addImageProvider('reyeimg', re_cam)
@@ -42,4 +55,8 @@ if __name__=='__main__':
     if not engine.rootObjects():
         sys.exit(-1)
 
-    sys.exit(app.exec_())
\ No newline at end of file
+    status = app.exec_()
+    gaze.stop()
+    calib_ctl.storer.stop_frame_archive()
+    calib_hmd.storer.stop_frame_archive()
+    sys.exit(status)
\ No newline at end of file
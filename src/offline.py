@@ -0,0 +1,78 @@
+'''
+Offline processing of eye or scene videos: every frame is decoded and
+processed as fast as possible (no real-time throttle, no dropped
+frames), and per-frame results are written to a CSV file along with
+the original frame index and timestamp.
+
+usage (from the src folder):
+    python3 offline.py eye video.mp4 [-o results.csv] [--3d] [--roi]
+    python3 offline.py scene video.mp4 [-o results.csv]
+'''
+import argparse
+import os
+import cv2
+from multiprocessing import Pipe, RawValue, Value
+from frame_buffer import FrameBuffer
+
+
+def video_mode(filename):
+    cap = cv2.VideoCapture(filename)
+    w = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    h = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    f = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return (int(w), int(h), int(f))
+
+
+def create_processor(kind, filename, mono=False, roi=False, latency=None):
+    '''
+    Builds the image processor of a camera type for a video file, to
+    be run in the calling process (i.e., with no camera object around)
+    '''
+    mode = video_mode(filename)
+    buffer = FrameBuffer(mode, channels=1 if mono else 3)
+    pipe, _ = Pipe()
+    capturing = Value('i', 0)
+    if kind == 'eye':
+        from eye_img_processor import EyeImageProcessor, PupilData
+        processor = EyeImageProcessor(filename, mode, pipe, buffer, 
+                                      capturing, RawValue(PupilData), latency)
+        processor.roi_mode = roi
+    else:
+        from scene_img_processor import SceneImageProcessor, MarkerTable
+        processor = SceneImageProcessor(filename, mode, pipe, buffer, 
+                                        capturing, RawValue(MarkerTable),
+                                        latency)
+    return processor
+
+
+def process_video(kind, filename, output, mode_3D=False, mono=False, 
+                  roi=False):
+    processor = create_processor(kind, filename, mono, roi)
+    return processor.run_offline(output, mode_3D)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline video processing')
+    parser.add_argument('kind', choices=['eye', 'scene'])
+    parser.add_argument('video')
+    parser.add_argument('-o', '--output', default=None,
+                        help='results file (default: <video>.csv)')
+    parser.add_argument('--3d', dest='mode_3D', action='store_true',
+                        help='3D eye model')
+    parser.add_argument('--roi', action='store_true',
+                        help='pupil ROI tracking')
+    parser.add_argument('--mono', action='store_true',
+                        help='single-channel processing')
+    args = parser.parse_args()
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.video)[0] + '.csv'
+    summary = process_video(args.kind, args.video, output, args.mode_3D,
+                            args.mono, args.roi)
+    print("{} frames in {:.2f}s: {:.1f} fps -> {}".format(
+        summary['frames'], summary['seconds'], summary['fps'], output))
+
+
+if __name__=='__main__':
+    main()
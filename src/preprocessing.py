@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+
+class Preprocessor():
+
+    '''
+    Fused preprocessing stage (gamma, B&W conversion and flip) used by
+    the image processing processes. It:
+    - caches the gamma LUT until a different gamma value is set
+    - skips steps that would leave the image unchanged
+    - writes its output directly into a destination buffer (i.e., a
+      FrameBuffer slot), reusing preallocated scratch buffers in between
+    - always outputs single-channel images in mono mode, whatever
+      the color setting is
+    '''
+
+    def __init__(self, gamma=1.0, color=True, flip=False, mono=False):
+        self.gamma = None
+        self.lut = None
+        self.color = color
+        self.flip = flip
+        self.mono = mono
+        self._scratch = {}
+        self.set_gamma(gamma)
+
+    def set_gamma(self, gamma):
+        if gamma == self.gamma:
+            return
+        self.gamma = gamma
+        self.lut = None
+        if gamma != 1.0:
+            x = np.arange(256) / 255.0
+            lut = np.clip(np.power(x, gamma) * 255.0, 0, 255)
+            self.lut = lut.astype(np.uint8).reshape(1,256)
+
+    def _to_gray(self, shape):
+        return (self.mono or not self.color) and len(shape) > 2
+
+    def output_shape(self, shape):
+        if self._to_gray(shape):
+            return shape[:2]
+        return shape
+
+    def _get_scratch(self, step, shape):
+        buf = self._scratch.get(step)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, np.uint8)
+            self._scratch[step] = buf
+        return buf
+
+    def apply(self, src, dst):
+        gray = self._to_gray(src.shape)
+        img = src
+        if self.lut is not None:
+            out = dst
+            if gray or self.flip:
+                out = self._get_scratch('gamma', src.shape)
+            cv2.LUT(img, self.lut, dst=out)
+            img = out
+        if gray:
+            out = dst
+            if self.flip:
+                out = self._get_scratch('gray', src.shape[:2])
+            cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=out)
+            img = out
+        if self.flip:
+            cv2.flip(img, -1, dst=dst)
+            img = dst
+        if img is not dst:
+            np.copyto(dst, img)
+        return dst
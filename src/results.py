@@ -0,0 +1,46 @@
+import time
+
+EYE_FIELDS = ['frame', 'timestamp', 'confidence', 'x', 'y', 'major',
+              'minor', 'angle', 'nx', 'ny', 'nz', 'model_confidence']
+SCENE_FIELDS = ['frame', 'timestamp', 'x', 'y', 'id', 'markers']
+
+
+class ResultWriter():
+
+    '''
+    Writes per-frame processing results of a video as CSV lines,
+    keyed by the original frame index and timestamp (in seconds)
+    '''
+
+    def __init__(self, filename, fields):
+        self.fields = fields
+        self.file = open(filename, 'w')
+        self.file.write(','.join(fields) + '\n')
+
+    def write(self, frame, timestamp, values):
+        row = [str(frame), '{:.6f}'.format(timestamp)]
+        row += ['{:.6f}'.format(v) for v in values]
+        self.file.write(','.join(row) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Throughput():
+
+    '''
+    Frames per second of an offline run
+    '''
+
+    def __init__(self):
+        self.frames = 0
+        self.start = time.monotonic()
+        self.elapsed = 0.0
+
+    def count(self):
+        self.frames += 1
+        self.elapsed = time.monotonic() - self.start
+
+    def summary(self):
+        fps = self.frames / self.elapsed if self.elapsed > 0 else 0.0
+        return {'frames': self.frames, 'seconds': self.elapsed, 'fps': fps}
@@ -0,0 +1,164 @@
+import collections
+import numpy as np
+from frame_buffer import FrameWaiter
+
+
+class StreamBuffer():
+
+    '''
+    Last 'size' samples of one stream ([..., timestamp] arrays),
+    indexed by their capture timestamp. Samples that are not newer
+    than the last one (i.e., the same frame read twice) are ignored.
+    '''
+
+    def __init__(self, size=256):
+        self.times = np.full(size, np.nan)
+        self.values = [None] * size
+        self.count = 0
+        self.latest = -np.inf
+
+    def add(self, sample):
+        if sample is None or sample[-1] <= self.latest:
+            return False
+        slot = self.count % len(self.values)
+        self.times[slot] = sample[-1]
+        self.values[slot] = sample
+        self.latest = sample[-1]
+        self.count += 1
+        return True
+
+    def nearest(self, timestamp):
+        '''
+        Returns the sample closest in time and its distance (seconds)
+        '''
+        if self.count == 0:
+            return None, np.inf
+        dt = np.abs(self.times - timestamp)
+        slot = int(np.nanargmin(dt))
+        return self.values[slot], dt[slot]
+
+
+class SampleJoiner():
+
+    '''
+    Nearest-timestamp join of a driver stream (one eye) with the other
+    streams (the other eye, the scene camera). Every driver sample
+    yields at most one matched tuple:
+    - it waits until every other stream has a sample at least as
+      recent, or until the driver is 'tolerance' seconds ahead of it
+    - it then takes the nearest sample of every other stream, and
+      is matched only if all of them are within 'tolerance'
+    '''
+
+    def __init__(self, streams, driver, tolerance):
+        self.streams = list(streams)
+        self.driver = driver
+        self.tolerance = tolerance
+        self.buffers = {name: StreamBuffer() for name in self.streams}
+        self.pending = collections.deque()
+        self.offered = 0
+        self.matched = 0
+        self.missed = {name: 0 for name in self.streams}
+        self.offsets = {name: 0.0 for name in self.streams}
+
+    def add(self, name, sample):
+        if self.buffers[name].add(sample) and name == self.driver:
+            self.pending.append(sample)
+            self.offered += 1
+
+    def _ready(self, timestamp):
+        if self.buffers[self.driver].latest - timestamp > self.tolerance:
+            return True
+        return all([self.buffers[n].latest >= timestamp
+                    for n in self.streams if n != self.driver])
+
+    def join(self):
+        '''
+        Returns the matched tuples ({stream: sample}) resolved so far
+        '''
+        matches = []
+        while self.pending and self._ready(self.pending[0][-1]):
+            sample = self.pending.popleft()
+            match, offsets = {self.driver: sample}, {}
+            for name in self.streams:
+                if name == self.driver:
+                    continue
+                other, dt = self.buffers[name].nearest(sample[-1])
+                if dt > self.tolerance:
+                    self.missed[name] += 1
+                    match = None
+                    break
+                match[name], offsets[name] = other, dt
+            if match is not None:
+                self.matched += 1
+                for name, dt in offsets.items():
+                    self.offsets[name] += dt
+                matches.append(match)
+        return matches
+
+    def summary(self):
+        rate = self.matched / self.offered if self.offered else 0.0
+        offsets = {name: self.offsets[name] / self.matched * 1000
+                   for name in self.streams
+                   if name != self.driver and self.matched}
+        return {'samples': self.offered, 'matched': self.matched,
+                'match_rate': rate, 'missed': self.missed,
+                'mean_offset_ms': offsets}
+
+
+class SampleCollector():
+
+    '''
+    Collects synchronized (scene, left eye, right eye) samples at the
+    pace of the eye cameras: it sleeps on the frame buffer of the first
+    active eye, reads the latest sample of every active camera on each
+    new frame, and joins them by capture timestamp (see SampleJoiner).
+    Frames committed while it was not looking (sequence gaps) are
+    counted as skipped.
+    '''
+
+    def __init__(self, scene, leye, reye, tolerance, timeout=0.05):
+        self.cameras = collections.OrderedDict()
+        for name, cam in (('left', leye), ('right', reye), ('scene', scene)):
+            if cam is not None and cam.is_cam_active():
+                self.cameras[name] = cam
+        self.joiner = None
+        self.driver = None
+        if 'left' in self.cameras or 'right' in self.cameras:
+            self.driver = next(iter(self.cameras))
+            self.joiner = SampleJoiner(self.cameras.keys(), self.driver,
+                                       tolerance)
+        self.timeout = timeout
+        self.waiter = FrameWaiter()
+
+    def poll(self):
+        '''
+        Waits for the next eye frame and returns the (scene, left,
+        right) tuples matched so far (None for inactive cameras)
+        '''
+        if self.joiner is None:
+            return []
+        frame_buffer = self.cameras[self.driver].frame_buffer
+        if frame_buffer is None or \
+           not self.waiter.wait(frame_buffer, self.timeout):
+            return []
+        for name, cam in self.cameras.items():
+            sample = cam.get_processed_data()
+            if name == 'scene' and sample is not None and not sample.any():
+                sample = None # no marker detected yet
+            self.joiner.add(name, sample)
+        return [(m.get('scene'), m.get('left'), m.get('right'))
+                for m in self.joiner.join()]
+
+    def summary(self):
+        if self.joiner is None:
+            return {}
+        summary = self.joiner.summary()
+        summary['skipped'] = self.waiter.skipped
+        return summary
+
+    def close(self):
+        '''
+        Gives the reader slot of the frame buffer back
+        '''
+        self.waiter.close()
@@ -2,17 +2,18 @@ import cv2
 import numpy as np
 import time
 import sys
-import camera_proc as camera
-from scene_img_processor import SceneImageProcessor
-from multiprocessing import Array, Process
+import camera_core
+from devices import inventory
+from scene_img_processor import SceneImageProcessor, MarkerTable
+from scene_img_processor import NMARKERS, marker_to_dict
+from multiprocessing import Process, RawValue
 import ctypes
-import uvc
 
 
-class SceneCamera(camera.Camera):
+class SceneCamera(camera_core.CameraCore):
 
     '''
-    This is the specialized scene camera extention of the Camera class.
+    This is the specialized scene camera extention of the CameraCore class.
     It is responsible for:
     - starting / stoping scene image processing independent tasks
     - tracking ARUCO markers on screen
@@ -24,44 +25,90 @@ class SceneCamera(camera.Camera):
         self.mode = mode
         self.cam_process = None
         self.vid_process = None
-        self.shared_array = self.create_shared_array(mode)
+        self.frame_buffer = self.create_frame_buffer(mode)
         self.shared_pos = self.create_shared_pos()
+        self.marker_scale = 1.0
+        self.marker_rescan = 30
 
-    def init_process(self, source, pipe, array, pos, mode, cap):
+    def init_process(self, source, pipe, buffer, pos, mode, cap):
         mode = self.check_mode_availability(source, mode)
         self.cam_process = SceneImageProcessor(source, mode, pipe, 
-                                               array, cap, pos)
+                                               buffer, cap, pos, 
+                                               self.latency)
+        self._setup_marker_detection()
         self.cam_process.start()  
 
-    def init_vid_process(self, source, pipe, array, pos, mode, cap):
+    def init_vid_process(self, source, pipe, buffer, pos, mode, cap):
         mode = self.check_mode_availability(source, mode)
         self.cam_process = SceneImageProcessor(source, mode, pipe,
-                                             array, cap, pos)
-        self.vid_process = Process(target=self.cam_process.run_vid, args=())
+                                             buffer, cap, pos, 
+                                             self.latency)
+        self._setup_marker_detection()
+        target, args = self.video_target(self.cam_process)
+        self.vid_process = Process(target=target, args=args)
         self.vid_process.start()    
 
+    def _setup_marker_detection(self):
+        self.cam_process.marker_scale = self.marker_scale
+        self.cam_process.marker_rescan = self.marker_rescan
+
     def join_process(self):
         self.cam_process.join(10)
 
     def join_vid_process(self):
         self.vid_process.join(3)
 
-    def create_shared_array(self, mode):
-        w = mode[0]
-        h = mode[1]
-        return Array(ctypes.c_uint8, h*w*3, lock=False)
-
     def create_shared_pos(self):
-        return Array(ctypes.c_float, 3, lock=False)
+        return RawValue(MarkerTable)
+
+    def get_processed_data(self):
+        '''
+        [x, y, timestamp] of the calibration target, i.e., the first
+        marker detected in the last frame where any marker was found
+        '''
+        table = self.shared_pos.snapshot()
+        if table is None:
+            return None
+        entry = table.markers[table.first_id]
+        return np.array([entry.center[0], entry.center[1], entry.timestamp])
+
+    def get_marker(self, marker_id):
+        '''
+        Last known state of a marker (None if it was never seen)
+        '''
+        if marker_id < 0 or marker_id >= NMARKERS:
+            return None
+        entry = self.shared_pos.entry(marker_id)
+        if entry is None or entry.timestamp == 0:
+            return None
+        return marker_to_dict(marker_id, entry)
+
+    def get_markers(self):
+        '''
+        Markers detected in the last frame, by id
+        '''
+        table = self.shared_pos.snapshot()
+        markers = {}
+        if table is None:
+            return markers
+        for i in range(table.count):
+            marker_id = table.ids[i]
+            markers[marker_id] = marker_to_dict(marker_id, 
+                                                table.markers[marker_id])
+        return markers
+
+    def get_detection_time(self):
+        return self.shared_pos.detection_time
 
     def check_mode_availability(self, source, mode):
-        dev_list = uvc.device_list()
-        cap = uvc.Capture(dev_list[source]['uid'])
+        if not isinstance(source, int):
+            return mode
+        avaible_modes = inventory.get_modes(source)
         # m = (mode[1], mode[0], mode[2])
-        if mode not in cap.avaible_modes:
-            m = cap.avaible_modes[0]
+        if mode not in avaible_modes:
+            m = avaible_modes[0]
             mode = (m[1], m[0], m[2])
-            self.shared_array = self.create_shared_array(mode)
+            self.frame_buffer = self.create_frame_buffer(mode)
             self.mode = mode
         return mode
         
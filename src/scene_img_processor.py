@@ -3,82 +3,188 @@ import numpy as np
 import img_processor as imp
 import time
 import uvc
+from devices import inventory
+from results import SCENE_FIELDS
+from aruco_detector import MarkerDetector
 import ctypes
 
+NMARKERS = 50 # --> ids of cv2.aruco.DICT_4X4_50
+
+
+class MarkerEntry(ctypes.Structure):
+
+    '''
+    Last known state of one ArUco marker (normalized coordinates)
+    '''
+
+    _fields_ = [('timestamp', ctypes.c_double), # --> last time it was seen
+                ('visible',   ctypes.c_int32),  # --> seen in the last frame
+                ('center',    ctypes.c_double * 2),
+                ('corners',   ctypes.c_double * 8)]
+
+
+class MarkerTable(ctypes.Structure):
+
+    '''
+    Fixed-capacity table of the markers detected by a SceneImageProcessor
+    (writer), shared with its SceneCamera (reader) and indexed by marker
+    id, so any marker can be looked up without running detection again.
+    'ids' lists the 'count' markers found in the last frame, in detection
+    order. Same sequence counter protocol as PupilData (snapshot and
+    entry return None if no consistent copy could be read).
+    '''
+
+    _fields_ = [('seq',            ctypes.c_int64),
+                ('timestamp',      ctypes.c_double),
+                ('detection_time', ctypes.c_double),
+                ('count',          ctypes.c_int32),
+                ('first_id',       ctypes.c_int32),
+                ('ids',            ctypes.c_int32 * NMARKERS),
+                ('markers',        MarkerEntry * NMARKERS)]
+
+    def snapshot(self, retries=500):
+        for _ in range(retries):
+            seq = self.seq
+            if seq % 2 == 0:
+                data = MarkerTable.from_buffer_copy(self)
+                if self.seq == seq:
+                    return data
+        return None
+
+    def entry(self, marker_id, retries=500):
+        for _ in range(retries):
+            seq = self.seq
+            if seq % 2 == 0:
+                data = MarkerEntry.from_buffer_copy(self.markers[marker_id])
+                if self.seq == seq:
+                    return data
+        return None
+
+
+def marker_to_dict(marker_id, entry):
+    return {'id': marker_id,
+            'visible': bool(entry.visible),
+            'timestamp': entry.timestamp,
+            'center': list(entry.center),
+            'corners': [list(entry.corners[i:i+2]) for i in range(0,8,2)]}
+
+
 class SceneImageProcessor(imp.ImageProcessor):
 
     '''
     It runs specialized image processing tasks for the scene camera
-    as a separate process
+    as a separate process, including:
+    - ArUco marker detection (see MarkerDetector)
+    - publishing every detected marker to the shared MarkerTable
     '''
 
-    def __init__(self, source, mode, pipe, array, cap, pos):
-        super().__init__(source, mode, pipe, array, cap, pos)
+    def __init__(self, source, mode, pipe, buffer, cap, pos, latency=None):
+        super().__init__(source, mode, pipe, buffer, cap, pos, latency)
+        self.result_fields = SCENE_FIELDS
+        self.marker_detector = None
+        self.marker_scale = 1.0  # --> downscaled first pass, if < 1
+        self.marker_rescan = 30  # --> frames between full-frame scans
 
     
+    def _setup_detector(self):
+        self.marker_detector = MarkerDetector(scale=self.marker_scale,
+                                              rescan=self.marker_rescan)
+
+    def _print_marker_summary(self):
+        print("scene markers [source: {}]: {}".format(
+            self.source, self.marker_detector.summary()))
+
     def run_vid(self):
         self.capturing.value = 1
-        cap = cv2.VideoCapture(self.source)
-        gamma, color, delay, loop = 1, True, 1/self.mode[2], True
-        while cap.isOpened() and loop:
-            ret, frame = cap.read()
-            if ret:
-                img = self.adjust_gamma(frame, gamma)
-                img = self.cvtBlackWhite(img, color)
-                img, pos = self.process(img)
-                if img is not None:
-                    shared_img = self.get_shared_np_array(img)
-                    shared_pos = np.frombuffer(self.shared_pos,
-                                               dtype=ctypes.c_float)
-                    np.copyto(shared_img, img)
-                    if pos is not None:
-                        np.copyto(shared_pos, pos)
-                time.sleep(delay)
-            loop, gamma, color, _, _ = self.process_msg(gamma, color)
-        cap.release()
+        self._setup_detector()
+        self.open_video()
+        loop = True
+        while loop:
+            item = self.next_video_frame()
+            if item is not None:
+                timestamp = time.monotonic()
+                img = self.preprocess(item[2])
+                t = self.lap('preprocess', timestamp)
+                self.process(img, timestamp)
+                self.lap('detection', t)
+                self.frame_buffer.commit(timestamp)
+            loop, _ = self.process_msg()
+        self.close_video()
+        self._print_marker_summary()
         self.capturing.value = 0
 
     
     def run(self):
         self.capturing.value = 1
-        dev_list = uvc.device_list()
-        cap = uvc.Capture(dev_list[self.source]['uid'])
+        self._setup_detector()
+        cap = uvc.Capture(inventory.get_uid(self.source))
         cap.frame_mode = self.mode
+        self.sync_clock()
         attempt, attempts, loop = 0, 4, True
-        gamma, color = 1, True
         while attempt < attempts and loop:     
             try:
-                frame    = cap.get_frame(2.0)
-                img      = self.adjust_gamma(frame.bgr, gamma)
-                img      = self.cvtBlackWhite(img, color)  
-                img, pos = self.process(img)   
-                if img is not None:
-                    attempt = 0
-                    shared_img = self.get_shared_np_array(img)
-                    shared_pos = np.frombuffer(self.shared_pos, 
-                                               dtype=ctypes.c_float)
-                    np.copyto(shared_img, img)
-                    if pos is not None:
-                        np.copyto(shared_pos, pos)
+                frame     = cap.get_frame(2.0)
+                timestamp = self.get_capture_time(frame)
+                t         = self.lap('capture', timestamp)
+                img       = self.preprocess(self.grab(frame))
+                t         = self.lap('preprocess', t)
+                self.process(img, timestamp)
+                attempt   = 0
+                self.lap('detection', t)
+                self.frame_buffer.commit(timestamp)
             except Exception as e:
                 print("error:", e)
                 cap = self.reset_mode(cap)
                 attempt += 1           
-            loop, gamma, color, _, _ = self.process_msg(gamma, color)
+            loop, _ = self.process_msg()
         self.capturing.value = 0
+        self._print_marker_summary()
         print("scene camera closed [source: {}]".format(self.source))
         
 
-    def process(self, img):
+    def setup_offline(self):
+        self._setup_detector()
+
+    def process_offline(self, img, timestamp, mode_3D):
+        self.process(img, timestamp)
+        table = self.shared_pos
+        if table.count == 0:
+            return [np.nan, np.nan, np.nan, 0]
+        center = table.markers[table.first_id].center
+        return [center[0], center[1], table.first_id, table.count]
+
+    def _publish(self, corners, ids, timestamp, width, height):
+        table = self.shared_pos
+        table.seq += 1
+        table.timestamp = timestamp
+        table.detection_time = self.marker_detector.last_time
+        for i in range(table.count):
+            table.markers[table.ids[i]].visible = 0
+        count = 0
+        if ids is not None:
+            size = np.array([width, height], np.float64)
+            for c, marker_id in zip(corners, ids.ravel()):
+                if marker_id < 0 or marker_id >= NMARKERS:
+                    continue
+                entry = table.markers[marker_id]
+                if entry.visible:
+                    continue
+                points = c.reshape(4,2) / size
+                entry.timestamp = timestamp
+                entry.visible = 1
+                entry.center[:] = points.mean(axis=0)
+                entry.corners[:] = points.ravel()
+                table.ids[count] = marker_id
+                count += 1
+        table.count = count
+        if count > 0:
+            table.first_id = table.ids[0]
+        table.seq += 1
+
+    def process(self, img, timestamp):
         height, width = img.shape[0], img.shape[1]
-        dict4 = cv2.aruco.DICT_4X4_50
-        aruco_dict = cv2.aruco.getPredefinedDictionary(dict4)
-        corners, ids,_ = cv2.aruco.detectMarkers(img, aruco_dict)
-        target_pos = None
+        corners, ids = self.marker_detector.detect(img)
         if ids is not None:
             cv2.aruco.drawDetectedMarkers(img, corners, ids)
-            mean = np.mean(corners[0][0], axis=0)
-            x = mean[0]/width
-            y = mean[1]/height
-            target_pos = np.array([x,y,time.monotonic()],dtype='float32')
-        return img, target_pos
\ No newline at end of file
+        self._publish(corners, ids, timestamp, width, height)
+        return img
\ No newline at end of file
@@ -0,0 +1,184 @@
+import os
+import queue
+import time
+import numpy as np
+from threading import Thread
+
+SESSION_DTYPE = np.dtype([('timestamp',    'f8'),
+                          ('l_timestamp',  'f8'),
+                          ('r_timestamp',  'f8'),
+                          ('l_raw',        'f4', 3),
+                          ('r_raw',        'f4', 3),
+                          ('l_gaze',       'f4', 3),
+                          ('r_gaze',       'f4', 3),
+                          ('l_confidence', 'f4'),
+                          ('r_confidence', 'f4')])
+INDEX_FILE = 'index.csv'
+
+
+def _fill(values, size):
+    '''
+    Pads (with NaN) or truncates values to a fixed number of columns
+    '''
+    row = np.full(size, np.nan)
+    if values is not None:
+        values = np.asarray(values, dtype=np.float64).ravel()[:size]
+        row[:len(values)] = values
+    return row
+
+
+class SessionRecorder():
+
+    '''
+    Streams session data (one fixed-width SESSION_DTYPE record per gaze
+    prediction) to disk from a background thread:
+    - append() only enqueues the record, so the caller never blocks
+      (records are dropped, and counted, if the writer falls behind
+      by more than 'backlog' records)
+    - records go into chunk files of 'chunk_size' records, which are
+      raw arrays that can be memory-mapped (see read_session)
+    - every 'flush_interval' seconds the current chunk is flushed and
+      the index file (chunk name, records, first/last timestamp) is
+      rewritten, so a crash loses at most that much data
+    '''
+
+    def __init__(self, path, chunk_size=65536, flush_interval=1.0,
+                 backlog=100000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(backlog)
+        self.chunks = []
+        self.chunk = None
+        self.count = 0
+        self.records = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.running = True
+        self.thread = Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def append(self, timestamp, l_gaze, r_gaze, l_raw, r_raw,
+               l_timestamp=None, r_timestamp=None,
+               l_confidence=None, r_confidence=None):
+        record = (timestamp, l_timestamp, r_timestamp, l_raw, r_raw,
+                  l_gaze, r_gaze, l_confidence, r_confidence)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _new_chunk(self):
+        self._close_chunk()
+        name = 'chunk_{:05d}.bin'.format(len(self.chunks))
+        self.chunk = np.memmap(os.path.join(self.path, name),
+                               dtype=SESSION_DTYPE, mode='w+',
+                               shape=(self.chunk_size,))
+        self.chunks.append([name, 0, np.nan, np.nan])
+        self.count = 0
+
+    def _close_chunk(self):
+        if self.chunk is None:
+            return
+        self.chunk.flush()
+        filename = self.chunk.filename
+        del self.chunk
+        self.chunk = None
+        # the last chunk is usually not full
+        os.truncate(filename, self.count * SESSION_DTYPE.itemsize)
+
+    def _write(self, record):
+        if self.chunk is None or self.count == self.chunk_size:
+            self._new_chunk()
+        row = self.chunk[self.count]
+        row['timestamp'] = record[0]
+        row['l_timestamp'] = np.nan if record[1] is None else record[1]
+        row['r_timestamp'] = np.nan if record[2] is None else record[2]
+        row['l_raw'] = _fill(record[3], 3)
+        row['r_raw'] = _fill(record[4], 3)
+        row['l_gaze'] = _fill(record[5], 3)
+        row['r_gaze'] = _fill(record[6], 3)
+        row['l_confidence'] = np.nan if record[7] is None else record[7]
+        row['r_confidence'] = np.nan if record[8] is None else record[8]
+        info = self.chunks[-1]
+        if self.count == 0:
+            info[2] = record[0]
+        info[1], info[3] = self.count + 1, record[0]
+        self.count += 1
+        self.records += 1
+
+    def _write_index(self):
+        filename = os.path.join(self.path, INDEX_FILE)
+        with open(filename + '.tmp', 'w') as f:
+            f.write('chunk,records,start,end\n')
+            for name, records, start, end in self.chunks:
+                f.write('{},{},{:.6f},{:.6f}\n'.format(name, records,
+                                                       start, end))
+        os.replace(filename + '.tmp', filename)
+
+    def _flush(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+        self._write_index()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while self.running or not self.queue.empty():
+            try:
+                self._write(self.queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_flush:
+                self._flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self._close_chunk()
+        self._write_index()
+
+    def close(self):
+        '''
+        Writes whatever is still queued and closes the files
+        '''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.dropped > 0:
+            print(">>> Session recorder dropped {} records".format(
+                self.dropped))
+
+
+def read_index(path):
+    chunks = []
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        f.readline()
+        for line in f:
+            name, records, start, end = line.strip().split(',')
+            chunks.append((name, int(records), float(start), float(end)))
+    return chunks
+
+
+def read_session(path, start=None, end=None):
+    '''
+    Records of a session recorded in 'path' with start <= timestamp
+    <= end. Only chunks overlapping the time range are read (mapped).
+    '''
+    start = -np.inf if start is None else start
+    end = np.inf if end is None else end
+    parts = []
+    for name, records, first, last in read_index(path):
+        if records == 0 or last < start or first > end:
+            continue
+        data = np.memmap(os.path.join(path, name), dtype=SESSION_DTYPE,
+                         mode='r', shape=(records,))
+        ts = data['timestamp']
+        i = np.searchsorted(ts, start, 'left')
+        j = np.searchsorted(ts, end, 'right')
+        parts.append(np.array(data[i:j]))
+    if not parts:
+        return np.empty(0, dtype=SESSION_DTYPE)
+    return np.concatenate(parts)
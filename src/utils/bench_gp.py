@@ -0,0 +1,52 @@
+'''
+Micro-benchmark of single-sample gaze prediction. It compares one
+sklearn GaussianProcessRegressor.predict call per eye against a single
+FastGP call for both eyes, and checks both give the same output.
+
+usage (from the src folder): python3 utils/bench_gp.py
+'''
+import os
+import sys
+import time
+import numpy as np
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process import kernels
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fast_gp import FastGP
+
+
+def get_clf():
+    kernel = 1.5*kernels.RBF(length_scale=1.0, length_scale_bounds=(0,1.0))
+    return GaussianProcessRegressor(alpha=1e-5, optimizer=None, 
+                                    kernel=kernel)
+
+
+def timeit(func, samples):
+    func(samples[0])
+    start = time.perf_counter()
+    for sample in samples:
+        func(sample)
+    return (time.perf_counter() - start) / len(samples) * 1e6
+
+
+if __name__=="__main__":
+    rnd = np.random.RandomState(0)
+    print("{:>5} {:>8} {:>13} {:>11} {:>8} {:>10}".format(
+        'dims', 'samples', 'sklearn(us)', 'fast(us)', 'speedup', 'max diff'))
+    for ndim in (2, 3):
+        for ntargets, per_target in [(9, 30), (16, 60)]:
+            n = ntargets * per_target
+            targets = rnd.rand(n, 2)
+            left = get_clf().fit(rnd.rand(n, ndim), targets)
+            right = get_clf().fit(rnd.rand(n, ndim), targets)
+            fast = FastGP([left, right])
+            samples = [(rnd.rand(ndim), rnd.rand(ndim)) for _ in range(500)]
+            sk = lambda s: (left.predict(s[0].reshape(1,-1)), 
+                            right.predict(s[1].reshape(1,-1)))
+            t_sk = timeit(sk, samples)
+            t_fast = timeit(lambda s: fast.predict(s), samples)
+            diff = max([np.abs(fast.predict(s) - np.vstack(sk(s))).max() 
+                        for s in samples])
+            print("{:>5} {:>8} {:>13.1f} {:>11.1f} {:>7.1f}x {:>10.1e}".format(
+                ndim, n, t_sk, t_fast, t_sk/t_fast, diff))
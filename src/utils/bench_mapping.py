@@ -0,0 +1,62 @@
+'''
+Compares the gaze mapping models of gaze_mapping.py on a synthetic
+calibration: pupil positions are a smooth nonlinear function of the
+target positions plus noise, and 5 samples per target are held out
+for the error, as in Calibrator.perform_estimation. Reports fit time,
+single-sample prediction latency and held-out error (% of the screen).
+
+usage (from the src folder): python3 utils/bench_mapping.py
+'''
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gaze_mapping as gm
+
+
+def pupil_positions(targets, ndim, rnd, noise):
+    x, y = targets[:,0], targets[:,1]
+    centers = [0.3 + 0.4*x + 0.05*np.sin(3*y) + 0.03*x*y,
+               0.3 + 0.35*y + 0.04*x**2 - 0.02*x*y,
+               0.8 + 0.1*(x-0.5)**2 + 0.1*(y-0.5)**2]
+    centers = np.vstack(centers[:ndim]).T
+    return centers + rnd.normal(0, noise, centers.shape)
+
+
+def synthetic_calibration(v, h, per_target, ndim, rnd, noise=0.002,
+                          jitter=0.002):
+    '''
+    Targets jitter by 'jitter' between samples, as the scene marker
+    positions detected frame by frame do
+    '''
+    train_x, train_y, test_x, test_y = [], [], [], []
+    for ty in np.linspace(0.09, 0.91, v):
+        for tx in np.linspace(0.055, 0.935, h):
+            targets = np.tile([tx, ty], (per_target, 1))
+            targets = targets + rnd.normal(0, jitter, targets.shape)
+            centers = pupil_positions(targets, ndim, rnd, noise)
+            train_x.append(centers[5:])
+            train_y.append(targets[5:])
+            test_x.append(centers[:5])
+            test_y.append(targets[:5])
+    return (np.vstack(train_x), np.vstack(train_y),
+            np.vstack(test_x), np.vstack(test_y))
+
+
+def target_ids(v, h, per_target):
+    '''
+    Target index of every training sample of synthetic_calibration
+    '''
+    return np.repeat(np.arange(v * h), per_target - 5)
+
+
+if __name__=="__main__":
+    rnd = np.random.RandomState(0)
+    for ndim in (2, 3):
+        for v, h, per_target in [(3, 3, 30), (3, 5, 60)]:
+            data = synthetic_calibration(v, h, per_target, ndim, rnd)
+            print("\n{} targets x {} samples, {}D".format(
+                v*h, per_target, ndim))
+            ids = target_ids(v, h, per_target)
+            print(gm.format_report(gm.compare_mappers(*data, groups=ids)))
@@ -0,0 +1,59 @@
+'''
+Micro-benchmark of the per-frame preprocessing cost.
+It compares the former per-step implementation (LUT rebuilt on every
+frame, one allocation per step plus a copy into shared memory) against
+the fused Preprocessor writing straight into a destination buffer.
+
+usage (from the src folder): python3 utils/bench_preprocess.py
+'''
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from preprocessing import Preprocessor
+
+
+def legacy(img, dst, gamma, color, flip):
+    lut = np.empty((1,256), np.uint8)
+    for i in range(256):
+        lut[0,i] = np.clip(pow(i/255.0, gamma) * 255.0, 0, 255)
+    img = cv2.LUT(img, lut)
+    if not color:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if flip:
+        img = cv2.flip(img, -1)
+    np.copyto(dst[:img.size].reshape(img.shape), img)
+
+
+def fused(prep, img, dst):
+    shape = prep.output_shape(img.shape)
+    prep.apply(img, dst[:int(np.prod(shape))].reshape(shape))
+
+
+def timeit(func, n):
+    func()
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n * 1000
+
+
+if __name__=="__main__":
+    n = 200
+    configs = [(1.0, True, False), (1.5, True, False),
+               (1.5, False, False), (1.5, False, True)]
+    print("{:>10} {:>6} {:>6} {:>5} {:>11} {:>11}".format(
+        'resolution', 'gamma', 'color', 'flip', 'legacy(ms)', 'fused(ms)'))
+    for w, h in [(640,480), (1280,720)]:
+        img = np.random.randint(0, 256, (h,w,3), dtype=np.uint8)
+        dst = np.empty(h*w*3, np.uint8)
+        for gamma, color, flip in configs:
+            prep = Preprocessor(gamma, color, flip)
+            t_old = timeit(lambda: legacy(img, dst, gamma, color, flip), n)
+            t_new = timeit(lambda: fused(prep, img, dst), n)
+            print("{:>10} {:>6} {:>6} {:>5} {:>11.3f} {:>11.3f}".format(
+                "{}x{}".format(w,h), gamma, str(color), str(flip),
+                t_old, t_new))
@@ -0,0 +1,51 @@
+'''
+Benchmark of the sparse (inducing-point) GP mapping against the exact
+GP as calibration data grows (targets x samples per target). Both are
+fitted on synthetic calibrations (see bench_mapping.py) and predict
+through FastGP, as in the live pipeline. Reports fit time, number of
+training/inducing points, single-sample prediction latency and the
+held-out error (% of the screen).
+
+usage (from the src folder): python3 utils/bench_sparse_gp.py
+'''
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gaze_mapping as gm
+from bench_mapping import synthetic_calibration, target_ids
+
+
+def run(name, data, ids):
+    X, Y, X_test, Y_test = data
+    mapper = gm.create_mapper(name)
+    start = time.perf_counter()
+    mapper.fit(X, Y, ids)
+    fit_time = time.perf_counter() - start
+    predictor = gm.pair_predictor([mapper, mapper])
+    start = time.perf_counter()
+    pred = np.vstack([predictor.predict([x, x])[0] for x in X_test])
+    predict_time = (time.perf_counter() - start) / len(X_test)
+    error = np.mean(np.linalg.norm(pred - Y_test, axis=1)) * 100
+    return fit_time * 1000, len(predictor.X) // 2, predict_time * 1e6, error
+
+
+if __name__=="__main__":
+    rnd = np.random.RandomState(0)
+    for name in ('gp', 'sgp'): # warm-up (imports)
+        run(name, synthetic_calibration(3, 3, 10, 2, rnd),
+            target_ids(3, 3, 10))
+    print("{:>8} {:>8} {:>5} {:>10} {:>7} {:>12} {:>9}".format(
+        'grid', 'samples', 'model', 'fit(ms)', 'points', 'predict(us)',
+        'error(%)'))
+    for v, h in [(3, 3), (5, 5)]:
+        for per_target in (30, 60, 120, 240):
+            data = synthetic_calibration(v, h, per_target, 2, rnd)
+            for name in ('gp', 'sgp'):
+                fit, points, predict, error = run(
+                    name, data, target_ids(v, h, per_target))
+                print("{:>8} {:>8} {:>5} {:>10.1f} {:>7} {:>12.1f} "
+                      "{:>9.3f}".format('{}x{}'.format(v, h), len(data[0]),
+                                       name, fit, points, predict, error))
@@ -0,0 +1,102 @@
+'''
+Startup benchmark. It reports, each one measured in a fresh interpreter:
+- the import time of the pEyeTracker modules (and of the heavy
+  dependencies they used to load eagerly)
+- time-to-first-frame: from spawning the interpreter (so its own
+  startup is included) to the first frame published by an eye camera
+  process, for a uvc device index or a video file. Both ends are read
+  from time.monotonic(), which is system-wide.
+
+usage (from the src folder):
+    python3 utils/bench_startup.py [source] [--runs N]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = ['PySide2.QtQuick', 'uvc', 'sklearn.gaussian_process',
+           'pupil_detectors', 'matplotlib.pyplot', 'camera_core', 'camera_proc',
+           'eye', 'scene', 'calibration', 'calibration_hmd']
+
+IMPORT_SCRIPT = '''
+import time
+t = time.perf_counter()
+import {}
+print(time.perf_counter() - t)
+'''
+
+FIRST_FRAME_SCRIPT = '''
+import time
+import eye
+cam = eye.EyeCamera('left')
+cam.preview = False
+cam.persistent = False
+source = {source!r}
+if source.isdigit():
+    cam.set_source(int(source))
+else:
+    cam.set_video_file(source)
+    cam.play_video_file()
+ok = cam.frame_buffer.wait(-1, 10.0)
+print(time.monotonic() if ok else -1)
+cam.stop(video_file=not source.isdigit())
+'''
+
+
+def run(script):
+    out = subprocess.run([sys.executable, '-c', script], cwd=SRC,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True)
+    lines = out.stdout.strip().split('\n')
+    try:
+        return float(lines[-1])
+    except ValueError:
+        return None
+
+
+def first_frame_time(script):
+    '''
+    Seconds from spawning the interpreter to its first frame
+    '''
+    start = time.monotonic()
+    end = run(script)
+    if end is None or end < 0:
+        return None
+    return end - start
+
+
+def median(values):
+    values = sorted([v for v in values if v is not None and v >= 0])
+    if not values:
+        return None
+    return values[len(values)//2]
+
+
+def report(name, values):
+    value = median(values)
+    if value is None:
+        print("{:>26} {:>10}".format(name, 'n/a'))
+    else:
+        print("{:>26} {:>10.1f}".format(name, value * 1000))
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='startup benchmark')
+    parser.add_argument('source', nargs='?', default=None,
+                        help='uvc device index or video file')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:>26} {:>10}".format('import', 'time(ms)'))
+    for module in MODULES:
+        values = [run(IMPORT_SCRIPT.format(module)) for _ in range(args.runs)]
+        report(module, values)
+    if args.source is not None:
+        script = FIRST_FRAME_SCRIPT.format(source=args.source)
+        values = [first_frame_time(script) for _ in range(args.runs)]
+        print()
+        report('time-to-first-frame', values)
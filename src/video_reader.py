@@ -0,0 +1,120 @@
+import cv2
+import queue
+import time
+from threading import Thread, Lock
+
+
+class PrefetchReader():
+
+    '''
+    Decodes a video file ahead of its consumer in a dedicated thread,
+    so decoding overlaps with image processing. Decoded frames wait in
+    a bounded queue (the decoder blocks when it is full), which means:
+    - no frame is skipped while the consumer pauses or slows down
+    - memory use is limited to 'size' frames
+    Seeking (by frame index or timestamp) discards whatever has
+    been decoded ahead and restarts decoding from the new position.
+    '''
+
+    def __init__(self, filename, size=8):
+        self.cap = cv2.VideoCapture(filename)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.nframes = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.queue = queue.Queue(size)
+        self.lock = Lock()
+        self.generation = 0
+        self.seek_to = None
+        self.running = False
+        self.finished = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._decode, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def _decode(self):
+        index = 0
+        while self.running:
+            with self.lock:
+                generation = self.generation
+                if self.seek_to is not None:
+                    index = self.seek_to
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                    self.seek_to = None
+            ret, frame = self.cap.read()
+            item = None
+            if ret:
+                timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                item = (index, timestamp, frame)
+                index += 1
+            if not self._put((generation, item)):
+                continue
+            if not ret:
+                self._wait_seek()
+
+    def _put(self, item):
+        '''
+        Blocks while the queue is full. Returns False if the item
+        became stale (seek or close) in the meantime
+        '''
+        while self.running and item[0] == self.generation:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _wait_seek(self):
+        '''
+        At the end of the file, decoding only resumes after a seek
+        '''
+        generation = self.generation
+        while self.running and generation == self.generation:
+            with self.lock:
+                if self.seek_to is not None:
+                    return
+            time.sleep(0.05)
+
+    def read(self, timeout=None):
+        '''
+        Returns the next (index, timestamp, frame), or None at the end
+        of the file (finished) or when nothing arrives within 'timeout'
+        '''
+        while True:
+            try:
+                generation, item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if generation != self.generation:
+                continue
+            self.finished = item is None
+            return item
+
+    def seek(self, frame=None, timestamp=None):
+        if frame is None:
+            frame = int(round(timestamp * self.fps))
+        frame = max(0, frame)
+        if self.nframes > 0:
+            frame = min(frame, self.nframes - 1)
+        with self.lock:
+            self.generation += 1
+            self.seek_to = frame
+            self.finished = False
+        self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.running = False
+        self._drain()
+        if self.thread is not None:
+            self.thread.join(1)
+        self.cap.release()
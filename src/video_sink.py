@@ -0,0 +1,76 @@
+from PySide2.QtCore import QObject, Signal, Slot, Property
+from PySide2.QtGui import QImage
+from PySide2.QtQuick import QQuickPaintedItem
+
+# Format_BGR888 is only available from Qt 5.14 on
+BGR888 = getattr(QImage, 'Format_BGR888', None)
+
+
+class VideoSink(QQuickPaintedItem):
+
+    '''
+    QML item that paints the preview frames of a camera, e.g.:
+
+        VideoSink { camera: leftEyeCam; anchors.fill: parent }
+
+    Frames come from the camera's frame buffer as numpy arrays (BGR or
+    gray) and are painted as they are, with no RGB conversion, QPixmap
+    upload or image provider URL. It repaints only when a frame with a
+    new sequence number is available.
+    '''
+
+    camera_changed = Signal()
+    new_frame = Signal()
+
+    def __init__(self, parent=None):
+        QQuickPaintedItem.__init__(self, parent)
+        self._camera = None
+        self._frame = None
+        self.seq = -1
+
+    def get_camera(self):
+        return self._camera
+
+    def set_camera(self, camera):
+        if camera is self._camera:
+            return
+        if self._camera is not None:
+            self._camera.update_image.disconnect(self.update_frame)
+            self._camera.detach_sink()
+        self._camera = camera
+        self.seq = -1
+        if camera is not None:
+            camera.attach_sink()
+            camera.update_image.connect(self.update_frame)
+        self.camera_changed.emit()
+
+    camera = Property(QObject, get_camera, set_camera, notify=camera_changed)
+
+    @Slot()
+    def update_frame(self):
+        frame = self._camera.get_preview_frame()
+        if frame is None or frame[1] == self.seq:
+            return
+        self._frame, self.seq = frame
+        self.update()
+        self.new_frame.emit()
+
+    @Slot()
+    def clear(self):
+        self._frame = None
+        self.seq = -1
+        self.update()
+
+    def paint(self, painter):
+        img = self._frame
+        if img is None:
+            return
+        h, w = img.shape[:2]
+        if len(img.shape) == 2:
+            qimg = QImage(img.data, w, h, w, QImage.Format_Grayscale8)
+        elif BGR888 is not None:
+            qimg = QImage(img.data, w, h, 3*w, BGR888)
+        else:
+            qimg = QImage(img.data, w, h, 3*w, QImage.Format_RGB888)
+            qimg = qimg.rgbSwapped()
+        painter.drawImage(self.boundingRect(), qimg)
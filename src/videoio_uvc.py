@@ -1,6 +1,6 @@
 import subprocess
 import re
-import uvc
+from devices import inventory
 from PySide2.QtCore import QObject, Signal, Slot, Property
 
 class VideoIO_UVC(QObject):
@@ -26,7 +26,7 @@ class VideoIO_UVC(QObject):
     
     def read_inputs(self):
         self.cameras = {}
-        dev_list = uvc.device_list()
+        dev_list = inventory.device_list()
         for i in range(len(dev_list)):
             name = dev_list[i]['name']
             self.cameras[i] = name
@@ -34,12 +34,20 @@ class VideoIO_UVC(QObject):
 
     @Property('QVariantList')
     def camera_list(self):
+        '''
+        Cached device list, kept up to date by the inventory watcher
+        '''
         self.read_inputs()
         cameras = ["{}: {}".format(i,self.cameras[i]) for i in self.cameras.keys()]
         opts = ['No feed', 'File...']
         return opts + cameras
 
 
+    @Slot()
+    def refresh_cameras(self):
+        inventory.refresh()
+        self.read_inputs()
+
     def get_camera_name(self, source):
         return self.cameras[source]
 
@@ -54,6 +62,20 @@ class VideoIO_UVC(QObject):
         self.leye.toggle_3D()
         self.reye.toggle_3D()
 
+    @Slot()
+    def toggle_roi(self):
+        self.leye.toggle_roi()
+        self.reye.toggle_roi()
+
+    @Slot(bool)
+    def set_preview_visible(self, visible):
+        '''
+        Previews are skipped while the main window is hidden or minimized
+        '''
+        self.scene.set_preview_visible(visible)
+        self.leye.set_preview_visible(visible)
+        self.reye.set_preview_visible(visible)
+
     @Slot(bool)
     def stop_scene_cam(self, video_file):
         self.scene.stop(video_file)
@@ -0,0 +1,101 @@
+import os
+import signal
+import sys
+import threading
+import time
+import numpy as np
+from multiprocessing import Process
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from frame_buffer import FrameBuffer, FrameWaiter
+
+MODE = (64, 48, 30)
+
+
+def _reader(frame_buffer):
+    reader = frame_buffer.add_reader()
+    seq = -1
+    while True:
+        if frame_buffer.wait(seq, 1.0, reader):
+            seq = frame_buffer.latest_seq()
+
+
+def test_commit_does_not_wait_for_a_stalled_reader():
+    frame_buffer = FrameBuffer(MODE)
+    reader = Process(target=_reader, args=(frame_buffer,), daemon=True)
+    reader.start()
+    try:
+        img = np.zeros((MODE[1], MODE[0], 3), np.uint8)
+        frame_buffer.write(img, time.monotonic())
+        time.sleep(0.2)   # --> the reader sleeps in wait()
+        os.kill(reader.pid, signal.SIGSTOP)
+        worst = 0.0
+        for _ in range(200):
+            start = time.perf_counter()
+            frame_buffer.write(img, time.monotonic())
+            worst = max(worst, time.perf_counter() - start)
+        assert worst < 0.005
+    finally:
+        os.kill(reader.pid, signal.SIGKILL)
+        reader.join()
+
+
+def test_registered_reader_wakes_once_per_frame():
+    frame_buffer = FrameBuffer(MODE)
+    waiter = FrameWaiter()
+    woken = []
+
+    def read():
+        while len(woken) < 20:
+            if waiter.wait(frame_buffer, 1.0):
+                woken.append(waiter.last_seq)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    img = np.zeros((MODE[1], MODE[0], 3), np.uint8)
+    while thread.is_alive():
+        frame_buffer.write(img, time.monotonic())
+        time.sleep(0.01)
+    thread.join()
+    waiter.close()
+    assert woken == sorted(set(woken))
+    assert waiter.skipped == woken[-1] - woken[0] - len(woken) + 1
+
+
+def test_waiter_follows_a_replaced_buffer():
+    waiter = FrameWaiter()
+    img = np.zeros((MODE[1], MODE[0], 3), np.uint8)
+    old = FrameBuffer(MODE)
+    for _ in range(10):
+        old.write(img, time.monotonic())
+    assert waiter.wait(old, 0.1)
+    new = FrameBuffer(MODE)
+    new.write(img, time.monotonic())
+    assert waiter.wait(new, 0.1)
+    assert waiter.last_seq == 0
+    assert old.readers[0] == 0
+    waiter.close()
+
+
+def test_wait_times_out_without_frames():
+    frame_buffer = FrameBuffer(MODE)
+    reader = frame_buffer.add_reader()
+    start = time.monotonic()
+    assert not frame_buffer.wait(-1, 0.05, reader)
+    assert not frame_buffer.wait(-1, 0.05)
+    assert time.monotonic() - start < 0.5
+    frame_buffer.remove_reader(reader)
+
+
+def test_read_at_returns_the_frame_of_a_timestamp():
+    frame_buffer = FrameBuffer(MODE, nslots=4)
+    times = []
+    for i in range(6):
+        img = np.full((MODE[1], MODE[0], 3), i, np.uint8)
+        times.append(100.0 + i / 30.0)
+        frame_buffer.write(img, times[-1])
+    img, seq, timestamp = frame_buffer.read_at(times[3])
+    assert (seq, timestamp) == (3, times[3])
+    assert (img == 3).all()
+    assert frame_buffer.read_at(times[1]) is None   # --> overwritten
+    assert frame_buffer.read_at(99.0) is None
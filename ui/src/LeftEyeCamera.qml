@@ -5,6 +5,7 @@ import QtQuick.Controls.Universal 2.2
 import QtGraphicalEffects 1.0
 import QtQuick.Dialogs 1.2
 import QtQuick.Layouts 1.0
+import pEyeTracker 1.0
 
 GroupBox {
     id: leftEyeGroup
@@ -64,7 +65,7 @@ GroupBox {
                 leftEyeGroup.video?
                             camManager.stop_leye_cam(true):
                             camManager.stop_leye_cam(false);
-                eyeImage.source = "../imgs/novideo.png";
+                eyeVideo.clear();
             }
             else {
                 leftEyeGroup.video = false;
@@ -95,7 +96,6 @@ GroupBox {
 
     Image {
         id: eyeImage
-        property bool counter: false
         anchors.rightMargin: -10
         anchors.leftMargin: -10
         anchors.bottomMargin: -10
@@ -103,17 +103,11 @@ GroupBox {
         source: "../imgs/novideo.png"
         anchors.fill: parent
         fillMode: Image.Stretch
-        cache: false
 
-        signal updateImage()
-        Component.onCompleted: leftEyeCam.update_image.connect(updateImage);
-
-        Connections {
-            target: eyeImage
-            function onUpdateImage() {
-                eyeImage.counter = !eyeImage.counter; //hack to force update
-                eyeImage.source = "image://leyeimg/eye" + eyeImage.counter;
-            }
+        VideoSink {
+            id: eyeVideo
+            anchors.fill: parent
+            camera: leftEyeCam
         }
     }
 
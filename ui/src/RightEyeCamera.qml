@@ -5,6 +5,7 @@ import QtQuick.Controls.Universal 2.2
 import QtGraphicalEffects 1.0
 import QtQuick.Dialogs 1.2
 import QtQuick.Layouts 1.0
+import pEyeTracker 1.0
 
 GroupBox {
     id: rightEyeGroup
@@ -64,7 +65,7 @@ GroupBox {
                 rightEyeGroup.video?
                             camManager.stop_reye_cam(true):
                             camManager.stop_reye_cam(false);
-                reyeImage.source = "../imgs/novideo.png";
+                reyeVideo.clear();
             }
             else {
                 rightEyeGroup.video = false;
@@ -95,7 +96,6 @@ GroupBox {
 
     Image {
         id: reyeImage
-        property bool counter: false
         anchors.rightMargin: -10
         anchors.leftMargin: -10
         anchors.bottomMargin: -10
@@ -103,17 +103,11 @@ GroupBox {
         source: "../imgs/novideo.png"
         anchors.fill: parent
         fillMode: Image.Stretch
-        cache: false
 
-        signal updateImage()
-        Component.onCompleted: rightEyeCam.update_image.connect(updateImage);
-
-        Connections {
-            target: reyeImage
-            function onUpdateImage() {
-                reyeImage.counter = !reyeImage.counter; //hack to force update
-                reyeImage.source = "image://reyeimg/eye" + reyeImage.counter;
-            }
+        VideoSink {
+            id: reyeVideo
+            anchors.fill: parent
+            camera: rightEyeCam
         }
     }
 
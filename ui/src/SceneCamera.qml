@@ -5,6 +5,7 @@ import QtQuick.Controls.Universal 2.2
 import QtGraphicalEffects 1.0
 import QtQuick.Dialogs 1.2
 import QtQuick.Layouts 1.0
+import pEyeTracker 1.0
 
 
     GroupBox {
@@ -41,7 +42,7 @@ import QtQuick.Layouts 1.0
                     camGroup.video?
                                 camManager.stop_scene_cam(true) :
                                 camManager.stop_scene_cam(false);
-                    sceneImage.source = "../imgs/novideo.png";
+                    sceneVideo.clear();
                 }
                 else {
                     camGroup.video = false;
@@ -72,7 +73,6 @@ import QtQuick.Layouts 1.0
 
         Image {
             id: sceneImage
-            property bool counter: false
             height: 433
             anchors.rightMargin: -10
             anchors.leftMargin: -10
@@ -81,17 +81,16 @@ import QtQuick.Layouts 1.0
             anchors.fill: parent
             source: "../imgs/novideo.png"
             fillMode: Image.Stretch
-            cache: false
 
-            signal updateImage()
-            Component.onCompleted: sceneCam.update_image.connect(updateImage);
+            VideoSink {
+                id: sceneVideo
+                anchors.fill: parent
+                camera: sceneCam
+            }
 
             Connections {
-                target: sceneImage
-                function onUpdateImage() {
-                    sceneImage.counter = !sceneImage.counter; //hack to force update
-                    sceneImage.source = "image://sceneimg/scene" + sceneImage.counter;
-                    var gazePoints = calibControl.predict;
+                target: calibControl
+                function onGaze_updated(gazePoints) {
                     //@disable-check M126
                     if (gazePoints[0] != -1.0 || gazePoints[2] != -1.0) {
                         //console.log('GP: ' + gazePoints[0] +' '+ gazePoints[1] + ' '+ gazePoints[2] + ' ' + gazePoints[3]);
@@ -15,6 +15,10 @@ Window {
     title: qsTr("pEye Tracker")
     Universal.theme: Universal.Dark
     Universal.accent: Universal.Lime
+    onVisibilityChanged: {
+        camManager.set_preview_visible(visibility !== Window.Minimized &&
+                                       visibility !== Window.Hidden);
+    }
     // @disable-check M16
     onClosing: {
         console.log("closing window");